@@ -1,12 +1,19 @@
-from django.contrib import admin
+from itertools import islice
+
+from django.contrib import admin, messages
 # from import_export.admin import ImportExportModelAdmin
 # from import_export import resources
 from django.contrib.auth.admin import UserAdmin
 from django import forms
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .imports import COLUMNS, PatientImportError, import_patients, read_rows
 from .models import *
 
 # from django.contrib.auth.models import User  # Default Django User model
-from django.core.cache import cache
 from .models import User as CustomUser  # Your custom User model
 
 
@@ -58,13 +65,7 @@ class CustomUserAdmin(UserAdmin):
     # Optional: Make password readonly in the admin panel to prevent unwanted errors
     readonly_fields = ("password",)
 
-    def save_model(self, request, obj, form, change):
-        if change:
-            original = User.objects.get(pk=obj.pk)
-            if original.role != obj.role:
-                cache.delete(f"user_token_{obj.pk}")  # Invalidate token
-        
-        super().save_model(request, obj, form, change)
+    # Token revocation on role/active changes happens in api.signals for every save path
 
 admin.site.register(User, CustomUserAdmin)
 
@@ -87,20 +88,74 @@ class LabReportInline(admin.TabularInline):  # You can use StackedInline for a d
     fields = ['report', 'report_type', 'uploaded_at']  # Customize the fields you want to display
     readonly_fields = ['uploaded_at']  # Make the uploaded_at field read-only
 
+class PatientImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or XLSX")
+
+
 # Register the PatientProfile model with the LabReport inline
 @admin.register(PatientProfile)
 class PatientProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'height', 'weight', 'bmi', 'created_at']
     inlines = [LabReportInline]  # Add the LabReportInline here
 
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='api_patientprofile_import'),
+        ] + super().get_urls()
+
+    # Bulk import of a clinic's patients (see api/imports.py); linked from the change list
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = PatientImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            limit = settings.PATIENT_IMPORT_ADMIN_MAX_ROWS
+            try:
+                rows = list(islice(read_rows(upload.file, upload.name), limit + 1))
+                if len(rows) > limit:
+                    raise PatientImportError(
+                        f"The admin imports at most {limit} rows; use manage.py import_patients for larger files"
+                    )
+                # Small enough to hash in this process; a pool per request would cost more than it saves
+                result = import_patients(rows, workers=0)
+            except PatientImportError as exc:
+                form.add_error('file', str(exc))
+            else:
+                self.message_user(
+                    request,
+                    f"Imported {result['created']} patients ({result['rows_per_second']:.0f} rows/s), "
+                    f"skipped {len(result['errors'])} row(s).",
+                    messages.SUCCESS,
+                )
+                for line, message in result['errors'][:20]:
+                    self.message_user(request, f"Line {line}: {message}", messages.WARNING)
+                return redirect('admin:api_patientprofile_changelist')
+        return TemplateResponse(request, 'admin/api/patientprofile/import.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import patients',
+            'form': form,
+            'columns': COLUMNS,
+            'max_rows': settings.PATIENT_IMPORT_ADMIN_MAX_ROWS,
+        })
+
 # Register LabReport model in admin
 @admin.register(LabReport)
 class LabReportAdmin(admin.ModelAdmin):
     list_display = ['patient', 'report', 'report_type', 'uploaded_at']
     search_fields = ['patient__first_name', 'patient__last_name']
 
+# Working hours are edited on the doctor's page
+class WorkingHoursInline(admin.TabularInline):
+    model = WorkingHours
+    extra = 0
+
+@admin.register(DoctorProfile)
+class DoctorProfileAdmin(admin.ModelAdmin):
+    inlines = [WorkingHoursInline]
+
 admin.site.register(Department)
-admin.site.register(DoctorProfile)
 # admin.site.register(PatientProfile)
 admin.site.register(PreVisitQuestion)
 admin.site.register(PreVisitReport)
@@ -0,0 +1,109 @@
+"""
+Async read path for the busiest GET endpoints, mounted under /api/async/.
+
+Served by backend/asgi.py, these views do not hold a worker thread while a
+request waits: authentication checks the JWT version with the async cache API
+(see VersionedJWTAuthentication.aauthenticate), doctor directory hits come
+straight from the async cache, and pre-visit reports are fetched with the async
+ORM. List pages reuse the matching viewset's scoping, filters, pagination and
+serializer, so their JSON is identical to the sync endpoints; that work runs
+through sync_to_async, the same thread Django's async ORM uses for queries.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .authentication import VersionedJWTAuthentication
+from .caching import DOCTOR_DIRECTORY, acached, cache_is_shared
+from .models import PreVisitReport
+from .serializers import PreVisitReportSerializer
+from .views import AppointmentViewSet, DoctorProfileViewSet, LabReportViewSet, directory_cache_key
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+async def _authenticate(request):
+    result = await VersionedJWTAuthentication().aauthenticate(request)
+    if result is not None:
+        return result[0]
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def async_read_view(view):
+    """GET only, authenticated; `view(request, user, ...)` returns a response. Errors mirror DRF's."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return _json({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            user = await _authenticate(request)
+            if user is None:
+                raise exceptions.NotAuthenticated()
+            return await view(request, user, *args, **kwargs)
+        except exceptions.APIException as exc:
+            # Like the sync views, whose first authenticator (session) has no
+            # WWW-Authenticate header, authentication failures are 403s
+            status = 403 if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)) \
+                else exc.status_code
+            data = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail}
+            return _json(data, status=status)
+    return wrapper
+
+
+def _viewset_list(viewset_class, request, user):
+    """Response data of `viewset_class`'s list action for `user`."""
+    drf_request = Request(request)
+    drf_request.user = user
+    view = viewset_class(request=drf_request, args=(), kwargs={}, action='list', format_kwarg=None)
+    if hasattr(view, 'compiled_list_data'):
+        data = view.compiled_list_data()
+        if data is not None:
+            return data
+    queryset = view.filter_queryset(view.get_queryset())
+    page = view.paginate_queryset(queryset)
+    if page is None:
+        return list(view.get_serializer(queryset, many=True).data)
+    return view.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+
+@async_read_view
+async def appointment_list(request, user):
+    return _json(await sync_to_async(_viewset_list)(AppointmentViewSet, request, user))
+
+
+@async_read_view
+async def lab_report_list(request, user):
+    return _json(await sync_to_async(_viewset_list)(LabReportViewSet, request, user))
+
+
+@async_read_view
+async def doctor_list(request, user):
+    async def build():
+        return await sync_to_async(_viewset_list)(DoctorProfileViewSet, request, user)
+
+    if not settings.DOCTOR_DIRECTORY_CACHE_ENABLED or not cache_is_shared():
+        return _json(await build())
+    # Same cache entries as DoctorProfileViewSet.list
+    data, hit = await acached(
+        DOCTOR_DIRECTORY, directory_cache_key(request, 'all'), build, timeout=settings.DOCTOR_DIRECTORY_CACHE_TIMEOUT
+    )
+    response = _json(data)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+@async_read_view
+async def previsit_report_detail(request, user, appointment):
+    try:
+        report = await PreVisitReport.objects.aget(appointment__id=appointment)
+    except PreVisitReport.DoesNotExist:
+        return _json({"detail": "No report found for this appointment."}, status=404)
+    return _json(PreVisitReportSerializer(report).data)
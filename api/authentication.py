@@ -0,0 +1,122 @@
+"""
+JWT authentication with per-user token versions.
+
+Every token issued by MyTokenObtainPairSerializer carries a `ver` claim copied
+from the cache key `user_token_<id>`. Bumping that counter (on role change or
+deactivation, see api/signals.py) revokes every outstanding token at once.
+The counters only mean something if every worker sees the same cache, so with
+a per-process cache no `ver` claim is issued or checked.
+
+With JWT_STATELESS_READS enabled, safe-method requests whose token version is
+current get a ClaimsUser built from the token alone, skipping the User query.
+Writes, and any request whose version cannot be confirmed from the cache, load
+the user from the database as usual. `aauthenticate` does the same for the
+async views in api/async_views.py.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .caching import cache_is_shared
+
+TOKEN_VERSION_CLAIM = 'ver'
+# Claims that must be present for a token to be trusted without a database read
+STATELESS_CLAIMS = ('role', 'username', TOKEN_VERSION_CLAIM)
+
+
+def token_version_key(user_id):
+    return f"user_token_{user_id}"
+
+
+def _fresh_version():
+    # Time based, so a counter lost from the cache is never re-created with a
+    # value that an old token could still carry.
+    return time.time_ns() // 1000
+
+
+def current_token_version(user_id):
+    """
+    Version new tokens for `user_id` are issued with, creating it if needed.
+    None with a per-process cache, where other workers would not know it.
+    """
+    if not cache_is_shared():
+        return None
+    cache.add(token_version_key(user_id), _fresh_version(), timeout=None)
+    return cache.get(token_version_key(user_id))
+
+
+def revoke_user_tokens(user_id):
+    """Invalidate every access and refresh token issued to `user_id` so far."""
+    try:
+        cache.incr(token_version_key(user_id))
+    except ValueError:
+        cache.set(token_version_key(user_id), _fresh_version(), timeout=None)
+
+
+class ClaimsUser(TokenUser):
+    """Read-only user built from access token claims."""
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def profile_id(self):
+        return self.token.get('profile_id')
+
+
+class VersionedJWTAuthentication(JWTAuthentication):
+    def claims_user(self, validated_token, cached_version):
+        """
+        Check the token against the cached version; returns a ClaimsUser when the
+        request may skip the database, None when the user must be loaded.
+        """
+        token_version = validated_token.get(TOKEN_VERSION_CLAIM)
+        if token_version is None or cached_version is None or not cache_is_shared():
+            return None
+        if token_version != cached_version:
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        if (
+            settings.JWT_STATELESS_READS
+            and self.request_method in SAFE_METHODS
+            and all(claim in validated_token for claim in STATELESS_CLAIMS)
+        ):
+            return ClaimsUser(validated_token)
+        return None
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        cached_version = cache.get(token_version_key(user_id)) if user_id is not None else None
+        return self.claims_user(validated_token, cached_version) or super().get_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        cached_version = await cache.aget(token_version_key(user_id)) if user_id is not None else None
+        return (
+            self.claims_user(validated_token, cached_version)
+            or await sync_to_async(JWTAuthentication.get_user)(self, validated_token)
+        )
+
+    def authenticate(self, request):
+        # Authenticator instances are created per request, see APIView.get_authenticators
+        self.request_method = request.method
+        return super().authenticate(request)
+
+    async def aauthenticate(self, request):
+        """Async `authenticate` for a plain Django request; (user, token) or None."""
+        self.request_method = request.method
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
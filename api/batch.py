@@ -0,0 +1,148 @@
+"""
+Batch appointment writes.
+
+The whole batch is validated up front with a fixed number of queries (targets,
+referenced users, slot conflicts), then written with one bulk_create and one
+bulk_update inside a single transaction (plus one UPDATE parking the rows
+that hand their slot to another row, such as a swap). Either every item is applied or none
+is, and the caller gets a result (or errors) per item. Bulk writes send no
+signals, so the daily statistics are updated here as well.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+
+from .models import Appointment, AppointmentDailyStat, User
+from .serializers import AppointmentBatchItemSerializer
+from .slots import SlotUnavailable
+from .stats import appointment_key, apply_deltas
+
+CREATE = AppointmentBatchItemSerializer.CREATE
+STATUS = AppointmentBatchItemSerializer.STATUS
+
+
+def _check_participants(op, user, roles):
+    errors = {}
+    if roles.get(op['patient']) is None:
+        errors['patient'] = "Patient not found."
+    elif user.role == User.Role.PATIENT and op['patient'] != user.id:
+        errors['patient'] = "You can only book appointments for yourself."
+    if roles.get(op['doctor']) != User.Role.DOCTOR:
+        errors['doctor'] = "Doctor not found."
+    return errors
+
+
+def apply_batch(user, items, scope):
+    """
+    Validate and apply `items` (raw operation dicts) for `user`. `scope` is the
+    queryset of appointments the user may modify. Returns (ok, results).
+    """
+    ops, errors = [], {}
+    for index, item in enumerate(items):
+        serializer = AppointmentBatchItemSerializer(data=item)
+        if serializer.is_valid():
+            ops.append(serializer.validated_data)
+        else:
+            ops.append(None)
+            errors[index] = serializer.errors
+
+    valid = [(index, op) for index, op in enumerate(ops) if op is not None]
+    targets = scope.in_bulk([op['id'] for _, op in valid if op['op'] != CREATE])
+    roles = dict(
+        User.objects
+        .filter(id__in={op[field] for _, op in valid if op['op'] == CREATE for field in ('patient', 'doctor')})
+        .values_list('id', 'role')
+    )
+
+    # Resulting state of every touched appointment, in batch order
+    planned, seen_ids = {}, set()
+    for index, op in valid:
+        if op['op'] == CREATE:
+            problems = _check_participants(op, user, roles)
+            if problems:
+                errors[index] = problems
+                continue
+            planned[index] = Appointment(
+                patient_id=op['patient'], doctor_id=op['doctor'], time=op['time'],
+                status=op.get('status', 'pending'), description=op.get('description'),
+            )
+            continue
+
+        appointment = targets.get(op['id'])
+        if appointment is None:
+            errors[index] = {'id': "Appointment not found."}
+        elif op['id'] in seen_ids:
+            errors[index] = {'id': "Appointment appears more than once in this batch."}
+        else:
+            seen_ids.add(op['id'])
+            if op['op'] == STATUS:
+                appointment.status = op['status']
+            else:
+                appointment.time = op['time']
+            planned[index] = appointment
+
+    # Slot conflicts, both inside the batch and against stored appointments
+    active = {
+        index: appointment for index, appointment in planned.items()
+        if appointment.status not in Appointment.RELEASED_STATUSES
+    }
+    held = {
+        (doctor_id, starts_at): pk
+        for pk, doctor_id, starts_at in Appointment.objects
+        .filter(
+            doctor_id__in={a.doctor_id for a in active.values()},
+            time__in={a.time for a in active.values()},
+        )
+        .exclude(status__in=Appointment.RELEASED_STATUSES)
+        .exclude(pk__in=seen_ids)
+        .values_list('pk', 'doctor_id', 'time')
+    } if active else {}
+    claimed = {}
+    for index, appointment in active.items():
+        slot = (appointment.doctor_id, appointment.time)
+        if slot in held or slot in claimed:
+            errors[index] = {'time': "This time slot is already booked for the selected doctor."}
+        else:
+            claimed[slot] = index
+
+    if errors:
+        return False, [
+            {'index': index, 'errors': errors[index]} if index in errors else {'index': index, 'status': 'valid'}
+            for index in range(len(items))
+        ]
+
+    creates = [a for a in planned.values() if a.pk is None]
+    updates = [a for a in planned.values() if a.pk is not None]
+    deltas = Counter()
+    for appointment in planned.values():
+        deltas[appointment_key(appointment.doctor_id, appointment.time, appointment.status)] += 1
+        if appointment.pk is not None:
+            deltas[appointment_key(*(appointment.get_original(name) for name in ('doctor', 'time', 'status')))] -= 1
+    # Rows giving up a slot that another row of the batch takes (e.g. two
+    # appointments swapping times). The slot constraint is checked row by row
+    # during the UPDATE, so these are parked in a released status first.
+    parked = []
+    for appointment in updates:
+        taker = claimed.get((appointment.get_original('doctor'), appointment.get_original('time')))
+        if taker is not None and planned[taker] is not appointment \
+                and appointment.get_original('status') not in Appointment.RELEASED_STATUSES:
+            parked.append(appointment.pk)
+    try:
+        with transaction.atomic():
+            if parked:
+                Appointment.objects.filter(pk__in=parked).update(status=Appointment.RELEASED_STATUSES[0])
+            # Updates first, so slots released by cancellations can be re-booked
+            Appointment.objects.bulk_update(updates, ['status', 'time'])
+            Appointment.objects.bulk_create(creates)
+            apply_deltas(AppointmentDailyStat, deltas)
+    except IntegrityError:
+        # Lost a race with a concurrent booking; the constraint rolled everything back
+        raise SlotUnavailable()
+
+    return True, [
+        {
+            'index': index, 'op': ops[index]['op'], 'id': planned[index].pk,
+            'status': planned[index].status, 'time': planned[index].time,
+        }
+        for index in range(len(items))
+    ]
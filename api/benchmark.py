@@ -0,0 +1,256 @@
+"""
+Helpers shared by the `bench_*` management commands.
+
+Benchmarks never touch the configured database: `scratch_database()` builds a
+throwaway copy of the schema the same way the test runner does, and the seed
+helpers fill it with `bulk_create` so signals and password hashing stay out of
+the measurements.
+"""
+import math
+import random
+from math import gcd
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Appointment, Department, DoctorProfile, LabReport, PatientProfile, PreVisitQuestion, PreVisitReport, ReportType,
+    User,
+)
+
+# Vocabulary for synthetic pre-visit answers
+SYMPTOMS = [
+    'chest pain', 'shortness of breath', 'headache', 'dizziness', 'nausea', 'fever', 'cough', 'fatigue',
+    'back pain', 'joint pain', 'palpitations', 'rash', 'blurred vision', 'sore throat', 'abdominal pain',
+    'insomnia', 'swelling', 'numbness', 'weight loss', 'anxiety',
+]
+DURATIONS = ['since yesterday', 'for a week', 'for two weeks', 'for months', 'on and off', 'after exercise']
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def percentile(samples, p):
+    """Nearest-rank `p`th percentile of `samples`."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def timed(func, repeat=5):
+    """Run `func` `repeat` times and return the median wall time in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def explain(queryset):
+    """SQLite query plan for `queryset`, one step per line."""
+    with connection.cursor() as cursor:
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def _batched(objects, model, batch_size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed_hospital(
+    departments=10, doctors=200, patients=20000, appointments=100000,
+    lab_reports=20000, report_types=10, days=365, batch_size=5000, seed=0, previsit_reports=0,
+):
+    """
+    Fill the current database with a synthetic hospital. Returns a dict of the
+    primary keys created so benchmarks can pick realistic filter values.
+    """
+    rng = random.Random(seed)
+    start = timezone.now() - timedelta(days=days // 2)
+    statuses = [choice for choice, _ in Appointment.STATUS_CHOICES]
+
+    Department.objects.bulk_create(Department(name=f'Department {i}') for i in range(departments))
+    ReportType.objects.bulk_create(ReportType(name=f'Report type {i}') for i in range(report_types))
+    department_ids = list(Department.objects.values_list('id', flat=True))
+    report_type_ids = list(ReportType.objects.values_list('id', flat=True))
+
+    _batched(
+        (User(username=f'doctor{i}', first_name='Doctor', last_name=str(i), role=User.Role.DOCTOR, password='!')
+         for i in range(doctors)),
+        User, batch_size,
+    )
+    doctor_ids = list(User.objects.filter(role=User.Role.DOCTOR).values_list('id', flat=True))
+    _batched(
+        (DoctorProfile(user_id=pk, department_id=department_ids[i % len(department_ids)])
+         for i, pk in enumerate(doctor_ids)),
+        DoctorProfile, batch_size,
+    )
+
+    _batched(
+        (User(username=f'patient{i}', first_name='Patient', last_name=str(i), password='!')
+         for i in range(patients)),
+        User, batch_size,
+    )
+    patient_ids = list(User.objects.filter(role=User.Role.PATIENT).values_list('id', flat=True))
+    _batched((PatientProfile(user_id=pk, height=170, weight=70, bmi=24.22) for pk in patient_ids),
+             PatientProfile, batch_size)
+    profile_ids = list(PatientProfile.objects.values_list('id', flat=True))
+
+    # Walk each doctor's half-hour slots with a stride coprime to the slot
+    # count so times look random but never collide (unique_active_doctor_slot).
+    slots = days * 48
+    stride = next(n for n in range(7919, slots * 2) if gcd(n, slots) == 1)
+    _batched(
+        (Appointment(
+            patient_id=rng.choice(patient_ids),
+            doctor_id=doctor_ids[i % len(doctor_ids)],
+            time=start + timedelta(minutes=30 * ((i // len(doctor_ids) * stride + i % len(doctor_ids)) % slots)),
+            status=rng.choice(statuses),
+        ) for i in range(min(appointments, slots * len(doctor_ids)))),
+        Appointment, batch_size,
+    )
+    _batched(
+        (LabReport(
+            patient_id=rng.choice(profile_ids),
+            report=f'lab_reports/{i}.pdf',
+            report_type_id=rng.choice(report_type_ids),
+        ) for i in range(lab_reports)),
+        LabReport, batch_size,
+    )
+    # uploaded_at is auto_now_add; spread it out so time-ordered reads are realistic
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {LabReport._meta.db_table} SET uploaded_at = "
+            f"datetime(uploaded_at, '-' || (id %% %s) || ' minutes')",
+            [days * 24 * 60],
+        )
+
+    if previsit_reports:
+        _batched(
+            (PreVisitQuestion(department_id=pk, question_text=text) for pk in department_ids for text in (
+                'What brings you in today?', 'How long have you had these symptoms?', 'Anything else we should know?',
+            )),
+            PreVisitQuestion, batch_size,
+        )
+        question_ids = list(PreVisitQuestion.objects.values_list('id', flat=True))
+        appointment_ids = Appointment.objects.order_by('id').values_list('id', flat=True)[:previsit_reports]
+        _batched(
+            (PreVisitReport(appointment_id=pk, responses={
+                str(rng.choice(question_ids)): f'{rng.choice(SYMPTOMS)} and {rng.choice(SYMPTOMS)}',
+                str(rng.choice(question_ids)): rng.choice(DURATIONS),
+            }) for pk in appointment_ids.iterator()),
+            PreVisitReport, batch_size,
+        )
+
+    return {
+        'departments': department_ids,
+        'report_types': report_type_ids,
+        'doctors': doctor_ids,
+        'patients': patient_ids,
+        'patient_profiles': profile_ids,
+    }
+
+
+def _dates(sample, first, last):
+    today = sample['today']
+    return f"?start={today + timedelta(days=first)}&end={today + timedelta(days=last)}"
+
+
+# URL of every GET route for one user's `sample` (see bench_endpoints), keyed by URL name
+ENDPOINT_URLS = {
+    'api-root': lambda s: reverse('api-root'),
+    'user-list': lambda s: reverse('user-list'),
+    'user-detail': lambda s: reverse('user-detail', args=[s['user']]),
+    'department-list': lambda s: reverse('department-list'),
+    'department-detail': lambda s: reverse('department-detail', args=[s['department']]),
+    'doctorprofile-list': lambda s: reverse('doctorprofile-list'),
+    'doctorprofile-detail': lambda s: reverse('doctorprofile-detail', args=[s['doctor_profile']]),
+    'doctors-by-department': lambda s: reverse('doctors-by-department', args=[s['department']]),
+    'doctor-slots-by-department': lambda s: reverse('doctor-slots-by-department', args=[s['department']])
+    + _dates(s, 0, 6),
+    'doctor-slots': lambda s: reverse('doctor-slots', args=[s['doctor_profile']]) + _dates(s, 0, 13),
+    'patientprofile-list': lambda s: reverse('patientprofile-list'),
+    'patientprofile-detail': lambda s: reverse('patientprofile-detail', args=[s['patient_profile']]),
+    'reporttype-list': lambda s: reverse('reporttype-list'),
+    'reporttype-detail': lambda s: reverse('reporttype-detail', args=[s['report_type']]),
+    'labreport-list': lambda s: reverse('labreport-list'),
+    'labreport-detail': lambda s: reverse('labreport-detail', args=[s['lab_report']]),
+    'lab-reports-by-type': lambda s: reverse('lab-reports-by-type', args=[s['report_type']]),
+    'get_patient_lab_reports': lambda s: reverse('get_patient_lab_reports', args=[s['patient_profile']]),
+    'appointment-list': lambda s: reverse('appointment-list'),
+    'appointment-detail': lambda s: reverse('appointment-detail', args=[s['appointment']]),
+    'appointment-stats': lambda s: reverse('appointment-stats') + _dates(s, -30, 0) + '&group_by=day',
+    'patient-appointments-admin': lambda s: reverse('patient-appointments-admin', args=[s['patient']]),
+    'previsitquestion-list': lambda s: reverse('previsitquestion-list'),
+    'previsitquestion-detail': lambda s: reverse('previsitquestion-detail', args=[s['question']]),
+    'previsitreport-list': lambda s: reverse('previsitreport-list'),
+    'previsitreport-detail': lambda s: reverse('previsitreport-detail', args=[s['previsit_appointment']]),
+    'daily-stats': lambda s: reverse('daily-stats') + _dates(s, -30, 0),
+    'search': lambda s: reverse('search') + '?q=%22chest+pain%22',
+    'async-appointment-list': lambda s: reverse('async-appointment-list'),
+    'async-doctor-list': lambda s: reverse('async-doctor-list'),
+    'async-labreport-list': lambda s: reverse('async-labreport-list'),
+    'async-previsitreport-detail': lambda s: reverse('async-previsitreport-detail', args=[s['previsit_appointment']]),
+}
+
+# Routes bench_endpoints leaves out, with the reason
+SKIPPED_ENDPOINTS = {
+    'register': 'writes; dominated by password hashing',
+    'login': 'writes; dominated by password hashing',
+    'logout': 'writes',
+    'token_obtain_pair': 'dominated by password hashing',
+    'token_refresh': 'token issuing, no database reads',
+    'upload_lab_report': 'POST only',
+    'appointment-batch': 'POST only',
+    'labreport-download': 'streams files; seeded reports have none on disk',
+    'labreportupload-list': 'resumable upload sessions are writes',
+    'labreportupload-detail': 'resumable upload sessions are writes',
+    'labreportupload-chunk': 'resumable upload sessions are writes',
+    'labreportupload-finalize': 'resumable upload sessions are writes',
+}
+
+# Relative request weights per role: how often each kind of user hits each route
+ROLE_MIX = {
+    User.Role.PATIENT: {
+        'appointment-list': 20, 'async-appointment-list': 5, 'appointment-detail': 3,
+        'patient-appointments-admin': 3, 'doctorprofile-list': 10, 'async-doctor-list': 3,
+        'doctorprofile-detail': 2, 'doctors-by-department': 8, 'doctor-slots': 10, 'doctor-slots-by-department': 5,
+        'department-list': 5, 'department-detail': 1, 'reporttype-list': 2, 'reporttype-detail': 1,
+        'previsitquestion-list': 4, 'previsitquestion-detail': 1, 'previsitreport-detail': 4,
+        'async-previsitreport-detail': 1, 'labreport-list': 8, 'async-labreport-list': 2, 'labreport-detail': 3,
+        'get_patient_lab_reports': 4, 'user-list': 1, 'user-detail': 2, 'patientprofile-detail': 2, 'search': 3,
+        'api-root': 1,
+    },
+    User.Role.DOCTOR: {
+        'appointment-list': 25, 'async-appointment-list': 5, 'appointment-detail': 5, 'appointment-stats': 5,
+        'patient-appointments-admin': 5, 'previsitreport-detail': 8, 'async-previsitreport-detail': 2,
+        'previsitquestion-list': 2, 'patientprofile-detail': 5, 'get_patient_lab_reports': 8, 'labreport-detail': 3,
+        'lab-reports-by-type': 1, 'doctor-slots': 3, 'doctorprofile-detail': 1, 'user-list': 2, 'search': 5,
+    },
+    User.Role.ADMIN: {
+        'user-list': 10, 'user-detail': 2, 'patientprofile-list': 5, 'patientprofile-detail': 3,
+        'doctorprofile-list': 5, 'appointment-list': 10, 'appointment-stats': 5, 'patient-appointments-admin': 5,
+        'labreport-list': 5, 'lab-reports-by-type': 1, 'previsitreport-list': 3, 'previsitquestion-list': 2,
+        'daily-stats': 5, 'search': 5,
+    },
+}
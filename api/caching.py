@@ -0,0 +1,110 @@
+"""
+Namespaced, versioned response caching.
+
+Each namespace (e.g. the doctor directory) has a version number in the cache.
+Cached payloads include the version in their key, so bumping it from a signal
+invalidates every entry of the namespace at once without having to know or
+delete the individual keys. Hits and misses are counted per namespace in
+process memory, so counting adds no cache round trip to the request.
+`aget_version` and `acached` are the same for async views.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+DOCTOR_DIRECTORY = 'doctor-directory'
+# Backends whose contents only the current process sees
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def cache_is_shared():
+    """Whether every worker reads and writes the same default cache."""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    # Time based start value so a version evicted from the cache never comes
+    # back as a number older entries were stored under.
+    cache.add(_version_key(namespace), time.time_ns() // 1000, timeout=None)
+    return cache.get(_version_key(namespace))
+
+
+async def aget_version(namespace):
+    await cache.aadd(_version_key(namespace), time.time_ns() // 1000, timeout=None)
+    return await cache.aget(_version_key(namespace))
+
+
+def bump_version(namespace):
+    try:
+        cache.incr(_version_key(namespace))
+    except ValueError:
+        get_version(namespace)
+
+
+def invalidate(namespace):
+    """
+    Bump `namespace` now and again once the current transaction commits, so a
+    reader that caches pre-commit data in between is invalidated as well.
+    """
+    bump_version(namespace)
+    transaction.on_commit(lambda: bump_version(namespace))
+
+
+_stats = Counter()  # (namespace, 'hit' | 'miss') -> count, for this process
+_stats_lock = threading.Lock()
+
+
+def _count(namespace, outcome):
+    with _stats_lock:
+        _stats[namespace, outcome] += 1
+
+
+def cache_stats(namespace):
+    """Hits and misses of `namespace` in this process."""
+    return {'hits': _stats[namespace, 'hit'], 'misses': _stats[namespace, 'miss']}
+
+
+def reset_stats(namespace):
+    with _stats_lock:
+        _stats.pop((namespace, 'hit'), None)
+        _stats.pop((namespace, 'miss'), None)
+
+
+def cached(namespace, key, build, timeout=None):
+    """
+    Return (value, hit) for `key` in the current version of `namespace`,
+    calling `build()` and storing its result on a miss.
+    """
+    full_key = f'{namespace}:{get_version(namespace)}:{key}'
+    value = cache.get(full_key)
+    if value is not None:
+        _count(namespace, 'hit')
+        return value, True
+    value = build()
+    cache.set(full_key, value, timeout)
+    _count(namespace, 'miss')
+    return value, False
+
+
+async def acached(namespace, key, build, timeout=None):
+    """`cached` for async callers; `build` is a coroutine function."""
+    full_key = f'{namespace}:{await aget_version(namespace)}:{key}'
+    value = await cache.aget(full_key)
+    if value is not None:
+        _count(namespace, 'hit')
+        return value, True
+    value = await build()
+    await cache.aset(full_key, value, timeout)
+    _count(namespace, 'miss')
+    return value, False
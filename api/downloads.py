@@ -0,0 +1,134 @@
+"""
+Streaming file responses with HTTP validators and byte-range support.
+
+Files are read from storage in fixed-size chunks, so a multi-hundred-MB scan
+never sits in worker memory. When `LAB_REPORT_DOWNLOAD_OFFLOAD` is set the
+response only carries a header telling the front web server which file to
+send, and it handles ranges itself.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import (
+    content_disposition_header, http_date, parse_etags, parse_http_date_safe, quote_etag,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_validators(fieldfile):
+    """(strong ETag, last modified timestamp, size) for a stored file."""
+    storage, name = fieldfile.storage, fieldfile.name
+    size = storage.size(name)
+    modified = int(storage.get_modified_time(name).timestamp())
+    digest = hashlib.sha256(f'{name}:{size}:{modified}'.encode()).hexdigest()[:32]
+    return quote_etag(digest), modified, size
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single `bytes=` range, None when the
+    header should be ignored (absent, malformed or multi-range), or False when
+    the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def range_applies(request, etag, modified):
+    """Honour If-Range: only serve a partial response for an unchanged file."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return etag in parse_etags(if_range) and not if_range.startswith('W/')
+    return parse_http_date_safe(if_range) == modified
+
+
+def iter_file(fieldfile, start, length, chunk_size=CHUNK_SIZE):
+    with fieldfile.storage.open(fieldfile.name, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def offload_response(fieldfile, mode):
+    response = HttpResponse()
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = fieldfile.path
+    elif mode == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.LAB_REPORT_ACCEL_REDIRECT_PREFIX + fieldfile.name
+    else:
+        raise ValueError(f'Unknown download offload mode: {mode!r}')
+    # Let the front server fill in the body headers for the real file
+    del response['Content-Type']
+    return response
+
+
+def serve_file(request, fieldfile, filename=None):
+    """Build a conditional, range-aware response for `fieldfile`."""
+    etag, modified, size = file_validators(fieldfile)
+    filename = filename or os.path.basename(fieldfile.name)
+
+    headers = HttpResponse()
+    headers['ETag'] = etag
+    headers['Last-Modified'] = http_date(modified)
+    headers['Cache-Control'] = 'private, no-cache'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=modified, response=headers)
+    if not_modified is not headers:
+        return not_modified
+
+    mode = getattr(settings, 'LAB_REPORT_DOWNLOAD_OFFLOAD', None)
+    if mode:
+        response = offload_response(fieldfile, mode)
+    else:
+        byte_range = None
+        if request.method == 'GET' and range_applies(request, etag, modified):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        length = max(end - start + 1, 0)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = StreamingHttpResponse(
+            iter_file(fieldfile, start, length) if request.method == 'GET' else [],
+            status=206 if byte_range else 200,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+        response[header] = headers[header]
+    return response
@@ -0,0 +1,136 @@
+"""
+Resized variants of doctor profile images.
+
+Uploads are checked for file size and pixel count before they are accepted,
+so a decompression bomb is rejected from its header alone. After the profile
+is committed, a small background pool renders each variant in WebP and JPEG
+and records the stored names on `DoctorProfile.image_variants`.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .caching import DOCTOR_DIRECTORY, invalidate
+
+logger = logging.getLogger(__name__)
+
+# name -> longest edge in pixels, largest first so each step resizes a smaller image
+VARIANTS = {
+    'full': 1024,
+    'card': 320,
+    'thumb': 96,
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix='image-variants')
+
+
+def validate_doctor_image(fieldfile):
+    """Reject oversized files and images whose header declares too many pixels."""
+    if getattr(fieldfile, '_committed', False):
+        return  # already stored (e.g. full_clean() of a saved profile); only new uploads are checked
+    try:
+        size = fieldfile.size
+    except OSError:
+        raise ValidationError('Upload a valid image.')
+    if size > settings.DOCTOR_IMAGE_MAX_UPLOAD_SIZE:
+        raise ValidationError(
+            f'Image files may not exceed {settings.DOCTOR_IMAGE_MAX_UPLOAD_SIZE // (1024 * 1024)} MB.'
+        )
+    position = fieldfile.tell() if hasattr(fieldfile, 'tell') else None
+    try:
+        # Image.open only parses the header; no pixel data is decoded here
+        with Image.open(fieldfile) as image:
+            width, height = image.size
+    except (Image.DecompressionBombError, OSError, ValueError):
+        raise ValidationError('Upload a valid image.')
+    finally:
+        if position is not None:
+            fieldfile.seek(position)
+    if width * height > settings.DOCTOR_IMAGE_MAX_PIXELS:
+        raise ValidationError(f'Images may not exceed {settings.DOCTOR_IMAGE_MAX_PIXELS} pixels.')
+
+
+def variant_name(image_name, variant, extension):
+    directory, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def render_variants(storage, image_name):
+    """Write every variant of `image_name` to `storage`; returns {variant: {format: name}}."""
+    with storage.open(image_name, 'rb') as fh, Image.open(fh) as image:
+        if image.width * image.height > settings.DOCTOR_IMAGE_MAX_PIXELS:
+            raise ValidationError('Image exceeds the pixel limit.')
+        # JPEG can decode straight at a reduced scale, which keeps memory low
+        image.draft('RGB', (VARIANTS['full'], VARIANTS['full']))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        variants = {}
+        for variant, edge in VARIANTS.items():
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            variants[variant] = {}
+            for extension, (pil_format, options) in FORMATS.items():
+                buffer = io.BytesIO()
+                image.save(buffer, pil_format, **options)
+                name = variant_name(image_name, variant, extension)
+                if storage.exists(name):
+                    storage.delete(name)
+                variants[variant][extension] = storage.save(name, ContentFile(buffer.getvalue()))
+        return variants
+
+
+def delete_variants(storage, variants):
+    for names in (variants or {}).values():
+        for name in names.values():
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def generate_variants(profile_id, image_name):
+    from .models import DoctorProfile
+
+    profile = DoctorProfile.objects.filter(pk=profile_id, image=image_name).first()
+    if profile is None:
+        return  # the image was replaced or the profile deleted in the meantime
+    try:
+        variants = render_variants(profile.image.storage, image_name)
+    except Exception:
+        logger.exception('Could not render variants for %s', image_name)
+        return
+    updated = DoctorProfile.objects.filter(pk=profile_id, image=image_name).update(image_variants=variants)
+    if not updated:
+        delete_variants(profile.image.storage, variants)
+    else:
+        # queryset.update() sends no post_save, so invalidate the directory here
+        invalidate(DOCTOR_DIRECTORY)
+
+
+def _generate_in_background(profile_id, image_name):
+    try:
+        generate_variants(profile_id, image_name)
+    finally:
+        connection.close()
+
+
+def schedule_variants(profile):
+    """Render the profile image's variants in the background once the transaction commits."""
+    profile_id, image_name = profile.pk, profile.image.name
+
+    def submit():
+        if settings.IMAGE_VARIANTS_ASYNC:
+            _executor.submit(_generate_in_background, profile_id, image_name)
+        else:
+            generate_variants(profile_id, image_name)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,201 @@
+"""
+Bulk patient import from CSV or XLSX files.
+
+Creating patients one at a time runs the signal handlers for every row (the
+PatientProfile INSERT, the new-patient counter) and hashes each password on
+the request thread, which is far too slow for onboarding a whole clinic. The
+importer instead streams the file in batches, hashes the passwords of the
+next batch in a process pool while the current one is written, and inserts
+User and PatientProfile rows (BMI included) with bulk_create, one transaction
+per batch. bulk_create sends no signals, so the work of the post_save
+receivers that matters for patients, the PatientDailyStat counters, is done
+here.
+
+Columns (header row, case-insensitive, only username is required):
+    username, email, first_name, last_name, password, phone, dob, height, weight
+Rows without a password get an unusable one.
+"""
+import csv
+import io
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import date, datetime
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from .models import PatientDailyStat, PatientProfile, User
+from .stats import apply_deltas
+
+COLUMNS = ('username', 'email', 'first_name', 'last_name', 'password', 'phone', 'dob', 'height', 'weight')
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name', 'phone', 'dob')
+
+
+class PatientImportError(Exception):
+    pass
+
+
+def read_rows(file, name):
+    """Yield (line number, {column: value}) from a binary CSV or XLSX file without loading it whole."""
+    if name.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise PatientImportError("Reading .xlsx files requires openpyxl (pip install openpyxl)")
+        rows = load_workbook(file, read_only=True, data_only=True).active.iter_rows(values_only=True)
+        header = [str(cell or '').strip().lower() for cell in next(rows, ())]
+        numbered = enumerate(rows, start=2)
+    elif name.lower().endswith('.csv'):
+        reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+        header = [cell.strip().lower() for cell in next(reader, [])]
+        numbered = ((reader.line_num, row) for row in reader)
+    else:
+        raise PatientImportError("Only .csv and .xlsx files can be imported")
+
+    if 'username' not in header:
+        raise PatientImportError("The header row must contain a username column")
+    for line, values in numbered:
+        row = dict(zip(header, values))
+        if any(value not in (None, '') for value in row.values()):
+            yield line, row
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _number(value, column):
+    if _text(value) == '':
+        return 0
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{column} must be a number")
+    if number < 0:
+        raise ValueError(f"{column} must not be negative")
+    return number
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date) or _text(value) == '':
+        return value or None
+    try:
+        return date.fromisoformat(_text(value))
+    except ValueError:
+        raise ValueError("dob must be a YYYY-MM-DD date")
+
+
+def clean_row(row):
+    """Validated field values of one file row; raises ValueError with a message for the user."""
+    cleaned = {column: _text(row.get(column)) for column in ('username', 'email', 'first_name', 'last_name', 'phone')}
+    if not cleaned['username']:
+        raise ValueError("username is required")
+    for column in cleaned:
+        max_length = User._meta.get_field(column).max_length
+        if len(cleaned[column]) > max_length:
+            raise ValueError(f"{column} is longer than {max_length} characters")
+    cleaned['phone'] = cleaned['phone'] or None
+    cleaned['dob'] = _date(row.get('dob'))
+    cleaned['height'] = _number(row.get('height'), 'height')
+    cleaned['weight'] = _number(row.get('weight'), 'weight')
+    cleaned['password'] = _text(row.get('password')) or None
+    return cleaned
+
+
+def _batches(rows, batch_size, errors):
+    """Batches of (line, cleaned row); invalid rows and taken usernames go to `errors` instead."""
+    seen = set()
+
+    def finish(batch):
+        taken = set(User.objects.filter(username__in=[row['username'] for _, row in batch])
+                    .values_list('username', flat=True))
+        kept = []
+        for line, row in batch:
+            if row['username'] in taken:
+                errors.append((line, f"username {row['username']!r} already exists"))
+            else:
+                kept.append((line, row))
+        return kept
+
+    batch = []
+    for line, row in rows:
+        try:
+            cleaned = clean_row(row)
+        except ValueError as exc:
+            errors.append((line, str(exc)))
+            continue
+        if cleaned['username'] in seen:
+            errors.append((line, f"username {cleaned['username']!r} appears more than once"))
+            continue
+        seen.add(cleaned['username'])
+        batch.append((line, cleaned))
+        if len(batch) == batch_size:
+            yield finish(batch)
+            batch = []
+    if batch:
+        yield finish(batch)
+
+
+def _write(batch, hashes, errors):
+    users = [
+        User(role=User.Role.PATIENT, password=password, **{field: row[field] for field in USER_FIELDS})
+        for (_, row), password in zip(batch, hashes)
+    ]
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            profiles = PatientProfile.objects.bulk_create(
+                PatientProfile(
+                    user=user, height=row['height'], weight=row['weight'],
+                    bmi=PatientProfile.compute_bmi(row['height'], row['weight']),
+                )
+                for user, (_, row) in zip(users, batch)
+            )
+            # What count_new_patient would have done for each profile
+            apply_deltas(PatientDailyStat, {(day,): n for day, n in Counter(p.created_at for p in profiles).items()})
+    except IntegrityError as exc:
+        # Someone registered one of these usernames since the batch was checked
+        errors.extend((line, f"batch not imported: {exc}") for line, _ in batch)
+        return 0
+    return len(users)
+
+
+def import_patients(rows, batch_size=1000, workers=None, progress=None):
+    """
+    Create a patient for every valid row of `rows` (as yielded by read_rows).
+    Passwords are hashed by `workers` processes (None: one per CPU, 0: in this
+    process). `progress(created)` is called after each batch. Returns
+    {'created', 'errors': [(line, message)], 'seconds', 'rows_per_second'}.
+    """
+    errors = []
+    created = 0
+    start = time.perf_counter()
+    pool = ProcessPoolExecutor(workers, initializer=django.setup) if workers != 0 else None
+    with pool or nullcontext():
+        pending = None
+        for batch in _batches(rows, batch_size, errors):
+            passwords = [row['password'] for _, row in batch]
+            # The pool starts on this batch's passwords while the previous batch is written
+            hashes = pool.map(make_password, passwords, chunksize=64) if pool else map(make_password, passwords)
+            if pending:
+                created += _write(*pending, errors)
+                if progress:
+                    progress(created)
+            pending = (batch, hashes)
+        if pending:
+            created += _write(*pending, errors)
+            if progress:
+                progress(created)
+
+    seconds = time.perf_counter() - start
+    return {
+        'created': created,
+        'errors': sorted(errors),
+        'seconds': seconds,
+        'rows_per_second': created / seconds if seconds else 0,
+    }
@@ -0,0 +1,104 @@
+import asyncio
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from api.benchmark import scratch_database, seed_hospital
+from api.models import User
+from api.views import MyTokenObtainPairSerializer
+
+# (sync route, async route) pairs exercised by every client
+ROUTES = [
+    ('appointment-list', 'async-appointment-list'),
+    ('labreport-list', 'async-labreport-list'),
+    ('doctorprofile-list', 'async-doctor-list'),
+]
+
+
+def _summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync (WSGI) and async (ASGI) read endpoints under many simultaneous clients. "
+        "Requests go through Django's request handlers in-process (no server or network), with a "
+        "fixed number of WSGI worker threads against one event loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--requests-per-client', type=int, default=4)
+        parser.add_argument('--wsgi-workers', type=int, default=8, help="Worker threads, like gunicorn --threads")
+
+    def run_wsgi(self, urls, headers, clients, per_client, workers):
+        slots = threading.BoundedSemaphore(workers)
+        latencies, lock = [], threading.Lock()
+
+        def client_loop(n):
+            client = Client(headers=headers)
+            for i in range(per_client):
+                start = time.perf_counter()
+                with slots:  # a request waits for a free worker before it is served
+                    response = client.get(urls[(n + i) % len(urls)])
+                assert response.status_code == 200, response.status_code
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+        threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return _summary(latencies, time.perf_counter() - start)
+
+    def run_asgi(self, urls, headers, clients, per_client):
+        latencies = []
+
+        async def client_loop(n):
+            client = AsyncClient()
+            for i in range(per_client):
+                start = time.perf_counter()
+                response = await client.get(urls[(n + i) % len(urls)], headers=headers)
+                assert response.status_code == 200, response.status_code
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        async def main():
+            await asyncio.gather(*(client_loop(n) for n in range(clients)))
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return _summary(latencies, time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        clients, per_client = options['clients'], options['requests_per_client']
+        with scratch_database():
+            ids = seed_hospital(doctors=50, patients=200, appointments=5000, lab_reports=2000)
+            patient = User.objects.get(pk=ids['patients'][0])
+            token = MyTokenObtainPairSerializer.get_token(patient).access_token
+            headers = {'Authorization': f'Bearer {token}'}
+
+            results = {
+                'WSGI': self.run_wsgi(
+                    [reverse(name) for name, _ in ROUTES], headers, clients, per_client, options['wsgi_workers']
+                ),
+                'ASGI': self.run_asgi([reverse(name) for _, name in ROUTES], headers, clients, per_client),
+            }
+
+        self.stdout.write(
+            f"{clients} simultaneous clients x {per_client} requests, "
+            f"{options['wsgi_workers']} WSGI worker threads"
+        )
+        self.stdout.write(f"{'':6} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10}")
+        for name, summary in results.items():
+            self.stdout.write(f"{name:6} {summary['rps']:10.1f} {summary['p50']:10.1f} {summary['p95']:10.1f}")
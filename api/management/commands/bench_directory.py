@@ -0,0 +1,48 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.benchmark import scratch_database, seed_hospital
+from api.caching import DOCTOR_DIRECTORY, cache_stats, reset_stats
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare doctor directory requests/second with and without the versioned response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=500)
+
+    def run(self, client, urls, count):
+        start = time.perf_counter()
+        for i in range(count):
+            response = client.get(urls[i % len(urls)])
+            assert response.status_code == 200, response.status_code
+        return count / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            ids = seed_hospital(departments=5, doctors=options['doctors'], patients=10, appointments=0, lab_reports=0)
+            client = APIClient()
+            client.force_authenticate(User.objects.get(pk=ids['patients'][0]))
+            urls = [reverse('doctorprofile-list')] + [
+                reverse('doctors-by-department', args=[pk]) for pk in ids['departments']
+            ]
+
+            results = {}
+            for enabled in (False, True):
+                cache.clear()
+                reset_stats(DOCTOR_DIRECTORY)
+                with override_settings(DOCTOR_DIRECTORY_CACHE_ENABLED=enabled):
+                    results[enabled] = self.run(client, urls, options['requests'])
+            stats = cache_stats(DOCTOR_DIRECTORY)
+
+        self.stdout.write(f"Doctors: {options['doctors']}, requests per run: {options['requests']}")
+        self.stdout.write(f"  without cache: {results[False]:10.1f} req/s")
+        self.stdout.write(f"  with cache:    {results[True]:10.1f} req/s  ({results[True] / results[False]:.1f}x)")
+        self.stdout.write(f"  cache hits: {stats['hits']}, misses: {stats['misses']}")
@@ -0,0 +1,233 @@
+import json
+import random
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api import search, stats
+from api.benchmark import ENDPOINT_URLS, ROLE_MIX, percentile, scratch_database, seed_hospital
+from api.models import (
+    Appointment, Department, DoctorProfile, LabReport, PatientProfile, PreVisitQuestion, PreVisitReport, User,
+)
+from api.views import MyTokenObtainPairSerializer
+
+SCALES = {
+    'small': dict(departments=10, doctors=50, patients=2000, appointments=20000, lab_reports=5000,
+                  previsit_reports=2000),
+    'medium': dict(departments=20, doctors=200, patients=50000, appointments=500000, lab_reports=100000,
+                   previsit_reports=50000),
+    'hospital': dict(departments=30, doctors=2000, patients=500000, appointments=5000000, lab_reports=1000000,
+                     previsit_reports=200000),
+}
+# Share of requests made by each role
+ROLE_WEIGHTS = {User.Role.PATIENT: 60, User.Role.DOCTOR: 30, User.Role.ADMIN: 10}
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic hospital and replay a weighted mix of authenticated requests per role "
+        "against every GET route in api/urls.py. Reports p50/p95/p99 latency, queries per request "
+        "and peak memory per endpoint, and writes the results as JSON (--output) so runs can be "
+        "compared (--compare)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        for field in SCALES['small']:
+            parser.add_argument(f"--{field.replace('_', '-')}", type=int, help="Override the --scale preset")
+        parser.add_argument('--requests', type=int, default=2000, help="Measured requests across all roles")
+        parser.add_argument('--users-per-role', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="Earlier --output file to compare p95 latency against")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read {options['compare']}: {exc}")
+
+        dataset = {
+            field: options[field] if options[field] is not None else value
+            for field, value in SCALES[options['scale']].items()
+        }
+        rng = random.Random(options['seed'])
+        with scratch_database():
+            start = time.perf_counter()
+            ids = seed_hospital(seed=options['seed'], **dataset)
+            # Bulk seeding sends no signals; fill the derived tables the endpoints read
+            stats.rebuild()
+            search.rebuild()
+            self.stdout.write(f"Seeded {options['scale']} dataset in {time.perf_counter() - start:.1f}s")
+
+            clients, samples = self.build_users(ids, options['users_per_role'], rng)
+            self.warm_up(clients, samples)
+            timings = self.replay(clients, samples, options['requests'], rng)
+            memory = self.peak_memory(clients, samples)
+            counts = {
+                model._meta.model_name: model.objects.count()
+                for model in (Department, DoctorProfile, PatientProfile, Appointment, LabReport, PreVisitReport)
+            }
+
+        results = {
+            'run': {
+                'timestamp': timezone.now().isoformat(timespec='seconds'),
+                'commit': _commit(),
+                'database_profile': settings.DATABASE_PROFILE,
+                'scale': options['scale'],
+                'requests': options['requests'],
+                'users_per_role': options['users_per_role'],
+                'seed': options['seed'],
+            },
+            'dataset': counts,
+            # ru_maxrss is in KiB on Linux
+            'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'endpoints': {
+                role: {
+                    name: {**self.summarize(samples_), 'peak_memory_kib': memory[role][name]}
+                    for name, samples_ in sorted(by_name.items())
+                }
+                for role, by_name in timings.items()
+            },
+        }
+        self.report(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+    def build_users(self, ids, count, rng):
+        """A Client with a bearer token and a dict of URL arguments it may use, for `count` users per role."""
+        last_id = Appointment.objects.order_by('-pk').values_list('pk', flat=True).first()
+        previsit = list(PreVisitReport.objects.values_list('appointment_id', flat=True)[:1000])
+        questions = list(PreVisitQuestion.objects.values_list('id', flat=True))
+        lab_reports = list(LabReport.objects.values_list('id', flat=True)[:1000])
+        admins = [
+            User.objects.create(username=f'bench-admin{i}', role=User.Role.ADMIN, password='!')
+            for i in range(count)
+        ]
+
+        clients, samples = {}, {}
+        for role in ROLE_MIX:
+            clients[role], samples[role] = [], []
+            for i in range(count):
+                # Patients and doctors act on one of their own appointments
+                appointment = Appointment.objects.filter(pk__gte=rng.randint(1, last_id)).order_by('pk') \
+                    .values('id', 'patient_id', 'doctor_id').first()
+                user_id = {
+                    User.Role.PATIENT: appointment['patient_id'],
+                    User.Role.DOCTOR: appointment['doctor_id'],
+                    User.Role.ADMIN: admins[i].pk,
+                }[role]
+                profile_id = PatientProfile.objects.values_list('id', flat=True).get(user_id=appointment['patient_id'])
+                doctor_profile, department = DoctorProfile.objects.values_list('id', 'department_id') \
+                    .get(user_id=appointment['doctor_id'])
+                samples[role].append({
+                    'today': timezone.localdate(),
+                    'user': user_id,
+                    'patient': appointment['patient_id'],
+                    'patient_profile': profile_id,
+                    'doctor_profile': doctor_profile,
+                    'department': department,
+                    'appointment': appointment['id'],
+                    'lab_report': LabReport.objects.filter(patient_id=profile_id).values_list('id', flat=True)
+                    .first() or rng.choice(lab_reports),
+                    'report_type': rng.choice(ids['report_types']),
+                    'question': rng.choice(questions),
+                    'previsit_appointment': rng.choice(previsit),
+                })
+                token = MyTokenObtainPairSerializer.get_token(User.objects.get(pk=user_id)).access_token
+                clients[role].append(Client(headers={'Authorization': f'Bearer {token}'}))
+        return clients, samples
+
+    def warm_up(self, clients, samples):
+        for role, mix in ROLE_MIX.items():
+            for name in mix:
+                response = clients[role][0].get(ENDPOINT_URLS[name](samples[role][0]))
+                if response.status_code >= 400:
+                    self.stderr.write(f"{role} {name}: HTTP {response.status_code} {response.content[:200]!r}")
+
+    def replay(self, clients, samples, requests, rng):
+        """{role: {url name: [(milliseconds, queries, status), ...]}} for `requests` requests drawn from the mix."""
+        timings = {role: {name: [] for name in mix} for role, mix in ROLE_MIX.items()}
+        roles = list(ROLE_WEIGHTS)
+        for _ in range(requests):
+            role = rng.choices(roles, weights=[ROLE_WEIGHTS[r] for r in roles])[0]
+            mix = ROLE_MIX[role]
+            name = rng.choices(list(mix), weights=list(mix.values()))[0]
+            user = rng.randrange(len(clients[role]))
+            url = ENDPOINT_URLS[name](samples[role][user])
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = clients[role][user].get(url)
+                elapsed = (time.perf_counter() - start) * 1000
+            timings[role][name].append((elapsed, len(queries.captured_queries), response.status_code))
+        return {role: {name: s for name, s in by_name.items() if s} for role, by_name in timings.items()}
+
+    def peak_memory(self, clients, samples):
+        """Peak Python allocations (KiB) of one request to every route, per role. Kept out of the timed run."""
+        peaks = {}
+        tracemalloc.start()
+        try:
+            for role, mix in ROLE_MIX.items():
+                peaks[role] = {}
+                for name in mix:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    clients[role][0].get(ENDPOINT_URLS[name](samples[role][0]))
+                    peaks[role][name] = round((tracemalloc.get_traced_memory()[1] - before) / 1024, 1)
+        finally:
+            tracemalloc.stop()
+        return peaks
+
+    @staticmethod
+    def summarize(samples):
+        latencies = [ms for ms, _, _ in samples]
+        queries = [count for _, count, _ in samples]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, _, status in samples if status >= 400),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+        }
+
+    def report(self, results, baseline):
+        header = (f"{'role':8} {'endpoint':30} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                  f"{'queries':>7} {'peak KiB':>9} {'errors':>6}")
+        if baseline:
+            header += f" {'p95 vs base':>11}"
+        self.stdout.write(header)
+        for role, by_name in results['endpoints'].items():
+            for name, row in by_name.items():
+                line = (f"{role:8} {name:30} {row['requests']:5} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} "
+                        f"{row['p99_ms']:8.2f} {row['queries_max']:7} {row['peak_memory_kib']:9.1f} {row['errors']:6}")
+                if baseline:
+                    before = baseline.get('endpoints', {}).get(role, {}).get(name)
+                    line += f" {(row['p95_ms'] / before['p95_ms'] - 1) * 100:+10.0f}%" if before else f" {'new':>11}"
+                self.stdout.write(line)
+        self.stdout.write(f"Peak RSS: {results['peak_rss_kib'] / 1024:.0f} MiB")
@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.benchmark import explain, scratch_database, seed_hospital, timed
+from api.models import Appointment, LabReport
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch database and compare query plans and timings of the hot "
+        "appointment/lab-report filters with and without the composite indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=1_000_000)
+        parser.add_argument('--lab-reports', type=int, default=200_000)
+        parser.add_argument('--doctors', type=int, default=200)
+        parser.add_argument('--patients', type=int, default=20_000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--json', help="Write the results to this file")
+
+    def queries(self, ids):
+        doctor, patient, profile = ids['doctors'][0], ids['patients'][0], ids['patient_profiles'][0]
+        report_type = ids['report_types'][0]
+        return {
+            'appointments by doctor': Appointment.objects.filter(doctor_id=doctor).order_by('time', 'id')[:50],
+            'appointments by patient': Appointment.objects.filter(patient_id=patient).order_by('time', 'id')[:50],
+            'appointments by status': Appointment.objects.filter(status='pending').order_by('time', 'id')[:50],
+            'lab reports by patient': LabReport.objects.filter(patient_id=profile).order_by('uploaded_at', 'id')[:50],
+            'lab reports by type': LabReport.objects.filter(report_type_id=report_type).order_by('uploaded_at', 'id')[:50],
+        }
+
+    def measure(self, ids, repeat):
+        results = {}
+        for label, queryset in self.queries(ids).items():
+            results[label] = {
+                'plan': explain(queryset),
+                'ms': round(timed(lambda: list(queryset.all()), repeat), 3),
+            }
+        return results
+
+    def report(self, title, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for label, result in results.items():
+            self.stdout.write(f"  {label:<26} {result['ms']:>10.3f} ms")
+            for step in result['plan']:
+                self.stdout.write(f"      {step}")
+
+    def handle(self, *args, **options):
+        indexes = [(model, index) for model in (Appointment, LabReport) for index in model._meta.indexes]
+
+        with scratch_database():
+            self.stdout.write("Seeding scratch database...")
+            ids = seed_hospital(
+                doctors=options['doctors'], patients=options['patients'],
+                appointments=options['appointments'], lab_reports=options['lab_reports'],
+            )
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            before = self.measure(ids, options['repeat'])
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.add_index(model, index)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            after = self.measure(ids, options['repeat'])
+
+        self.report("Without composite indexes", before)
+        self.report("With composite indexes", after)
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump({'options': options, 'before': before, 'after': after}, fh, indent=2, default=str)
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import search
+from api.benchmark import scratch_database, seed_hospital, timed
+from api.models import PreVisitReport
+
+
+class Command(BaseCommand):
+    help = "Time FTS5 search over pre-visit reports against a LIKE scan of the JSON responses."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reports', type=int, default=500000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        reports = options['reports']
+        queries = ['"chest pain"', 'fever cough', '"shortness of breath" "for months"', 'rash']
+        with scratch_database():
+            seed_hospital(
+                doctors=200, patients=max(reports // 10, 100), appointments=reports, lab_reports=reports // 5,
+                previsit_reports=reports,
+            )
+            start = time.perf_counter()
+            documents = search.rebuild()
+            build_seconds = time.perf_counter() - start
+
+            rows = []
+            for text in queries:
+                expression = search.match_expression(text)
+                fts = timed(lambda: search.search(expression, limit=20), repeat=options['repeat'])
+                # Without the index every report's JSON has to be scanned to find
+                # (let alone rank) the matches
+                scan = PreVisitReport.objects.all()
+                for phrase in text.strip('"').split('" "') if text.startswith('"') else text.split():
+                    scan = scan.filter(responses__icontains=phrase)
+                like = timed(lambda: list(scan.values_list('id', flat=True)), repeat=options['repeat'])
+                rows.append((text, fts, like))
+
+        self.stdout.write(f"Pre-visit reports: {reports}, indexed documents: {documents} ({build_seconds:.1f}s to build)")
+        self.stdout.write(f"{'query':40} {'fts5 top 20 ms':>15} {'LIKE scan ms':>14}")
+        for text, fts, scan in rows:
+            self.stdout.write(f"{text:40} {fts:15.2f} {scan:14.2f}")
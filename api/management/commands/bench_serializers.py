@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.benchmark import scratch_database, seed_hospital
+from api.compiled import compile_serializer
+from api.models import Appointment
+from api.serializers import AppointmentSerializer
+
+
+def cpu_timed(func, repeat):
+    """Median process CPU time of `func` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        samples.append((time.process_time() - start) * 1000)
+    return statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = (
+        "CPU time to render appointment pages through AppointmentSerializer and through its compiled "
+        "values() projection (api/compiled.py), with and without the query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=20000)
+        parser.add_argument('--rows', type=int, nargs='+', default=[50, 500, 5000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        results = []
+        with scratch_database():
+            seed_hospital(doctors=50, patients=2000, appointments=options['appointments'], lab_reports=0)
+            projection = compile_serializer(AppointmentSerializer)
+            base = Appointment.objects.order_by('time', 'id')
+            for rows in options['rows']:
+                queryset = AppointmentSerializer.setup_eager_loading(base)[:rows]
+                values = projection.rows(base)[:rows]
+                instances, dicts = list(queryset), list(values)
+                results.append((
+                    rows,
+                    cpu_timed(lambda: AppointmentSerializer(instances, many=True).data, repeat),
+                    cpu_timed(lambda: projection.render(dicts), repeat),
+                    cpu_timed(lambda: AppointmentSerializer(queryset.all(), many=True).data, repeat),
+                    cpu_timed(lambda: projection.render(values.all()), repeat),
+                ))
+
+        self.stdout.write(f"CPU ms, median of {repeat}")
+        self.stdout.write(
+            f"{'rows':>6} {'render: serializer':>19} {'compiled':>9} {'speedup':>8} "
+            f"{'query+render: serializer':>25} {'compiled':>9} {'speedup':>8}"
+        )
+        for rows, serializer, compiled, serializer_total, compiled_total in results:
+            self.stdout.write(
+                f"{rows:6} {serializer:19.1f} {compiled:9.1f} {serializer / compiled:7.1f}x "
+                f"{serializer_total:25.1f} {compiled_total:9.1f} {serializer_total / compiled_total:7.1f}x"
+            )
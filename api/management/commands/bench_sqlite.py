@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.utils import timezone
+
+from api.benchmark import seed_hospital
+from api.models import Appointment
+
+PROFILES = ('development', 'production')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure write and read throughput with concurrent writer and reader threads under the "
+        "development and production database profiles (DATABASE_PROFILE). Each profile runs in "
+        "its own process against a throwaway database file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=16)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--worker', action='store_true', help="Run one profile in this process (internal)")
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_workload(options)))
+            return
+
+        results = {}
+        for profile in PROFILES:
+            with tempfile.TemporaryDirectory() as directory:
+                env = {**os.environ, 'DATABASE_PROFILE': profile, 'DATABASE_NAME': os.path.join(directory, 'bench.sqlite3')}
+                output = subprocess.run(
+                    [sys.executable, sys.argv[0], 'bench_sqlite', '--worker',
+                     '--writers', str(options['writers']), '--readers', str(options['readers']),
+                     '--seconds', str(options['seconds'])],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+            results[profile] = json.loads(output.strip().splitlines()[-1])
+
+        self.stdout.write(
+            f"{options['writers']} writer and {options['readers']} reader threads for {options['seconds']}s"
+        )
+        self.stdout.write(f"{'profile':12} {'writes/s':>10} {'reads/s':>10} {'locked errors':>14}")
+        for profile, result in results.items():
+            self.stdout.write(
+                f"{profile:12} {result['writes'] / result['seconds']:10.1f} "
+                f"{result['reads'] / result['seconds']:10.1f} {result['locked']:14}"
+            )
+
+    def run_workload(self, options):
+        call_command('migrate', verbosity=0)
+        ids = seed_hospital(doctors=20, patients=200, appointments=20000, lab_reports=0)
+        counts = {'writes': 0, 'reads': 0, 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+        # Far from the seeded appointments, and a distinct slot for every write
+        base = timezone.now() + timedelta(days=3650)
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def writer(n):
+            doctor_id = ids['doctors'][n % len(ids['doctors'])]
+            i = 0
+            while time.perf_counter() < deadline:
+                when = base + timedelta(minutes=30 * (i * options['writers'] + n))
+                try:
+                    # Shaped like a booking: check the slot, then insert
+                    with transaction.atomic():
+                        if not Appointment.objects.filter(doctor_id=doctor_id, time=when).exists():
+                            Appointment.objects.create(
+                                patient_id=ids['patients'][i % len(ids['patients'])], doctor_id=doctor_id, time=when,
+                                status='pending',
+                            )
+                    count('writes')
+                except OperationalError:
+                    count('locked')
+                i += 1
+            connections.close_all()
+
+        def reader(n):
+            doctor_id = ids['doctors'][n % len(ids['doctors'])]
+            while time.perf_counter() < deadline:
+                try:
+                    list(Appointment.objects.filter(doctor_id=doctor_id).order_by('time')[:50])
+                    count('reads')
+                except OperationalError:
+                    count('locked')
+            connections.close_all()
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(options['writers'])]
+        threads += [threading.Thread(target=reader, args=(n,)) for n in range(options['readers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {**counts, 'seconds': time.perf_counter() - start}
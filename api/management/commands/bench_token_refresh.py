@@ -0,0 +1,108 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from api.benchmark import _batched, scratch_database, seed_hospital, timed
+from api.models import User
+from api.revocation import PRUNE_LOCK_KEY, is_revoked, prune_expired, revocations
+from api.views import MyTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh-token rotation throughput with millions of historical outstanding/blacklisted "
+        "tokens: the blacklist table lookup against the Bloom filter (JWT_REVOCATION_FILTER), and "
+        "the effect of pruning expired tokens."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=2000000, help="Historical tokens, all blacklisted")
+        parser.add_argument('--expired', type=float, default=0.75, help="Share of them already expired")
+        parser.add_argument('--refreshes', type=int, default=500)
+
+    def seed_tokens(self, count, expired_share, user_ids):
+        now = timezone.now()
+        lifetime = settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME']
+        expired = int(count * expired_share)
+        _batched(
+            (OutstandingToken(
+                user_id=user_ids[i % len(user_ids)], jti=uuid.uuid4().hex, token='',
+                created_at=now - lifetime * 2, expires_at=now - timedelta(days=1) if i < expired else now + lifetime,
+            ) for i in range(count)),
+            OutstandingToken, 10000,
+        )
+        # Every rotation blacklists the token it replaces
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {BlacklistedToken._meta.db_table} (token_id, blacklisted_at) "
+                f"SELECT id, created_at FROM {OutstandingToken._meta.db_table}"
+            )
+
+    def run_refreshes(self, user, count):
+        client = Client()
+        refresh = str(MyTokenObtainPairSerializer.get_token(user))
+        queries = 0
+        start = time.perf_counter()
+        for _ in range(count):
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = client.post(reverse('token_refresh'), {'refresh': refresh})
+            assert response.status_code == 200, response.content
+            refresh = response.json()['refresh']
+            queries += len(context.captured_queries)
+        elapsed = time.perf_counter() - start
+        return count / elapsed, queries / count
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            ids = seed_hospital(doctors=10, patients=1000, appointments=0, lab_reports=0)
+            user = User.objects.get(pk=ids['patients'][0])
+            start = time.perf_counter()
+            self.seed_tokens(options['tokens'], options['expired'], ids['patients'])
+            self.stdout.write(f"Seeded {options['tokens']} blacklisted tokens in {time.perf_counter() - start:.1f}s")
+
+            cache.clear()
+            cache.set(PRUNE_LOCK_KEY, 'benchmark', timeout=None)  # prune explicitly below
+            rows, checks = [], {}
+            jti = uuid.uuid4().hex  # not revoked, the common case
+            with override_settings(JWT_REVOCATION_FILTER=False):
+                checks['table lookup'] = timed(lambda: [is_revoked(jti) for _ in range(1000)])
+                rows.append(('table lookup', *self.run_refreshes(user, options['refreshes'])))
+            with override_settings(JWT_REVOCATION_FILTER=True):
+                revocations.reset()
+                start = time.perf_counter()
+                revocations.sync()
+                build = time.perf_counter() - start
+                checks['bloom filter'] = timed(lambda: [is_revoked(jti) for _ in range(1000)])
+                rows.append(('bloom filter', *self.run_refreshes(user, options['refreshes'])))
+                bloom = revocations._filter
+
+            start = time.perf_counter()
+            pruned = prune_expired()
+            prune = time.perf_counter() - start
+            with override_settings(JWT_REVOCATION_FILTER=True):
+                revocations.reset()
+                revocations.sync()
+                rows.append(('pruned + bloom filter', *self.run_refreshes(user, options['refreshes'])))
+            revocations.reset()
+
+        self.stdout.write(
+            f"Bloom filter: {bloom.count} jtis in {len(bloom.bits) / 1024 / 1024:.1f} MiB, "
+            f"{bloom.hashes} hashes, built in {build:.1f}s"
+        )
+        self.stdout.write(f"Pruned {pruned} expired tokens in {prune:.1f}s")
+        for name, ms in checks.items():
+            self.stdout.write(f"is_revoked() on an unrevoked jti, {name}: {ms:.1f} us")
+        self.stdout.write(f"{'revocation check':24} {'refresh/s':>10} {'queries':>8}")
+        for name, rate, queries in rows:
+            self.stdout.write(f"{name:24} {rate:10.1f} {queries:8.1f}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.uploads import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete resumable lab report uploads that have been idle longer than LAB_REPORT_UPLOAD_EXPIRY."
+
+    def handle(self, *args, **options):
+        purged = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} abandoned upload session(s)."))
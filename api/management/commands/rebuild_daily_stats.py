@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily statistics tables from appointments, patient profiles and lab reports."
+
+    def handle(self, *args, **options):
+        rows = rebuild()
+        summary = ", ".join(f"{name}: {count}" for name, count in rows.items())
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily statistics ({summary})."))
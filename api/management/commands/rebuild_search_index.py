@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.search import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recreate the full-text search index over pre-visit reports and lab reports."
+
+    def handle(self, *args, **options):
+        documents = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {documents} document(s)."))
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_alter_doctorprofile_location_alter_labreport_patient'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctorprofile',
+            name='department',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='doctors', to='api.department'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'time'], name='appointment_doctor_time'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'time'], name='appointment_patient_time'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'time'], name='appointment_status_time'),
+        ),
+        migrations.AddIndex(
+            model_name='labreport',
+            index=models.Index(fields=['patient', 'uploaded_at'], name='labreport_patient_uploaded'),
+        ),
+        migrations.AddIndex(
+            model_name='labreport',
+            index=models.Index(fields=['report_type', 'uploaded_at'], name='labreport_type_uploaded'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:38
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+RELEASED_STATUSES = ['canceled', 'rejected']
+
+
+def cancel_double_bookings(apps, schema_editor):
+    # Existing double bookings would make the constraint fail; the first
+    # booking of each slot keeps it and the others are canceled
+    Appointment = apps.get_model('api', 'Appointment')
+    active = Appointment.objects.exclude(status__in=RELEASED_STATUSES)
+    doubled = active.values('doctor', 'time').order_by() \
+        .annotate(count=Count('id'), first=Min('id')).filter(count__gt=1)
+    canceled = []
+    for slot in doubled.iterator():
+        canceled += active.filter(doctor=slot['doctor'], time=slot['time']).exclude(id=slot['first']) \
+            .values_list('id', flat=True)
+    if canceled:
+        Appointment.objects.filter(id__in=canceled).update(status='canceled')
+        print(f"\n  Canceled {len(canceled)} double-booked appointment(s): {', '.join(map(str, canceled))}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_workinghours'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_double_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['canceled', 'rejected']), _negated=True), fields=('doctor', 'time'), name='unique_active_doctor_slot'),
+        ),
+    ]
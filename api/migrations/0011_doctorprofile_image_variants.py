@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:43
+
+import api.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_labreportupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='doctorprofile',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='doctor_images/', validators=[api.images.validate_doctor_image]),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+
+
+def count_existing_rows(apps, schema_editor):
+    # The summaries start from the rows already there; signals keep them current from now on
+    Appointment = apps.get_model('api', 'Appointment')
+    AppointmentDailyStat = apps.get_model('api', 'AppointmentDailyStat')
+    LabReport = apps.get_model('api', 'LabReport')
+    LabReportDailyStat = apps.get_model('api', 'LabReportDailyStat')
+    PatientDailyStat = apps.get_model('api', 'PatientDailyStat')
+    PatientProfile = apps.get_model('api', 'PatientProfile')
+    sources = [
+        (
+            Appointment.objects.values('doctor', 'status', day=TruncDate('time')),
+            lambda row: AppointmentDailyStat(doctor_id=row['doctor'], day=row['day'], status=row['status']),
+        ),
+        (
+            PatientProfile.objects.values(day=F('created_at')),
+            lambda row: PatientDailyStat(day=row['day']),
+        ),
+        (
+            LabReport.objects.exclude(report_type=None).values('report_type', day=TruncDate('uploaded_at')),
+            lambda row: LabReportDailyStat(report_type_id=row['report_type'], day=row['day']),
+        ),
+    ]
+    for groups, build in sources:
+        stats = []
+        for row in groups.order_by().annotate(total=Count('id')).iterator():
+            stat = build(row)
+            stat.count = row['total']
+            stats.append(stat)
+        if stats:
+            type(stats[0]).objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_doctorprofile_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AppointmentDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('completed', 'Completed'), ('canceled', 'canceled'), ('no-show', 'no-show')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='appointmentstat_day')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day', 'status'), name='unique_appointment_daily_stat')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LabReportDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('report_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.reporttype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='labreportstat_day')],
+                'constraints': [models.UniqueConstraint(fields=('report_type', 'day'), name='unique_labreport_daily_stat')],
+            },
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
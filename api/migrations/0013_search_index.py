@@ -0,0 +1,86 @@
+from django.db import migrations
+
+# Copies of api/search.py as of this migration, so later changes there do not
+# change what it does
+PREVISIT_KIND, LAB_REPORT_KIND, KIND_COUNT = 0, 1, 2
+QUESTION_KEYS = ('question', 'question_id')
+BATCH_SIZE = 2000
+
+INSERT_DOCUMENT = (
+    "INSERT INTO api_search_index "
+    "(rowid, kind, object_id, patient_id, appointment_id, patient_name, title, body) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+)
+INSERT_LAB_REPORTS = (
+    "INSERT INTO api_search_index "
+    "(rowid, kind, object_id, patient_id, appointment_id, patient_name, title, body) "
+    "SELECT report.id * %s + %s, 'lab_report', report.id, patient.id, NULL, "
+    "TRIM(patient.first_name || ' ' || patient.last_name), COALESCE(report_type.name, ''), report.report "
+    "FROM api_labreport report "
+    "JOIN api_patientprofile profile ON profile.id = report.patient_id "
+    "JOIN api_user patient ON patient.id = profile.user_id "
+    "LEFT JOIN api_reporttype report_type ON report_type.id = report.report_type_id"
+)
+
+
+def strings(value, question_ids):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in QUESTION_KEYS and str(item).isdigit():
+                question_ids.add(int(item))
+                continue
+            if str(key).isdigit():
+                question_ids.add(int(key))
+            yield from strings(item, question_ids)
+    elif isinstance(value, list):
+        for item in value:
+            yield from strings(item, question_ids)
+    elif isinstance(value, str):
+        yield value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield str(value)
+
+
+def index_existing_reports(apps, schema_editor):
+    PreVisitQuestion = apps.get_model('api', 'PreVisitQuestion')
+    PreVisitReport = apps.get_model('api', 'PreVisitReport')
+    questions = dict(PreVisitQuestion.objects.values_list('pk', 'question_text'))
+    reports = PreVisitReport.objects.order_by('pk').values_list(
+        'pk', 'responses', 'appointment_id', 'appointment__patient_id',
+        'appointment__patient__first_name', 'appointment__patient__last_name',
+    )
+    with schema_editor.connection.cursor() as cursor:
+        batch = []
+        for pk, responses, appointment_id, patient_id, first_name, last_name in reports.iterator():
+            question_ids = set()
+            answers = ' '.join(strings(responses, question_ids))
+            asked = ' '.join(questions[question] for question in sorted(question_ids) if question in questions)
+            batch.append((
+                pk * KIND_COUNT + PREVISIT_KIND, 'previsit_report', pk, patient_id, appointment_id,
+                f'{first_name} {last_name}'.strip(), asked, answers,
+            ))
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany(INSERT_DOCUMENT, batch)
+                batch = []
+        cursor.executemany(INSERT_DOCUMENT, batch)
+        cursor.execute(INSERT_LAB_REPORTS, [KIND_COUNT, LAB_REPORT_KIND])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_daily_stats'),
+    ]
+
+    # Full-text index over pre-visit and lab reports, maintained by api/search.py
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                "CREATE VIRTUAL TABLE api_search_index USING fts5("
+                "kind UNINDEXED, object_id UNINDEXED, patient_id UNINDEXED, appointment_id UNINDEXED, "
+                "patient_name, title, body, tokenize = 'unicode61 remove_diacritics 2')"
+            ),
+            reverse_sql="DROP TABLE api_search_index",
+        ),
+        migrations.RunPython(index_existing_reports, migrations.RunPython.noop),
+    ]
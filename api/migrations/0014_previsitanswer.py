@@ -0,0 +1,83 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copies of api/previsit.py as of this migration, so later changes there do
+# not change what it does
+QUESTION_KEYS = ('question', 'question_id')
+ANSWER_KEYS = ('answer', 'response', 'value')
+VALUE_LENGTH = 255
+
+
+def normalize(answer):
+    return ' '.join(str(answer).split()).casefold()[:VALUE_LENGTH]
+
+
+def text(answer):
+    if isinstance(answer, list):
+        return ', '.join(text(item) for item in answer if item not in (None, ''))
+    if isinstance(answer, bool):
+        return 'yes' if answer else 'no'
+    return '' if answer is None else str(answer)
+
+
+def extract_answers(responses):
+    answers = {}
+    if isinstance(responses, dict):
+        items = ((key, value) for key, value in responses.items() if str(key).isdigit())
+    elif isinstance(responses, list):
+        items = (
+            (next((entry[k] for k in QUESTION_KEYS if k in entry), None),
+             next((entry[k] for k in ANSWER_KEYS if k in entry), None))
+            for entry in responses if isinstance(entry, dict)
+        )
+    else:
+        items = ()
+    for question, answer in items:
+        if str(question).isdigit() and text(answer):
+            answers[int(question)] = text(answer)
+    return answers
+
+
+def backfill_answers(apps, schema_editor):
+    PreVisitAnswer = apps.get_model('api', 'PreVisitAnswer')
+    PreVisitQuestion = apps.get_model('api', 'PreVisitQuestion')
+    PreVisitReport = apps.get_model('api', 'PreVisitReport')
+    known = set(PreVisitQuestion.objects.values_list('pk', flat=True))
+    batch = []
+    for pk, responses in PreVisitReport.objects.values_list('pk', 'responses').iterator():
+        batch.extend(
+            PreVisitAnswer(report_id=pk, question_id=question, answer=text, value=normalize(text))
+            for question, text in extract_answers(responses).items() if question in known
+        )
+        if len(batch) >= 5000:
+            PreVisitAnswer.objects.bulk_create(batch)
+            batch = []
+    PreVisitAnswer.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreVisitAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.TextField()),
+                ('value', models.CharField(max_length=255)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='api.previsitquestion')),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='api.previsitreport')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'value'], name='previsitanswer_question_value')],
+                'constraints': [models.UniqueConstraint(fields=('report', 'question'), name='unique_previsit_answer')],
+            },
+        ),
+        migrations.RunPython(backfill_answers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:02
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def lowercase_pending(apps, schema_editor):
+    # Appointments used to default to "Pending", which is not one of the
+    # status choices, so the dashboard statistics never counted them
+    Appointment = apps.get_model('api', 'Appointment')
+    AppointmentDailyStat = apps.get_model('api', 'AppointmentDailyStat')
+    Appointment.objects.filter(status='Pending').update(status='pending')
+    for stat in AppointmentDailyStat.objects.filter(status='Pending').iterator():
+        merged, created = AppointmentDailyStat.objects.get_or_create(
+            doctor_id=stat.doctor_id, day=stat.day, status='pending', defaults={'count': stat.count}
+        )
+        if not created:
+            AppointmentDailyStat.objects.filter(pk=merged.pk).update(count=F('count') + stat.count)
+    AppointmentDailyStat.objects.filter(status='Pending').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_previsitanswer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('completed', 'Completed'), ('canceled', 'canceled'), ('no-show', 'no-show')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(lowercase_pending, migrations.RunPython.noop),
+    ]
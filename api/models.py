@@ -1,13 +1,74 @@
+import copy
 import os
+import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.utils.translation import gettext_lazy as _
 
 from django.core.files.storage import default_storage
 
+from .images import delete_variants, schedule_variants, validate_doctor_image
+
+
+# Remembers the values of selected fields as they were loaded from the database,
+# so saves and signals can tell what changed without re-reading the row.
+class FieldTrackerMixin:
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def _tracked_value(self, name, value=None, fetched=False):
+        field = self._meta.get_field(name)
+        if not fetched:
+            value = getattr(self, field.attname)
+        if isinstance(field, models.FileField):
+            return getattr(value, 'name', value) or None
+        return value
+
+    def _snapshot_tracked_fields(self, names=None):
+        """Remember the current values of the tracked fields (of those in `names`, if given)."""
+        deferred = self.get_deferred_fields()
+        loaded = getattr(self, '_loaded_values', {}) if names is not None else {}
+        # Deep copies, so in-place edits of JSONField values still count as changes
+        loaded.update({
+            name: copy.deepcopy(self._tracked_value(name)) for name in self.tracked_fields
+            if self._meta.get_field(name).attname not in deferred
+            and (names is None or name in names or self._meta.get_field(name).attname in names)
+        })
+        self._loaded_values = loaded
+
+    def get_original(self, name):
+        """Value of `name` when the instance was loaded (None for unsaved instances)."""
+        if self.pk is None:
+            return None
+        loaded = getattr(self, '_loaded_values', {})
+        if name not in loaded:
+            # Built by hand or loaded with the field deferred: ask the database once
+            value = type(self)._base_manager.filter(pk=self.pk).values_list(name, flat=True).first()
+            loaded[name] = self._tracked_value(name, value, fetched=True)
+            self._loaded_values = loaded
+        return loaded[name]
+
+    def has_changed(self, name):
+        return self.get_original(name) != self._tracked_value(name)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Fields left out of update_fields were not written; they still differ from the row
+        update_fields = kwargs.get('update_fields')
+        self._snapshot_tracked_fields(None if update_fields is None else set(update_fields))
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked_fields()
+
 
 # User Model with Role-Based Access Control
-class User(AbstractUser):
+class User(FieldTrackerMixin, AbstractUser):
     class Role(models.TextChoices):
         PATIENT = "PATIENT", _("Patient")
         DOCTOR = "DOCTOR", _("Doctor")
@@ -20,6 +81,8 @@ class User(AbstractUser):
     groups = models.ManyToManyField(Group, related_name="custom_user_groups", blank=True)
     user_permissions = models.ManyToManyField(Permission, related_name="custom_user_permissions", blank=True)
 
+    tracked_fields = ('role', 'is_active', 'first_name', 'last_name')
+
 # Department Model
 class Department(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -29,9 +92,11 @@ class Department(models.Model):
         return self.name
     
 # Doctor Profile
-class DoctorProfile(models.Model):
+class DoctorProfile(FieldTrackerMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="doctor_profile")
-    image = models.ImageField(upload_to="doctor_images/", blank=True, null=True)
+    image = models.ImageField(upload_to="doctor_images/", blank=True, null=True, validators=[validate_doctor_image])
+    # Stored names of the resized copies, {variant: {format: name}}; filled in by api/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     location = models.CharField(max_length=255, null=True, blank=True)
     department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, related_name="doctors", blank=True)
     title = models.CharField(max_length=255, blank=True, null=True)
@@ -40,16 +105,47 @@ class DoctorProfile(models.Model):
     def __str__(self):
             return f'{self.user.first_name} {self.user.last_name}'
 
+    tracked_fields = ('image', 'image_variants')
+
     def save(self, *args, **kwargs):
+        image_changed = bool(self.image)
         # Check if the object already exists in the database
         if self.pk:
-            existing = DoctorProfile.objects.get(pk=self.pk)
-            if existing.image and self.image != existing.image:
-                # Delete the old image if a new one is uploaded
-                if default_storage.exists(existing.image.name):
-                    default_storage.delete(existing.image.name)
+            old_image = self.get_original('image')
+            image_changed = self.has_changed('image')
+            if old_image and image_changed:
+                # Delete the old image and its resized copies if a new one is uploaded
+                if default_storage.exists(old_image):
+                    default_storage.delete(old_image)
+                delete_variants(default_storage, self.get_original('image_variants'))
+            if image_changed:
+                self.image_variants = {}
 
         super().save(*args, **kwargs)
+        if image_changed and self.image:
+            schedule_variants(self)
+
+# Doctor Working Hours (used to compute free appointment slots)
+class WorkingHours(models.Model):
+    class Weekday(models.IntegerChoices):
+        MONDAY = 0, _("Monday")
+        TUESDAY = 1, _("Tuesday")
+        WEDNESDAY = 2, _("Wednesday")
+        THURSDAY = 3, _("Thursday")
+        FRIDAY = 4, _("Friday")
+        SATURDAY = 5, _("Saturday")
+        SUNDAY = 6, _("Sunday")
+
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="working_hours")
+    weekday = models.IntegerField(choices=Weekday.choices)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        ordering = ['weekday', 'start_time']
+
+    def __str__(self):
+        return f'{self.doctor} - {self.get_weekday_display()} {self.start_time:%H:%M}-{self.end_time:%H:%M}'
 
 # Patient Model
 class PatientProfile(models.Model):
@@ -59,9 +155,16 @@ class PatientProfile(models.Model):
     bmi = models.FloatField(blank=True, null=True)
     created_at = models.DateField(auto_now_add=True)
 
+    @staticmethod
+    def compute_bmi(height, weight):
+        """BMI from height (cm) and weight (kg), or None when either is unknown."""
+        if height and weight:
+            return round(weight / ((height / 100) ** 2), 2)
+        return None
+
     def save(self, *args, **kwargs):
         if self.height and self.weight:
-            self.bmi = round(self.weight / ((self.height / 100) ** 2), 2)
+            self.bmi = self.compute_bmi(self.height, self.weight)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -69,7 +172,9 @@ class PatientProfile(models.Model):
 
 
 # Report Type Model
-class ReportType(models.Model):
+class ReportType(FieldTrackerMixin, models.Model):
+    tracked_fields = ('name',)  # see api/search.py
+
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True, null=True)
 
@@ -77,17 +182,53 @@ class ReportType(models.Model):
         return self.name
 
 # Lab Reports
-class LabReport(models.Model):
+class LabReport(FieldTrackerMixin, models.Model):
+    tracked_fields = ('report_type', 'uploaded_at')  # see LabReportDailyStat
+
     patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="lab_reports")
     report = models.FileField(upload_to="lab_reports/")
     report_type = models.ForeignKey(ReportType, on_delete=models.SET_NULL, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Reports are always listed newest/oldest first within a patient or type
+        indexes = [
+            models.Index(fields=['patient', 'uploaded_at'], name='labreport_patient_uploaded'),
+            models.Index(fields=['report_type', 'uploaded_at'], name='labreport_type_uploaded'),
+        ]
     
     def __str__(self):
         return f'{self.patient.user.first_name} {self.patient.user.last_name} - {self.report_type.name}'    
 
+# Resumable lab report upload session; chunks live on disk until finalized (see api/uploads.py)
+class LabReportUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lab_report_uploads")
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name="lab_report_uploads")
+    report_type = models.ForeignKey(ReportType, on_delete=models.SET_NULL, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)  # hex SHA-256 of the whole file
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size)
+
+    def chunk_length(self, number):
+        if number == self.chunk_count - 1:
+            return self.size - self.chunk_size * number
+        return self.chunk_size
+
+    def __str__(self):
+        return f'{self.filename} ({self.patient})'
+
 # Appointment Model
-class Appointment(models.Model):
+class Appointment(FieldTrackerMixin, models.Model):
+    tracked_fields = ('doctor', 'time', 'status')  # see AppointmentDailyStat
+
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('approved', 'Approved'),
@@ -96,17 +237,39 @@ class Appointment(models.Model):
         ('canceled', 'canceled'),
         ('no-show', 'no-show'),
     ]
+    # Statuses that no longer hold the doctor's slot (see unique_active_doctor_slot)
+    RELEASED_STATUSES = ('canceled', 'rejected')
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments")
     doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="doctor_appointments")
     time = models.DateTimeField()
-    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="Pending")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
     description = models.TextField(blank=True, null=True)
 
+    class Meta:
+        # Appointments are filtered by doctor, patient or status and read in time order
+        indexes = [
+            models.Index(fields=['doctor', 'time'], name='appointment_doctor_time'),
+            models.Index(fields=['patient', 'time'], name='appointment_patient_time'),
+            models.Index(fields=['status', 'time'], name='appointment_status_time'),
+        ]
+        # A doctor's slot can only be held by one live appointment; canceled and
+        # rejected ones release it. Enforced by the database so concurrent
+        # bookings cannot both succeed.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'time'],
+                condition=~models.Q(status__in=['canceled', 'rejected']),
+                name='unique_active_doctor_slot',
+            ),
+        ]
+
     def __str__(self):
         return f'{self.patient.first_name} {self.patient.last_name} on {self.time}'
 
 # Pre-visit Question Model
-class PreVisitQuestion(models.Model):
+class PreVisitQuestion(FieldTrackerMixin, models.Model):
+    tracked_fields = ('question_text',)  # see api/search.py
+
     department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name="pre_visit_questions")
     question_text = models.TextField()
 
@@ -114,10 +277,69 @@ class PreVisitQuestion(models.Model):
         return f'{self.department.name} - {self.question_text}'
 
 # Pre-visit Report
-class PreVisitReport(models.Model):
+class PreVisitReport(FieldTrackerMixin, models.Model):
+    tracked_fields = ('responses',)  # see api/previsit.py
+
     appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name="pre_visit_report")
     responses = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f'{self.appointment.patient.first_name} {self.appointment.patient.last_name} | {self.appointment.time} | {self.appointment.doctor.doctor_profile.department.name}'
\ No newline at end of file
+        return f'{self.appointment.patient.first_name} {self.appointment.patient.last_name} | {self.appointment.time} | {self.appointment.doctor.doctor_profile.department.name}'
+
+# One answer of a pre-visit report, written from `responses` by api/previsit.py
+class PreVisitAnswer(models.Model):
+    report = models.ForeignKey(PreVisitReport, on_delete=models.CASCADE, related_name="answers")
+    question = models.ForeignKey(PreVisitQuestion, on_delete=models.CASCADE, related_name="answers")
+    answer = models.TextField()
+    value = models.CharField(max_length=255)  # normalized answer used for lookups
+
+    class Meta:
+        # Filters ask "which reports answered question Y with Z"
+        indexes = [models.Index(fields=['question', 'value'], name='previsitanswer_question_value')]
+        constraints = [models.UniqueConstraint(fields=['report', 'question'], name='unique_previsit_answer')]
+
+    def __str__(self):
+        return f'{self.question_id}: {self.answer}'
+
+
+# Daily statistics, kept current by api/signals.py (and api/batch.py for bulk
+# writes) and rebuilt from scratch by `manage.py rebuild_daily_stats`.
+# Days are in the current time zone.
+class AppointmentDailyStat(models.Model):
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    day = models.DateField()
+    status = models.CharField(max_length=10, choices=Appointment.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['day'], name='appointmentstat_day')]
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'day', 'status'], name='unique_appointment_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f'{self.doctor_id} {self.day} {self.status}: {self.count}'
+
+class PatientDailyStat(models.Model):
+    day = models.DateField(unique=True)
+    count = models.IntegerField(default=0)  # patient profiles created that day
+
+    def __str__(self):
+        return f'{self.day}: {self.count}'
+
+# Reports without a type are not counted; deleting a type drops its rows, as
+# its reports lose the type.
+class LabReportDailyStat(models.Model):
+    report_type = models.ForeignKey(ReportType, on_delete=models.CASCADE, related_name="+")
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['day'], name='labreportstat_day')]
+        constraints = [
+            models.UniqueConstraint(fields=['report_type', 'day'], name='unique_labreport_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f'{self.report_type_id} {self.day}: {self.count}'
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+# Keyset pagination: each page is fetched with a `WHERE <key> > <cursor>`
+# seek instead of an OFFSET scan, so deep pages cost the same as page one.
+# The trailing `id` breaks ties between rows sharing the same timestamp.
+class KeysetPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = ('time', 'id')
+
+
+class LabReportPagination(KeysetPagination):
+    ordering = ('uploaded_at', 'id')
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
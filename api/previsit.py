@@ -0,0 +1,70 @@
+"""
+Per-question pre-visit answers.
+
+`PreVisitReport.responses` stays whatever JSON the frontend sends. When a
+report is saved its answers are also written to PreVisitAnswer, one row per
+question, with a normalized copy of the answer indexed together with the
+question, so "who answered Y with Z" is an index lookup instead of a scan of
+every report.
+
+Two response shapes are understood:
+    {"<question id>": <answer>, ...}
+    [{"question": <id>, "answer": <answer>}, ...]   ("question_id" also works)
+Lists of answers are joined with ", ".
+"""
+from .models import PreVisitAnswer, PreVisitQuestion
+
+QUESTION_KEYS = ('question', 'question_id')
+ANSWER_KEYS = ('answer', 'response', 'value')
+VALUE_LENGTH = PreVisitAnswer._meta.get_field('value').max_length
+
+
+def normalize(answer):
+    """Lookup form of an answer: case-folded, whitespace collapsed, truncated to the column size."""
+    return ' '.join(str(answer).split()).casefold()[:VALUE_LENGTH]
+
+
+def _text(answer):
+    if isinstance(answer, list):
+        return ', '.join(_text(item) for item in answer if item not in (None, ''))
+    if isinstance(answer, bool):
+        return 'yes' if answer else 'no'
+    return '' if answer is None else str(answer)
+
+
+def extract_answers(responses):
+    """{question id: answer text} from a responses blob; unrecognized entries are ignored."""
+    answers = {}
+    if isinstance(responses, dict):
+        items = ((key, value) for key, value in responses.items() if str(key).isdigit())
+    elif isinstance(responses, list):
+        items = (
+            (next((entry[k] for k in QUESTION_KEYS if k in entry), None),
+             next((entry[k] for k in ANSWER_KEYS if k in entry), None))
+            for entry in responses if isinstance(entry, dict)
+        )
+    else:
+        items = ()
+    for question, answer in items:
+        if str(question).isdigit() and _text(answer):
+            answers[int(question)] = _text(answer)
+    return answers
+
+
+def sync_answers(report):
+    """Replace the PreVisitAnswer rows of `report` with those in its responses."""
+    answers = extract_answers(report.responses)
+    known = set(PreVisitQuestion.objects.filter(pk__in=answers).values_list('pk', flat=True)) if answers else set()
+    PreVisitAnswer.objects.filter(report_id=report.pk).delete()
+    PreVisitAnswer.objects.bulk_create(
+        PreVisitAnswer(report_id=report.pk, question_id=question, answer=text, value=normalize(text))
+        for question, text in answers.items() if question in known
+    )
+
+
+def filter_by_answer(appointments, question_id, answers):
+    """Appointments whose pre-visit report answered `question_id` with any of `answers` (case-insensitive)."""
+    return appointments.filter(
+        pre_visit_report__answers__question_id=question_id,
+        pre_visit_report__answers__value__in=[normalize(answer) for answer in answers],
+    )
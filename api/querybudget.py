@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+# Maximum number of SQL queries each read endpoint may issue, keyed by URL name.
+# The numbers are independent of page size: a list endpoint that grows with the
+# number of rows it renders has an N+1 and must fail the test suite.
+ENDPOINT_QUERY_BUDGETS = {
+    'user-list': 3,                     # users + groups + user_permissions
+    'user-detail': 3,
+    'department-list': 1,
+    'department-detail': 1,
+    'doctorprofile-list': 3,            # doctors/users/departments + groups + user_permissions
+    'doctorprofile-detail': 3,
+    'doctors-by-department': 4,         # department lookup + the doctorprofile-list queries
+    'doctor-slots-by-department': 4,    # department check + doctors + working hours + appointments
+    'doctor-slots': 4,
+    'patientprofile-list': 4,           # patients/users + latest lab_reports + groups + user_permissions
+    'patientprofile-detail': 4,
+    'reporttype-list': 1,
+    'reporttype-detail': 1,
+    'labreport-list': 1,
+    'labreport-detail': 1,
+    'lab-reports-by-type': 2,           # report type lookup + reports
+    'get_patient_lab_reports': 1,
+    'appointment-list': 1,
+    'appointment-detail': 1,
+    'appointment-stats': 1,             # one GROUP BY over the daily statistics
+    'daily-stats': 2,                   # new patients + lab reports per type
+    'search': 1,                        # one FTS5 MATCH
+    'async-appointment-list': 1,
+    'async-doctor-list': 3,
+    'async-labreport-list': 1,
+    'async-previsitreport-detail': 1,
+    'patient-appointments-admin': 1,
+    'previsitquestion-list': 1,
+    'previsitquestion-detail': 1,
+    'previsitreport-list': 1,
+    'previsitreport-detail': 1,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(max_queries, label='block', using=DEFAULT_DB_ALIAS):
+    """
+    Fail with QueryBudgetExceeded when the wrapped block runs more than
+    `max_queries` SQL statements. Yields the capture context so callers can
+    inspect `captured_queries` afterwards.
+    """
+    context = CaptureQueriesContext(connections[using])
+    with context:
+        yield context
+
+    executed = len(context.captured_queries)
+    if executed > max_queries:
+        statements = '\n'.join(
+            f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1)
+        )
+        raise QueryBudgetExceeded(
+            f'{label} ran {executed} queries, budget is {max_queries}:\n{statements}'
+        )
+
+
+def endpoint_budget(url_name, using=DEFAULT_DB_ALIAS):
+    """Query budget context for the endpoint registered under `url_name`."""
+    return query_budget(ENDPOINT_QUERY_BUDGETS[url_name], label=url_name, using=using)
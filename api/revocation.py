@@ -0,0 +1,207 @@
+"""
+Refresh-token revocation backed by simplejwt's token_blacklist tables.
+
+Every refresh (ROTATE_REFRESH_TOKENS + BLACKLIST_AFTER_ROTATION) and logout
+adds a BlacklistedToken row, and every refresh asks whether the presented
+token is blacklisted. Two things keep that cheap as the tables grow:
+
+* Pruning. Rows of tokens past their expiry can never matter again (an
+  expired token fails verification anyway), so `maybe_prune()` deletes them
+  at most once per TOKEN_PRUNE_INTERVAL, triggered by the revocations
+  themselves. It runs on the request path, so each call deletes a single
+  batch; a backlog is worked off by the following revocations. simplejwt's
+  `flushexpiredtokens` command deletes everything on demand.
+
+* A Bloom filter. With JWT_REVOCATION_FILTER enabled each process keeps the
+  blacklisted jtis in a `BloomFilter`. A jti the filter has never seen is not
+  revoked, without touching the database; the rare "maybe" is confirmed
+  against the table, so false positives cost one query and never reject a
+  valid token. Revocations bump a counter in the cache, and a process that
+  sees the counter move loads only the rows added since its last look. The
+  counter must be visible to every worker, so like JWT_STATELESS_READS this
+  needs a shared cache backend.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+REVOCATIONS_KEY = 'token_revocations'
+PRUNE_LOCK_KEY = 'token_revocations_pruned'
+# Smallest filter built, in entries
+MIN_CAPACITY = 1024
+PRUNE_BATCH_SIZE = 5000
+# Rows maybe_prune() deletes per revocation
+REQUEST_PRUNE_BATCH_SIZE = 1000
+
+
+def _fresh_version():
+    # A counter lost from the cache never comes back with a value a filter already synced to
+    return time.time_ns() // 1000
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a false positive rate of about `error_rate` up to `capacity`."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from two independent 64-bit hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """Per-process Bloom filter of blacklisted jtis, kept in step with the table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._version = None
+
+    def _rebuild(self):
+        last_id = BlacklistedToken.objects.aggregate(last=Max('id'))['last'] or 0
+        # Expired tokens fail verification before it matters whether they were revoked
+        jtis = BlacklistedToken.objects.filter(id__lte=last_id, token__expires_at__gt=timezone.now()) \
+            .values_list('token__jti', flat=True)
+        jtis = list(jtis.iterator(chunk_size=10000))
+        self._filter = BloomFilter(max(2 * len(jtis), MIN_CAPACITY), settings.JWT_REVOCATION_FILTER_ERROR_RATE)
+        for jti in jtis:
+            self._filter.add(jti)
+        self._last_id = last_id
+
+    def _catch_up(self):
+        for pk, jti in BlacklistedToken.objects.filter(id__gt=self._last_id).values_list('id', 'token__jti'):
+            self._filter.add(jti)
+            self._last_id = max(self._last_id, pk)
+
+    def sync(self):
+        version = cache.get(REVOCATIONS_KEY)
+        if version is None:
+            cache.add(REVOCATIONS_KEY, _fresh_version(), timeout=None)
+            version = cache.get(REVOCATIONS_KEY)
+        if self._filter is not None and version == self._version:
+            return
+        with self._lock:
+            if self._filter is None or self._filter.count > self._filter.capacity:
+                self._rebuild()
+            else:
+                self._catch_up()
+            # Read before loading, so a revocation made meanwhile triggers another load
+            self._version = version
+
+    def add(self, jti):
+        """
+        Add a jti this process revoked. The counter still counts as moved: a
+        revocation made elsewhere at the same time may have bumped it to the
+        same value (not every backend's incr is atomic), so the next sync
+        loads every row since the last one it saw.
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def might_be_revoked(self, jti):
+        self.sync()
+        return jti in self._filter
+
+    def reset(self):
+        with self._lock:
+            self._filter, self._last_id, self._version = None, 0, None
+
+
+revocations = RevocationFilter()
+
+
+def is_revoked(jti):
+    if settings.JWT_REVOCATION_FILTER and not revocations.might_be_revoked(jti):
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def record_revocation(jti):
+    """Tell every process's filter about a new blacklist row."""
+    try:
+        cache.incr(REVOCATIONS_KEY)
+    except ValueError:
+        cache.set(REVOCATIONS_KEY, _fresh_version(), timeout=None)
+    revocations.add(jti)
+    maybe_prune()
+
+
+def prune_expired(batch_size=PRUNE_BATCH_SIZE, max_batches=None):
+    """
+    Delete outstanding and blacklisted tokens that have expired, in batches of
+    `batch_size` (at most `max_batches` of them); returns outstanding rows deleted.
+    """
+    now = timezone.now()
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        # order_by(): OutstandingToken's default ordering would sort every expired row per batch
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now).order_by().values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        # Cascades to the tokens' BlacklistedToken rows
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        batches += 1
+    return deleted
+
+
+def maybe_prune():
+    """
+    One batch of prune_expired() unless another call did within
+    TOKEN_PRUNE_INTERVAL seconds. A full batch may have left expired rows
+    behind, so it lets the next call prune again.
+    """
+    if not cache.add(PRUNE_LOCK_KEY, timezone.now().isoformat(), timeout=settings.TOKEN_PRUNE_INTERVAL):
+        return 0
+    deleted = prune_expired(REQUEST_PRUNE_BATCH_SIZE, max_batches=1)
+    if deleted == REQUEST_PRUNE_BATCH_SIZE:
+        cache.delete(PRUNE_LOCK_KEY)
+    return deleted
+
+
+class RevocableRefreshToken(RefreshToken):
+    """Refresh token whose blacklist checks and writes go through this module."""
+
+    def check_blacklist(self):
+        if is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        result = super().blacklist()
+        record_revocation(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RevocableRefreshToken
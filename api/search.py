@@ -0,0 +1,185 @@
+"""
+Full-text search over pre-visit reports and lab reports.
+
+Both kinds of document live in one SQLite FTS5 table (created by migration
+0013). A pre-visit report is indexed with its patient's name, the responses
+(every string in the JSON) and the text of the questions they refer to; a lab
+report with its patient's name, report type and file name. api/signals.py keeps
+the index in step with the source rows; `rebuild()` recreates it.
+
+Each document's rowid is derived from its kind and primary key, so updates and
+deletes address a single row without scanning the index.
+"""
+import re
+
+from django.db import connection, transaction
+
+from .models import LabReport, PreVisitQuestion, PreVisitReport
+
+TABLE = 'api_search_index'
+# Kind name -> model; the position is part of the rowid, so only append
+KINDS = {
+    'previsit_report': PreVisitReport,
+    'lab_report': LabReport,
+}
+KIND_NAMES = list(KINDS)
+COLUMNS = ('kind', 'object_id', 'patient_id', 'appointment_id', 'patient_name', 'title', 'body')
+# bm25 weight per column; the unindexed id columns never match
+WEIGHTS = (0, 0, 0, 0, 2.0, 1.5, 1.0)
+BATCH_SIZE = 2000
+
+# Question references inside responses: numeric keys, or values of these keys
+QUESTION_KEYS = ('question', 'question_id')
+
+
+def _rowid(kind, pk):
+    return pk * len(KIND_NAMES) + KIND_NAMES.index(kind)
+
+
+def _kind_of(model):
+    return next(kind for kind, kind_model in KINDS.items() if kind_model is model)
+
+
+def _strings(value, question_ids):
+    """Every string in a JSON value; question ids it refers to go into `question_ids`."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in QUESTION_KEYS and str(item).isdigit():
+                question_ids.add(int(item))
+                continue
+            if str(key).isdigit():
+                question_ids.add(int(key))
+            yield from _strings(item, question_ids)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item, question_ids)
+    elif isinstance(value, str):
+        yield value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield str(value)
+
+
+def _full_name(user):
+    return f'{user.first_name} {user.last_name}'.strip()
+
+
+def _previsit_documents(reports):
+    reports = list(reports.select_related('appointment__patient'))
+    referenced = {}
+    for report in reports:
+        question_ids = set()
+        referenced[report.pk] = (' '.join(_strings(report.responses, question_ids)), question_ids)
+    questions = dict(
+        PreVisitQuestion.objects
+        .filter(pk__in=set().union(*(ids for _, ids in referenced.values())))
+        .values_list('pk', 'question_text')
+    )
+    for report in reports:
+        answers, question_ids = referenced[report.pk]
+        asked = ' '.join(questions[pk] for pk in sorted(question_ids) if pk in questions)
+        patient = report.appointment.patient
+        yield (
+            _rowid('previsit_report', report.pk), 'previsit_report', report.pk, patient.pk,
+            report.appointment_id, _full_name(patient), asked, answers,
+        )
+
+
+def _lab_report_documents(reports):
+    for report in reports.select_related('patient__user', 'report_type'):
+        patient = report.patient.user
+        yield (
+            _rowid('lab_report', report.pk), 'lab_report', report.pk, patient.pk, None,
+            _full_name(patient), report.report_type.name if report.report_type else '', report.report.name,
+        )
+
+
+DOCUMENTS = {
+    'previsit_report': _previsit_documents,
+    'lab_report': _lab_report_documents,
+}
+
+
+def _write(rows):
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, {", ".join(COLUMNS)}) VALUES ({", ".join(["%s"] * (len(COLUMNS) + 1))})',
+            rows,
+        )
+
+
+def remove(model, pks):
+    rowids = [_rowid(_kind_of(model), pk) for pk in pks]
+    if rowids:
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(rowid,) for rowid in rowids])
+
+
+def index(model, pks):
+    """(Re)index the `model` rows with primary keys `pks`; missing rows are dropped from the index."""
+    pks = list(pks)
+    kind = _kind_of(model)
+    for offset in range(0, len(pks), BATCH_SIZE):
+        batch = pks[offset:offset + BATCH_SIZE]
+        remove(model, batch)
+        _write(list(DOCUMENTS[kind](model.objects.filter(pk__in=batch))))
+
+
+def rebuild():
+    """Recreate the whole index from the source tables; returns the number of documents."""
+    total = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE}')
+        for kind, model in KINDS.items():
+            pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            for offset in range(0, len(pks), BATCH_SIZE):
+                rows = list(DOCUMENTS[kind](model.objects.filter(pk__in=pks[offset:offset + BATCH_SIZE])))
+                _write(rows)
+                total += len(rows)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def match_expression(text):
+    """
+    Turn free text into an FTS5 query: quoted phrases are kept, every other word
+    is quoted on its own (so FTS5 operators in user input are literal), and all
+    terms must match. Returns None when nothing searchable is left.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        words = re.findall(r'\w+', phrase or word)
+        if phrase and words:
+            terms.append('"' + ' '.join(words) + '"')
+        else:
+            terms.extend(f'"{w}"' for w in words)
+    return ' '.join(terms) or None
+
+
+def search(expression, kinds=None, patient_id=None, limit=20, offset=0):
+    """Ranked matches for an FTS5 `expression` (see match_expression), best first."""
+    sql = [
+        f'SELECT kind, object_id, patient_id, appointment_id, patient_name, title, '
+        f"snippet({TABLE}, -1, '[', ']', '…', 12), bm25({TABLE}, {', '.join(['%s'] * len(WEIGHTS))}) AS score "
+        f'FROM {TABLE} WHERE {TABLE} MATCH %s'
+    ]
+    params = [*WEIGHTS, expression]
+    if kinds:
+        sql.append(f'AND kind IN ({", ".join(["%s"] * len(kinds))})')
+        params.extend(kinds)
+    if patient_id is not None:
+        sql.append('AND patient_id = %s')
+        params.append(patient_id)
+    sql.append('ORDER BY score, rowid LIMIT %s OFFSET %s')
+    params.extend([limit, offset])
+
+    with connection.cursor() as cursor:
+        cursor.execute(' '.join(sql), params)
+        return [
+            {
+                'type': kind, 'id': object_id, 'patient': patient, 'appointment': appointment,
+                'patient_name': name, 'title': title, 'snippet': snippet, 'score': score,
+            }
+            for kind, object_id, patient, appointment, name, title, snippet, score in cursor.fetchall()
+        ]
@@ -1,15 +1,35 @@
+import os
+import re
+
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db.models import CharField, Count, F, OuterRef, Prefetch, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.urls import reverse
 from rest_framework import serializers
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.serializers import StringRelatedField, SlugRelatedField
 from .models import *
+from .images import FORMATS, VARIANTS
+from .sparse import SparseFieldsMixin
+from .slots import on_slot_grid
+from .uploads import received_chunks
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     profile_id = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = '__all__'
+        field_sources = {'profile_id': ('role', 'doctor_profile__id', 'patient_profile__id')}
+
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        # profile_id reads the reverse one-to-one profiles, and the '__all__'
+        # field set renders both M2M relations.
+        return queryset.select_related(
+            f'{prefix}doctor_profile', f'{prefix}patient_profile'
+        ).prefetch_related(f'{prefix}groups', f'{prefix}user_permissions')
 
     def get_profile_id(self, obj):
             if obj.role == User.Role.DOCTOR and hasattr(obj, 'doctor_profile'):
@@ -18,6 +38,13 @@ class UserSerializer(serializers.ModelSerializer):
                 return obj.patient_profile.id
             return None
 
+# What ?expand= renders for users related to another record
+class PublicUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ('id', 'first_name', 'last_name', 'role')
+        read_only_fields = fields
+
 # Sign Up
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -67,12 +94,12 @@ class TokenSerializer(serializers.Serializer):
     access = serializers.CharField()
 
 
-class DepartmentSerializer(serializers.ModelSerializer):
+class DepartmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Department
         fields = '__all__'
 
-class DoctorProfileSerializer(serializers.ModelSerializer):
+class DoctorProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     # first_name = serializers.CharField(source='user.first_name', read_only=True)
     # last_name = serializers.CharField(source='user.last_name', read_only=True)
@@ -82,31 +109,158 @@ class DoctorProfileSerializer(serializers.ModelSerializer):
     # dob = serializers.DateField(source='user.dob', read_only=True)
     # email = serializers.EmailField(source='user.email', read_only=True)
     user = UserSerializer()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = DoctorProfile
         fields = '__all__'
+        field_sources = {'image_variants': ('image', 'image_variants')}
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        queryset = queryset.select_related('user', 'department')
+        return UserSerializer.setup_eager_loading(queryset, prefix='user__')
+
+    def get_image_variants(self, obj):
+        """
+        {variant: {format: url}} for the resized copies. Until they have been
+        rendered every entry points at the original upload.
+        """
+        if not obj.image:
+            return None
+        request = self.context.get('request')
+        storage = obj.image.storage
+
+        def url(name):
+            location = storage.url(name)
+            return request.build_absolute_uri(location) if request else location
+
+        if not obj.image_variants:
+            original = url(obj.image.name)
+            return {variant: {extension: original for extension in FORMATS} for variant in VARIANTS}
+        return {
+            variant: {extension: url(name) for extension, name in names.items()}
+            for variant, names in obj.image_variants.items()
+        }
         
-class LabReportSerializer(serializers.ModelSerializer):
+class ReportTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ReportType
+        fields = '__all__'
+
+class LabReportFileField(serializers.FileField):
+    """
+    Renders a lab report's file as its download URL, which checks who is
+    asking; the files are not served from MEDIA_URL.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = reverse('labreport-download', args=[value.instance.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class LabReportSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    report = LabReportFileField()
+
     class Meta:
         model = LabReport
         fields = '__all__'
+        expandable = {'report_type': ReportTypeSerializer}
+
+class LabReportUploadSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = LabReportUpload
+        fields = [
+            'id', 'patient', 'report_type', 'filename', 'size', 'chunk_size', 'checksum',
+            'chunk_count', 'received_chunks', 'created_at', 'updated_at',
+        ]
 
-class PatientProfileSerializer(serializers.ModelSerializer):
+    def get_received_chunks(self, obj):
+        return received_chunks(obj)
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.LAB_REPORT_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Size must be between 1 and {settings.LAB_REPORT_UPLOAD_MAX_SIZE} bytes."
+            )
+        return value
+
+    def validate_chunk_size(self, value):
+        if value > settings.LAB_REPORT_UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(
+                f"Chunk size may not exceed {settings.LAB_REPORT_UPLOAD_MAX_CHUNK_SIZE} bytes."
+            )
+        return value
+
+    def validate_checksum(self, value):
+        if not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+            raise serializers.ValidationError("Checksum must be a hex SHA-256 digest.")
+        return value.lower()
+
+    def validate_filename(self, value):
+        return os.path.basename(value)
+
+    def create(self, validated_data):
+        validated_data.setdefault('chunk_size', settings.LAB_REPORT_UPLOAD_CHUNK_SIZE)
+        return super().create(validated_data)
+
+class PatientProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer()
-    lab_reports = LabReportSerializer(many=True, read_only=True)  # Include lab reports
+    # Only the latest PATIENT_PROFILE_LAB_REPORTS; lab_reports_url pages through all of them
+    lab_reports = LabReportSerializer(source='latest_lab_reports', many=True, read_only=True)
+    lab_reports_count = serializers.IntegerField(read_only=True)
+    lab_reports_url = serializers.SerializerMethodField()
 
     class Meta:
         model = PatientProfile
         fields = '__all__'
+        field_sources = {'lab_reports_url': ()}
 
-class ReportTypeSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ReportType
-        fields = '__all__'
+    @staticmethod
+    def latest_lab_reports():
+        # A sliced Prefetch: one ROW_NUMBER() query for the whole page of patients
+        reports = LabReport.objects.order_by('-uploaded_at', '-id')[:settings.PATIENT_PROFILE_LAB_REPORTS]
+        return Prefetch('lab_reports', queryset=reports, to_attr='latest_lab_reports')
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        counts = LabReport.objects.filter(patient=OuterRef('pk')).order_by().values('patient') \
+            .annotate(count=Count('pk')).values('count')
+        queryset = queryset.select_related('user').prefetch_related(PatientProfileSerializer.latest_lab_reports()) \
+            .annotate(lab_reports_count=Coalesce(Subquery(counts), 0))
+        return UserSerializer.setup_eager_loading(queryset, prefix='user__')
+
+    def get_lab_reports_url(self, obj):
+        request = self.context.get('request')
+        url = reverse('get_patient_lab_reports', args=[obj.pk])
+        return request.build_absolute_uri(url) if request else url
+
+    def to_representation(self, instance):
+        # Instances that did not come through setup_eager_loading (create/update responses)
+        if 'lab_reports' in self.fields and not hasattr(instance, 'latest_lab_reports'):
+            prefetch_related_objects([instance], self.latest_lab_reports())
+        if 'lab_reports_count' in self.fields and not hasattr(instance, 'lab_reports_count'):
+            instance.lab_reports_count = instance.lab_reports.count()
+        return super().to_representation(instance)
 
 
-class AppointmentSerializer(serializers.ModelSerializer):
+def validate_slot_time(value):
+    if not on_slot_grid(value):
+        minutes = settings.APPOINTMENT_SLOT_MINUTES
+        raise serializers.ValidationError(
+            f"Appointments start on the {minutes}-minute slot grid (e.g. 09:00, 09:{minutes:02d})."
+        )
+    return value
+
+
+class AppointmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     patient_name = serializers.SerializerMethodField(read_only=True)
     doctor_name = serializers.SerializerMethodField(read_only=True)
     doctor_id = serializers.SerializerMethodField(read_only=True)
@@ -118,6 +272,30 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'id', 'patient', 'doctor', 'time', 'description', 'status',
             'patient_name', 'doctor_name', 'doctor_id', 'department'
         ]
+        # The unique_active_doctor_slot constraint is enforced by the database
+        # (see slots.reserve_slot) so racing bookings get the same 409 answer.
+        validators = []
+        field_sources = {
+            'patient_name': ('patient__first_name', 'patient__last_name'),
+            'doctor_name': ('doctor__first_name', 'doctor__last_name'),
+            'doctor_id': ('doctor__doctor_profile__id',),
+            'department': ('doctor__doctor_profile__department__name',),
+        }
+        # The same values computed by the database, for the compiled list (api/compiled.py)
+        field_expressions = {
+            'patient_name': Concat('patient__first_name', Value(' '), 'patient__last_name', output_field=CharField()),
+            'doctor_name': Concat('doctor__first_name', Value(' '), 'doctor__last_name', output_field=CharField()),
+            'doctor_id': Cast('doctor__doctor_profile__id', output_field=CharField()),
+            'department': F('doctor__doctor_profile__department__name'),
+        }
+        expandable = {'patient': PublicUserSerializer, 'doctor': PublicUserSerializer}
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('patient', 'doctor__doctor_profile__department')
+
+    def validate_time(self, value):
+        return validate_slot_time(value)
 
     def get_patient_name(self, obj):
         return f"{obj.patient.first_name} {obj.patient.last_name}"
@@ -131,12 +309,41 @@ class AppointmentSerializer(serializers.ModelSerializer):
     def get_department(self, obj):
         return f"{obj.doctor.doctor_profile.department.name}"
         
-class PreVisitQuestionSerializer(serializers.ModelSerializer):
+# One entry of POST /appointments/batch/. Relations are plain ids here and are
+# checked for the whole batch at once in api/batch.py.
+class AppointmentBatchItemSerializer(serializers.Serializer):
+    CREATE, STATUS, RESCHEDULE = 'create', 'status', 'reschedule'
+    REQUIRED = {
+        CREATE: ('patient', 'doctor', 'time'),
+        STATUS: ('id', 'status'),
+        RESCHEDULE: ('id', 'time'),
+    }
+
+    op = serializers.ChoiceField(choices=list(REQUIRED))
+    id = serializers.IntegerField(required=False)
+    patient = serializers.IntegerField(required=False)
+    doctor = serializers.IntegerField(required=False)
+    time = serializers.DateTimeField(required=False)
+    status = serializers.ChoiceField(choices=Appointment.STATUS_CHOICES, required=False)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+    def validate_time(self, value):
+        return validate_slot_time(value)
+
+    def validate(self, data):
+        missing = [field for field in self.REQUIRED[data['op']] if field not in data]
+        if missing:
+            raise serializers.ValidationError({field: "This field is required." for field in missing})
+        return data
+
+class PreVisitQuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PreVisitQuestion
         fields = '__all__'
+        expandable = {'department': DepartmentSerializer}
 
-class PreVisitReportSerializer(serializers.ModelSerializer):
+class PreVisitReportSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PreVisitReport
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        expandable = {'appointment': AppointmentSerializer}
\ No newline at end of file
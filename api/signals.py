@@ -1,10 +1,20 @@
 from django.dispatch import receiver
 from django.db import models
-from django.db.models.signals import post_save, post_delete, pre_save
-from .models import DoctorProfile, User, PatientProfile
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+from .models import (
+    Appointment, AppointmentDailyStat, Department, DoctorProfile, LabReport, LabReportDailyStat, PatientDailyStat,
+    PreVisitQuestion, PreVisitReport, ReportType, User, PatientProfile,
+)
 
 from django.core.files.storage import default_storage
 
+from .authentication import revoke_user_tokens
+from .caching import DOCTOR_DIRECTORY, invalidate
+from .images import delete_variants
+from . import search
+from .previsit import sync_answers
+from .stats import appointment_key, apply_deltas, lab_report_key
+
 # Auto delete images 
 @receiver(post_delete, sender=DoctorProfile)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
@@ -12,6 +22,7 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     if instance.image:
         if default_storage.exists(instance.image.name):
             default_storage.delete(instance.image.name)
+    delete_variants(default_storage, instance.image_variants)
 
 # auto create pateint profile
 @receiver(post_save, sender=User)
@@ -26,11 +37,10 @@ def update_user_profile(sender, instance, **kwargs):
     if not instance.pk:
         return  # New user handled in post_save
 
-    old_user = User.objects.get(pk=instance.pk)
-    old_role = old_user.role
+    old_role = instance.get_original('role')
     new_role = instance.role
 
-    if old_role != new_role:
+    if old_role is not None and old_role != new_role:
         # Delete old profile
         if old_role == User.Role.PATIENT:
             PatientProfile.objects.filter(user=instance).delete()
@@ -42,3 +52,157 @@ def update_user_profile(sender, instance, **kwargs):
             PatientProfile.objects.get_or_create(user=instance)
         elif new_role == User.Role.DOCTOR:
             DoctorProfile.objects.get_or_create(user=instance)
+
+
+# role changes and deactivations revoke every token issued before them
+@receiver(post_save, sender=User)
+def revoke_tokens_on_access_change(sender, instance, created, **kwargs):
+    if created:
+        return
+    if instance.has_changed('role') or instance.has_changed('is_active'):
+        revoke_user_tokens(instance.pk)
+
+
+# Doctor directory responses are cached per directory version (see api/caching.py)
+@receiver([post_save, post_delete], sender=DoctorProfile)
+@receiver([post_save, post_delete], sender=Department)
+def invalidate_doctor_directory(sender, **kwargs):
+    invalidate(DOCTOR_DIRECTORY)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_doctor_directory_for_user(sender, instance, **kwargs):
+    if instance.role == User.Role.DOCTOR or instance.get_original('role') == User.Role.DOCTOR:
+        invalidate(DOCTOR_DIRECTORY)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_doctor_directory_for_user_m2m(sender, instance, **kwargs):
+    if isinstance(instance, User) and instance.role == User.Role.DOCTOR:
+        invalidate(DOCTOR_DIRECTORY)
+
+
+# Reference tables answer conditional GETs from their version alone (see views.VersionedETagMixin)
+REFERENCE_MODELS = (Department, ReportType, PreVisitQuestion)
+
+
+@receiver([post_save, post_delete])
+def invalidate_reference_table(sender, **kwargs):
+    if sender in REFERENCE_MODELS:
+        invalidate(sender._meta.db_table)
+
+
+
+# Daily statistics (see api/stats.py). Originals are loaded before the row is
+# written, so the post_save handlers can move a count from the old to the new key.
+@receiver(pre_save, sender=Appointment)
+@receiver(pre_save, sender=LabReport)
+def load_original_stat_keys(sender, instance, **kwargs):
+    for name in sender.tracked_fields:
+        instance.get_original(name)
+
+
+@receiver(post_save, sender=Appointment)
+def count_appointment(sender, instance, created, **kwargs):
+    deltas = {appointment_key(instance.doctor_id, instance.time, instance.status): 1}
+    if not created:
+        old = appointment_key(*(instance.get_original(name) for name in ('doctor', 'time', 'status')))
+        deltas[old] = deltas.get(old, 0) - 1
+    apply_deltas(AppointmentDailyStat, deltas)
+
+
+@receiver(post_delete, sender=Appointment)
+def uncount_appointment(sender, instance, **kwargs):
+    old = appointment_key(*(instance.get_original(name) for name in ('doctor', 'time', 'status')))
+    apply_deltas(AppointmentDailyStat, {old: -1})
+
+
+@receiver(post_save, sender=LabReport)
+def count_lab_report(sender, instance, created, **kwargs):
+    deltas = {lab_report_key(instance.report_type_id, instance.uploaded_at): 1}
+    if not created:
+        old = lab_report_key(instance.get_original('report_type'), instance.get_original('uploaded_at'))
+        deltas[old] = deltas.get(old, 0) - 1
+    apply_deltas(LabReportDailyStat, deltas)
+
+
+@receiver(post_delete, sender=LabReport)
+def uncount_lab_report(sender, instance, **kwargs):
+    old = lab_report_key(instance.get_original('report_type'), instance.get_original('uploaded_at'))
+    apply_deltas(LabReportDailyStat, {old: -1})
+
+
+@receiver(post_save, sender=PatientProfile)
+def count_new_patient(sender, instance, created, **kwargs):
+    if created:
+        apply_deltas(PatientDailyStat, {(instance.created_at,): 1})
+
+
+@receiver(post_delete, sender=PatientProfile)
+def uncount_patient(sender, instance, **kwargs):
+    apply_deltas(PatientDailyStat, {(instance.created_at,): -1})
+
+
+
+# Per-question answers (see api/previsit.py)
+@receiver(post_save, sender=PreVisitReport)
+def write_previsit_answers(sender, instance, created, **kwargs):
+    if created or instance.has_changed('responses'):
+        sync_answers(instance)
+
+
+# Full-text search index (see api/search.py)
+@receiver(post_save, sender=PreVisitReport)
+@receiver(post_save, sender=LabReport)
+def index_search_document(sender, instance, **kwargs):
+    search.index(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=PreVisitReport)
+@receiver(post_delete, sender=LabReport)
+def remove_search_document(sender, instance, **kwargs):
+    search.remove(sender, [instance.pk])
+
+
+@receiver(post_save, sender=User)
+def reindex_patient_documents(sender, instance, created, **kwargs):
+    if not created and (instance.has_changed('first_name') or instance.has_changed('last_name')):
+        search.index(PreVisitReport, PreVisitReport.objects.filter(appointment__patient_id=instance.pk)
+                     .values_list('pk', flat=True))
+        search.index(LabReport, LabReport.objects.filter(patient__user_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=ReportType)
+def reindex_renamed_report_type(sender, instance, created, **kwargs):
+    if not created and instance.has_changed('name'):
+        search.index(LabReport, LabReport.objects.filter(report_type_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=ReportType)
+def remember_report_type_documents(sender, instance, **kwargs):
+    # SET_NULL clears the reports with a plain UPDATE, so note them before it runs
+    instance._lab_report_ids = list(LabReport.objects.filter(report_type_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=ReportType)
+def reindex_report_type_documents(sender, instance, **kwargs):
+    search.index(LabReport, getattr(instance, '_lab_report_ids', []))
+
+
+def _reindex_department_reports(department_id):
+    # Responses refer to questions by id, so any report of the department may quote it
+    search.index(PreVisitReport, PreVisitReport.objects.filter(
+        appointment__doctor__doctor_profile__department_id=department_id,
+    ).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=PreVisitQuestion)
+def reindex_edited_question(sender, instance, created, **kwargs):
+    if not created and instance.has_changed('question_text'):
+        _reindex_department_reports(instance.department_id)
+
+
+@receiver(post_delete, sender=PreVisitQuestion)
+def reindex_deleted_question(sender, instance, **kwargs):
+    _reindex_department_reports(instance.department_id)
@@ -0,0 +1,143 @@
+"""
+Free appointment slot search.
+
+Booked appointments for every requested doctor are read in one indexed query
+(`appointment_doctor_time`) and grouped into a sorted list of start times per
+doctor and day. Each candidate slot is then checked with a binary search over
+that day's list instead of a scan over all of the doctor's appointments.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import Appointment
+
+
+def slot_length():
+    return timedelta(minutes=settings.APPOINTMENT_SLOT_MINUTES)
+
+
+def on_slot_grid(value):
+    """
+    True when `value` is a whole number of slot lengths after local midnight.
+    Appointments only start on this grid, so two live bookings of a doctor
+    either hold the same slot (rejected by unique_active_doctor_slot) or do
+    not overlap at all.
+    """
+    local = timezone.localtime(value) if timezone.is_aware(value) else value
+    minutes = local.hour * 60 + local.minute
+    return local.second == 0 and local.microsecond == 0 and minutes % settings.APPOINTMENT_SLOT_MINUTES == 0
+
+
+def build_interval_index(doctor_user_ids, start, end):
+    """
+    Map (doctor user id, local date) to the sorted start times of the
+    appointments that occupy that doctor's calendar between `start` and `end`.
+    """
+    length = slot_length()
+    tz = timezone.get_current_timezone()
+    index = defaultdict(list)
+    booked = (
+        Appointment.objects
+        .filter(doctor_id__in=doctor_user_ids, time__gt=start - length, time__lt=end)
+        .exclude(status__in=Appointment.RELEASED_STATUSES)
+        .order_by('doctor_id', 'time')
+        .values_list('doctor_id', 'time')
+    )
+    for doctor_id, starts_at in booked:
+        index[doctor_id, timezone.localtime(starts_at, tz).date()].append(starts_at)
+    return index
+
+
+def is_free(booked, slot_start, length):
+    """True when no booked start time falls within (slot_start - length, slot_start + length)."""
+    i = bisect_right(booked, slot_start - length)
+    return i == len(booked) or booked[i] >= slot_start + length
+
+
+def working_windows(doctor, day):
+    """(start, end) local times the doctor works on `day`; needs `working_hours` prefetched."""
+    windows = [(wh.start_time, wh.end_time) for wh in doctor.working_hours.all() if wh.weekday == day.weekday()]
+    if windows or doctor.working_hours.all():
+        return windows
+    default = settings.DEFAULT_WORKING_HOURS.get(day.weekday())
+    if default is None:
+        return []
+    return [(time.fromisoformat(default[0]), time.fromisoformat(default[1]))]
+
+
+def free_slots(doctors, first_day, last_day, now=None):
+    """
+    Return {doctor profile id: [slot start datetimes]} for every day between
+    `first_day` and `last_day` inclusive. `doctors` are DoctorProfile
+    instances with `working_hours` prefetched.
+    """
+    tz = timezone.get_current_timezone()
+    now = now or timezone.now()
+    length = slot_length()
+    range_start = timezone.make_aware(datetime.combine(first_day, time.min), tz)
+    range_end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min), tz)
+    index = build_interval_index([doctor.user_id for doctor in doctors], range_start, range_end)
+
+    result = {}
+    for doctor in doctors:
+        slots = []
+        day = first_day
+        while day <= last_day:
+            # Appointments next to midnight can overlap slots on the neighbouring day
+            booked = (
+                index.get((doctor.user_id, day - timedelta(days=1)), [])[-1:]
+                + index.get((doctor.user_id, day), [])
+                + index.get((doctor.user_id, day + timedelta(days=1)), [])[:1]
+            )
+            for window_start, window_end in working_windows(doctor, day):
+                slot = timezone.make_aware(datetime.combine(day, window_start.replace(second=0, microsecond=0)), tz)
+                # Windows that do not start on the slot grid begin at its next line
+                past_grid = (window_start.hour * 60 + window_start.minute) % settings.APPOINTMENT_SLOT_MINUTES
+                if past_grid:
+                    slot += timedelta(minutes=settings.APPOINTMENT_SLOT_MINUTES - past_grid)
+                window_close = timezone.make_aware(datetime.combine(day, window_end), tz)
+                while slot + length <= window_close:
+                    if slot >= now and is_free(booked, slot, length):
+                        slots.append(slot)
+                    slot += length
+            day += timedelta(days=1)
+        result[doctor.id] = slots
+    return result
+
+
+class SlotUnavailable(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This time slot is already booked for the selected doctor.'
+    default_code = 'slot_unavailable'
+
+
+def reserve_slot(serializer, **kwargs):
+    """
+    Save an appointment serializer in its own transaction. If the database
+    rejects the row because the doctor's slot is already held by another live
+    appointment, raise SlotUnavailable instead of an IntegrityError.
+
+    The unique_active_doctor_slot constraint makes the check-and-insert atomic,
+    so concurrent bookings of one slot cannot both commit, while bookings for
+    other doctors or times never wait on each other.
+    """
+    try:
+        with transaction.atomic():
+            return serializer.save(**kwargs)
+    except IntegrityError:
+        data = {**serializer.validated_data, **kwargs}
+        doctor = data.get('doctor') or serializer.instance.doctor
+        starts_at = data.get('time') or serializer.instance.time
+        taken = Appointment.objects.filter(doctor=doctor, time=starts_at).exclude(
+            status__in=Appointment.RELEASED_STATUSES
+        )
+        if taken.exists():
+            raise SlotUnavailable()
+        raise
@@ -0,0 +1,244 @@
+"""
+Sparse fieldsets for the read endpoints.
+
+    ?fields=id,user.first_name,department
+        keep only the listed fields; dotted names reach into nested objects
+        and a bare nested name keeps all of it
+    ?expand=patient,doctor
+        render the listed relations as nested objects instead of ids (the
+        relations a serializer names in Meta.expandable)
+
+Serializers opt in with SparseFieldsMixin, which trims `fields` on GET
+requests. Views opt in with SparseQuerysetMixin, which hands the trimmed
+serializer to `plan_queryset`: the fields that will be rendered become the
+only() columns, select_related joins and Prefetch querysets, so unrequested
+columns and relations are never loaded. SerializerMethodFields say which
+columns they read in Meta.field_sources; one that does not is given the
+whole row. Without ?fields= and ?expand= nothing changes.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_fields(text):
+    """
+    'id,user.first_name,user.last_name' ->
+    {'id': None, 'user': {'first_name': None, 'last_name': None}}, where
+    None means the whole field. Returns None for an empty parameter.
+    """
+    if not text:
+        return None
+    tree = {}
+    for path in filter(None, (part.strip() for part in text.split(','))):
+        node = tree
+        *parents, leaf = path.split('.')
+        for name in parents:
+            if name in node and node[name] is None:
+                break  # the whole field was asked for already
+            node = node.setdefault(name, {})
+        else:
+            node[leaf] = None
+    return tree
+
+
+def _sparse_params(request):
+    if request is None or request.method not in SAFE_METHODS:
+        return None, {}
+    return parse_fields(request.query_params.get('fields')), parse_fields(request.query_params.get('expand')) or {}
+
+
+def expanded_models(serializer_class, request):
+    """Models a `serializer_class` response to `request` renders through ?expand= (unknown names are skipped)."""
+    def walk(serializer_class, expand):
+        expandable = getattr(serializer_class.Meta, 'expandable', {})
+        for name, subtree in expand.items():
+            if name in expandable:
+                yield expandable[name].Meta.model
+                yield from walk(expandable[name], subtree or {})
+
+    return list(walk(serializer_class, _sparse_params(request)[1]))
+
+
+class SparseFieldsMixin:
+    """ModelSerializer mixin honouring ?fields= and ?expand= (see module docstring)."""
+
+    def _sparse_spec(self):
+        if hasattr(self, '_sparse'):
+            return self._sparse  # set by the parent serializer
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if parent is not None:
+            return None, {}
+        return _sparse_params(self.context.get('request'))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self._sparse_spec()
+        expandable = getattr(self.Meta, 'expandable', {})
+        unknown = set(expand) - set(expandable)
+        if unknown:
+            raise serializers.ValidationError({"expand": f"Cannot expand: {', '.join(sorted(unknown))}"})
+        for name in expand:
+            fields[name] = expandable[name](read_only=True)
+        if only is not None:
+            unknown = set(only) - set(fields)
+            if unknown:
+                raise serializers.ValidationError({"fields": f"Unknown fields: {', '.join(sorted(unknown))}"})
+            fields = {name: field for name, field in fields.items() if name in only}
+        for name, field in fields.items():
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            subfields = (only or {}).get(name)
+            if isinstance(nested, SparseFieldsMixin):
+                nested._sparse = (subfields, expand.get(name) or {})
+            elif subfields:
+                raise serializers.ValidationError({"fields": f"{name} has no fields to select"})
+        return fields
+
+
+class _Plan:
+    """
+    Columns, joins and prefetches one model's rows need. `queryset` is the
+    one being narrowed: its annotations are kept, and its Prefetch(to_attr=)
+    lookups are planned like the relations they prefetch.
+    """
+
+    def __init__(self, model, queryset=None):
+        self.model = model
+        self.columns = {model._meta.pk.name}
+        self.whole_row = False
+        self.joins = {}
+        self.prefetches = {}
+        self.annotations = set(queryset.query.annotations) if queryset is not None else set()
+        self.to_attrs = {
+            lookup.to_attr: lookup for lookup in (queryset._prefetch_related_lookups if queryset is not None else ())
+            if isinstance(lookup, Prefetch) and lookup.to_attr and '__' not in lookup.prefetch_through
+        }
+        self.prefetch = None  # the Prefetch this plan narrows, for to_attr lookups
+
+    def relation(self, path):
+        """Plan of the model at the end of `path` (a list of relation names), adding the joins/prefetches on the way."""
+        plan = self
+        for name in path:
+            plan = plan.add(name, whole=False)
+            if plan is None:
+                return None
+        return plan
+
+    def add(self, name, whole=True):
+        """
+        Record that field `name` is read. Returns the related model's plan for
+        relations that are followed (whole=False), otherwise None.
+        """
+        if name in self.annotations:
+            return None  # only() keeps annotations
+        if name in self.to_attrs:
+            lookup = self.to_attrs[name]
+            field = self.model._meta.get_field(lookup.prefetch_through)
+            plan = self.prefetches.setdefault(name, _Plan(field.related_model))
+            plan.prefetch = lookup
+            if field.one_to_many:
+                plan.columns.add(field.field.name)
+            return None if whole else plan
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            self.whole_row = True  # a property or method; it may read anything
+            return None
+        if not field.is_relation:
+            self.columns.add(name)
+            return None
+        if field.many_to_many or field.one_to_many:
+            plan = self.prefetches.setdefault(name, _Plan(field.related_model))
+            if field.one_to_many:
+                plan.columns.add(field.field.name)  # to match the rows to their parent
+            return None if whole else plan
+        if field.concrete:
+            self.columns.add(name)
+            if whole:
+                return None  # just the id
+        plan = self.joins.setdefault(name, _Plan(field.related_model))
+        if not field.concrete:
+            plan.columns.add(field.field.name)  # reverse one-to-one, joined on the related row's key
+        return plan
+
+    def walk(self, serializer):
+        meta = getattr(serializer, 'Meta', None)
+        sources = getattr(meta, 'field_sources', {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, serializers.BaseSerializer):
+                plan = self.relation(field.source_attrs)
+                if plan is not None:
+                    plan.walk(nested)
+            elif isinstance(field, serializers.SerializerMethodField):
+                if name not in sources:
+                    self.whole_row = True
+                for path in sources.get(name, ()):
+                    self.read(path.split('__'))
+            elif field.source == '*':
+                self.whole_row = True
+            else:
+                self.read(field.source_attrs)
+
+    def read(self, path):
+        plan = self.relation(path[:-1])
+        if plan is not None:
+            plan.add(path[-1])
+
+    def lookups(self, prefix=''):
+        """(only() names, select_related paths, Prefetch objects) for this plan under `prefix`."""
+        if self.whole_row:
+            only = [prefix + field.name for field in self.model._meta.concrete_fields]
+        else:
+            only = [prefix + column for column in self.columns]
+        related, prefetches = [], []
+        for name, plan in self.joins.items():
+            related.append(prefix + name)
+            child = plan.lookups(f'{prefix}{name}__')
+            only += child[0]
+            related += child[1]
+            prefetches += child[2]
+        for name, plan in self.prefetches.items():
+            if plan.prefetch is not None:
+                lookup = plan.prefetch
+                queryset = plan.apply(lookup.queryset if lookup.queryset is not None else plan.model._default_manager.all())
+                prefetches.append(Prefetch(prefix + lookup.prefetch_through, queryset=queryset, to_attr=lookup.to_attr))
+            else:
+                prefetches.append(Prefetch(prefix + name, queryset=plan.apply(plan.model._default_manager.all())))
+        return only, related, prefetches
+
+    def apply(self, queryset):
+        only, related, prefetches = self.lookups()
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if related:  # select_related() without names would follow every foreign key
+            queryset = queryset.select_related(*related)
+        return queryset.prefetch_related(*prefetches).only(*only)
+
+
+def plan_queryset(queryset, serializer, ordering=()):
+    """`queryset` loading just what `serializer` (trimmed by ?fields=/?expand=) renders, plus the `ordering` columns."""
+    plan = _Plan(queryset.model, queryset)
+    plan.walk(serializer)
+    for name in ordering:
+        plan.read(name.lstrip('-').split('__'))
+    return plan.apply(queryset)
+
+
+def is_sparse(request):
+    return request.method in SAFE_METHODS and ('fields' in request.query_params or 'expand' in request.query_params)
+
+
+class SparseQuerysetMixin:
+    """GenericAPIView mixin: narrow the queryset to the requested fields (see plan_queryset)."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not is_sparse(self.request):
+            return queryset
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        return plan_queryset(queryset, self.get_serializer(), ordering=ordering)
@@ -0,0 +1,153 @@
+"""
+Dashboard statistics.
+
+Daily counts live in small summary tables (AppointmentDailyStat,
+PatientDailyStat, LabReportDailyStat) that api/signals.py keeps current one
+delta at a time, so a year-long dashboard reads a few hundred pre-aggregated
+rows instead of grouping the whole appointment table. `rebuild()` recomputes
+every table from the source rows.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, TruncDate, TruncWeek
+from django.utils import timezone
+
+from .models import (
+    Appointment, AppointmentDailyStat, LabReport, LabReportDailyStat, PatientDailyStat, PatientProfile,
+)
+
+STATUSES = [value for value, _ in Appointment.STATUS_CHOICES]
+
+# Summary table -> fields identifying one counter row
+STAT_KEYS = {
+    AppointmentDailyStat: ('doctor_id', 'day', 'status'),
+    PatientDailyStat: ('day',),
+    LabReportDailyStat: ('report_type_id', 'day'),
+}
+# Keys per UPDATE; SQLite limits how deeply the OR-ed conditions may nest
+DELTA_CHUNK_SIZE = 200
+
+# group_by -> output field -> expression (None for a plain model field); rows
+# are ordered by the first field
+GROUPINGS = {
+    'day': {'day': None},
+    'week': {'week': TruncWeek('day')},
+    'doctor': {
+        'doctor': None,
+        'doctor_name': Concat('doctor__first_name', Value(' '), 'doctor__last_name'),
+    },
+    'department': {
+        'department': F('doctor__doctor_profile__department'),
+        'department_name': F('doctor__doctor_profile__department__name'),
+    },
+}
+
+
+def local_day(value):
+    return timezone.localtime(value).date() if value is not None else None
+
+
+def appointment_key(doctor_id, time, status):
+    return (doctor_id, local_day(time), status)
+
+
+def lab_report_key(report_type_id, uploaded_at):
+    return (report_type_id, local_day(uploaded_at))
+
+
+def apply_deltas(model, deltas):
+    """
+    Add `deltas` ({key tuple: n}, keys ordered as in STAT_KEYS) to the counters
+    of `model`. Increments happen in the database, so concurrent writers never
+    lose updates. Keys containing None (e.g. an untyped lab report) are skipped.
+    """
+    deltas = {key: n for key, n in deltas.items() if n and None not in key}
+    if not deltas:
+        return
+    fields = STAT_KEYS[model]
+    # Rows that are about to grow must exist; existing rows are left untouched
+    model.objects.bulk_create(
+        [model(**dict(zip(fields, key))) for key, n in deltas.items() if n > 0], ignore_conflicts=True
+    )
+    keys = list(deltas)
+    for offset in range(0, len(keys), DELTA_CHUNK_SIZE):
+        matches = [(Q(**dict(zip(fields, key))), deltas[key]) for key in keys[offset:offset + DELTA_CHUNK_SIZE]]
+        model.objects.filter(reduce(or_, [match for match, _ in matches])).update(
+            count=F('count') + Case(*[When(match, then=Value(n)) for match, n in matches], default=Value(0))
+        )
+
+
+def rebuild():
+    """Recompute every summary table from the source tables; returns {model name: rows}."""
+    sources = {
+        AppointmentDailyStat: (
+            Appointment.objects.values('doctor', 'status', day=TruncDate('time')),
+            lambda row: AppointmentDailyStat(doctor_id=row['doctor'], day=row['day'], status=row['status']),
+        ),
+        PatientDailyStat: (
+            PatientProfile.objects.values(day=F('created_at')),
+            lambda row: PatientDailyStat(day=row['day']),
+        ),
+        LabReportDailyStat: (
+            LabReport.objects.exclude(report_type=None).values('report_type', day=TruncDate('uploaded_at')),
+            lambda row: LabReportDailyStat(report_type_id=row['report_type'], day=row['day']),
+        ),
+    }
+    rows = {}
+    with transaction.atomic():
+        for model, (groups, build) in sources.items():
+            model.objects.all().delete()
+            stats = []
+            for row in groups.order_by().annotate(total=Count('id')).iterator():
+                stat = build(row)
+                stat.count = row['total']
+                stats.append(stat)
+            model.objects.bulk_create(stats, batch_size=1000)
+            rows[model.__name__] = len(stats)
+    return rows
+
+
+def _grouped(queryset, fields):
+    return queryset.order_by().values(
+        *[name for name, expression in fields.items() if expression is None],
+        **{name: expression for name, expression in fields.items() if expression is not None},
+    )
+
+
+def status_counts(group_by, first_day, last_day, doctor_id=None):
+    """
+    Appointment counts per status for each `group_by` group between the two
+    dates (inclusive), optionally for one doctor. Returns a list of dicts with
+    the group fields, `counts` ({status: n} for every status) and `total`.
+    """
+    fields = GROUPINGS[group_by]
+    stats = AppointmentDailyStat.objects.filter(day__range=(first_day, last_day), count__gt=0)
+    if doctor_id is not None:
+        stats = stats.filter(doctor_id=doctor_id)
+    rows = _grouped(stats, fields).annotate(
+        total=Sum('count'),
+        **{f'count_{i}': Coalesce(Sum('count', filter=Q(status=value)), 0) for i, value in enumerate(STATUSES)},
+    ).order_by(next(iter(fields)))
+
+    results = []
+    for row in rows:
+        row['counts'] = {value: row.pop(f'count_{i}') for i, value in enumerate(STATUSES)}
+        row['total'] = row.pop('total')  # keep it after counts in the output
+        results.append(row)
+    return results
+
+
+def daily_totals(first_day, last_day):
+    """New patients per day and lab reports per type per day between the two dates (inclusive)."""
+    patients = PatientDailyStat.objects.filter(day__range=(first_day, last_day), count__gt=0)
+    reports = LabReportDailyStat.objects.filter(day__range=(first_day, last_day), count__gt=0)
+    return {
+        'new_patients': list(patients.order_by('day').values('day', 'count')),
+        'lab_reports': list(
+            reports.order_by('day', 'report_type')
+            .values('day', 'report_type', 'count', report_type_name=F('report_type__name'))
+        ),
+    }
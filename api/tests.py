@@ -1,3 +1,1453 @@
-from django.test import TestCase
+from datetime import datetime, time, timedelta
 
-# Create your tests here.
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, resolve, reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from .models import *
+from . import urls as api_urls
+from backend.routers import ReplicaRouter
+from .benchmark import ENDPOINT_URLS, ROLE_MIX, SKIPPED_ENDPOINTS
+from .authentication import TOKEN_VERSION_CLAIM, revoke_user_tokens, token_version_key
+from .caching import DOCTOR_DIRECTORY, cache_stats, reset_stats
+from .compiled import compile_serializer
+from .images import validate_doctor_image
+from .imports import PatientImportError, import_patients, read_rows
+from .serializers import AppointmentSerializer, DoctorProfileSerializer, LabReportSerializer, PatientProfileSerializer
+from .views import AppointmentViewSet, MyTokenObtainPairSerializer
+from .slots import free_slots
+from .stats import rebuild
+from .uploads import purge_expired, session_dir
+from .revocation import REVOCATIONS_KEY, BloomFilter, RevocableRefreshToken, is_revoked, maybe_prune, revocations
+from .querybudget import ENDPOINT_QUERY_BUDGETS, QueryBudgetExceeded, endpoint_budget, query_budget
+
+
+# Features that need every worker to see the same cache (token versions, ETags,
+# the doctor directory, the revocation counter) are tested against a file cache
+# of their own; the default LocMemCache turns them off.
+SHARED_CACHE_DIR = tempfile.mkdtemp(prefix='api-tests-cache-')
+shared_cache = override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': SHARED_CACHE_DIR,
+}})
+
+
+def tearDownModule():
+    shutil.rmtree(SHARED_CACHE_DIR, ignore_errors=True)
+
+
+def make_user(username, role=User.Role.PATIENT, **extra):
+    extra = {'first_name': username.title(), 'last_name': 'Test', **extra}
+    return User.objects.create(username=username, role=role, **extra)
+
+
+def make_doctor(username, department):
+    user = make_user(username, role=User.Role.DOCTOR)
+    DoctorProfile.objects.create(user=user, department=department)
+    return user
+
+
+class QueryBudgetTests(TestCase):
+    """Every read endpoint must stay within its budget whatever the page size."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        self.department = Department.objects.create(name='Cardiology')
+        self.report_type = ReportType.objects.create(name='Blood')
+        self.question = PreVisitQuestion.objects.create(department=self.department, question_text='Pain?')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.rows = 0
+        self.today = timezone.localdate()
+
+    def seed(self, count):
+        now = timezone.now()
+        for i in range(self.rows, self.rows + count):
+            doctor = make_doctor(f'doctor{i}', self.department)
+            patient = make_user(f'patient{i}')
+            LabReport.objects.create(
+                patient=patient.patient_profile, report=f'lab_reports/{i}.pdf', report_type=self.report_type
+            )
+            appointment = Appointment.objects.create(
+                patient=patient, doctor=doctor, time=now + timedelta(hours=i), status='pending'
+            )
+            PreVisitReport.objects.create(appointment=appointment, responses={'pain': 'no'})
+        self.rows += count
+        self.doctor = doctor
+        self.patient = patient
+        self.appointment = appointment
+
+    def endpoints(self):
+        return {
+            'user-list': reverse('user-list'),
+            'user-detail': reverse('user-detail', args=[self.patient.pk]),
+            'department-list': reverse('department-list'),
+            'doctorprofile-list': reverse('doctorprofile-list'),
+            'doctors-by-department': reverse('doctors-by-department', args=[self.department.pk]),
+            'doctor-slots-by-department': reverse('doctor-slots-by-department', args=[self.department.pk])
+            + f'?start={self.today}&end={self.today + timedelta(days=6)}',
+            'doctor-slots': reverse('doctor-slots', args=[self.doctor.doctor_profile.pk])
+            + f'?start={self.today}&end={self.today + timedelta(days=6)}',
+            'patientprofile-list': reverse('patientprofile-list'),
+            'patientprofile-detail': reverse('patientprofile-detail', args=[self.patient.patient_profile.pk]),
+            'reporttype-list': reverse('reporttype-list'),
+            'labreport-list': reverse('labreport-list'),
+            'lab-reports-by-type': reverse('lab-reports-by-type', args=[self.report_type.pk]),
+            'get_patient_lab_reports': reverse('get_patient_lab_reports', args=[self.patient.patient_profile.pk]),
+            'appointment-list': reverse('appointment-list'),
+            'appointment-detail': reverse('appointment-detail', args=[self.appointment.pk]),
+            'patient-appointments-admin': reverse('patient-appointments-admin', args=[self.patient.pk]),
+            'previsitquestion-list': reverse('previsitquestion-list'),
+            'previsitreport-list': reverse('previsitreport-list'),
+            'previsitreport-detail': reverse('previsitreport-detail', args=[self.appointment.pk]),
+        }
+
+    def measure(self):
+        counts = {}
+        for name, url in self.endpoints().items():
+            with endpoint_budget(name) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, f'{name}: {response.content[:200]}')
+            counts[name] = len(context.captured_queries)
+        return counts
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        self.seed(2)
+        small = self.measure()
+        self.seed(8)
+        self.assertEqual(self.measure(), small)
+
+    def test_every_budget_refers_to_a_route(self):
+        for name in ENDPOINT_QUERY_BUDGETS:
+            try:
+                reverse(name)
+            except Exception:
+                reverse(name, args=[1])
+
+    def test_budget_exceeded_fails(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                list(User.objects.all())
+                list(Department.objects.all())
+
+
+class EndpointBenchmarkMixTests(TestCase):
+    """bench_endpoints has to keep up with api/urls.py."""
+
+    def url_names(self, patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from self.url_names(pattern.url_patterns)
+            else:
+                yield pattern.name
+
+    def test_every_route_is_benchmarked_or_skipped(self):
+        missing = set(self.url_names(api_urls.urlpatterns)) - set(ENDPOINT_URLS) - set(SKIPPED_ENDPOINTS)
+        self.assertEqual(missing, set())
+
+    def test_mix_urls_resolve_to_their_route(self):
+        sample = dict.fromkeys(
+            ['user', 'patient', 'patient_profile', 'doctor_profile', 'department', 'appointment', 'lab_report',
+             'report_type', 'question', 'previsit_appointment'], 1,
+        )
+        sample['today'] = timezone.localdate()
+        for mix in ROLE_MIX.values():
+            for name in mix:
+                self.assertEqual(resolve(ENDPOINT_URLS[name](sample).split('?')[0]).url_name, name)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        department = Department.objects.create(name='Cardiology')
+        self.doctors = [make_doctor(f'doctor{i}', department) for i in range(3)]
+        self.patient = make_user('patient')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_appointments_pages_are_stable_across_equal_times(self):
+        now = timezone.now()
+        # Several rows share a timestamp so the id tie-breaker is exercised.
+        appointments = [
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.doctors[i % 3], time=now + timedelta(hours=i // 3)
+            )
+            for i in range(10)
+        ]
+        expected = [a.id for a in sorted(appointments, key=lambda a: (a.time, a.id))]
+        self.assertEqual(self.walk(reverse('appointment-list') + '?page_size=4'), expected)
+
+    def test_patient_lab_reports_route_is_paginated(self):
+        profile = self.patient.patient_profile
+        reports = [LabReport.objects.create(patient=profile, report=f'lab_reports/{i}.pdf') for i in range(5)]
+        url = reverse('get_patient_lab_reports', args=[profile.pk]) + '?page_size=2'
+        self.assertEqual(self.walk(url), [r.id for r in reports])
+
+    def test_users_are_paginated_by_id(self):
+        url = reverse('user-list') + '?page_size=1'
+        self.assertEqual(self.walk(url), sorted(User.objects.values_list('id', flat=True)))
+
+
+class FreeSlotTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', self.department)
+        self.profile = self.doctor.doctor_profile
+        self.patient = make_user('patient')
+        WorkingHours.objects.create(doctor=self.profile, weekday=0, start_time='09:00', end_time='11:00')
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(datetime.combine(self.monday, time(hour, minute)))
+
+    def slots(self):
+        doctors = list(DoctorProfile.objects.prefetch_related('working_hours'))
+        return free_slots(doctors, self.monday, self.monday + timedelta(days=6))[self.profile.id]
+
+    def test_booked_and_overlapping_slots_are_excluded(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.at(9, 30))
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.at(10, 15))
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.at(9), status='canceled')
+        self.assertEqual(self.slots(), [self.at(9)])
+
+    def test_only_working_days_have_slots(self):
+        self.assertEqual(self.slots(), [self.at(9), self.at(9, 30), self.at(10), self.at(10, 30)])
+
+    def test_department_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        url = reverse('doctor-slots-by-department', args=[self.department.pk])
+        response = client.get(url, {'start': self.monday, 'end': self.monday})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['doctor_id'], self.profile.id)
+        self.assertEqual(len(response.data[0]['slots']), 4)
+        self.assertEqual(client.get(url, {'start': self.monday}).status_code, 400)
+
+
+class DoubleBookingTests(TransactionTestCase):
+    databases = '__all__'  # includes the read replica alias of the production profile
+    workers = 32
+    attempts = 200
+
+    def setUp(self):
+        department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', department)
+        self.other_doctor = make_doctor('other', department)
+        self.patients = [make_user(f'patient{i}') for i in range(self.attempts)]
+        self.slot = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def book(self, patient, doctor, when):
+        client = APIClient()
+        client.force_authenticate(patient)
+        try:
+            return client.post(
+                reverse('appointment-list'),
+                {'patient': patient.pk, 'doctor': doctor.pk, 'time': when.isoformat()},
+            ).status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_bookings_of_one_slot_have_a_single_winner(self):
+        with ThreadPoolExecutor(self.workers) as pool:
+            codes = list(pool.map(lambda p: self.book(p, self.doctor, self.slot), self.patients))
+        self.assertEqual(codes.count(201), 1)
+        self.assertEqual(codes.count(409), self.attempts - 1)
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor, time=self.slot).count(), 1)
+
+    def test_bookings_for_other_slots_do_not_conflict(self):
+        def book(i):
+            doctor = (self.doctor, self.other_doctor)[i % 2]
+            return self.book(self.patients[i], doctor, self.slot + timedelta(minutes=30 * (i // 2)))
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            codes = list(pool.map(book, range(40)))
+        self.assertEqual(codes, [201] * 40)
+
+    def test_released_slot_can_be_rebooked(self):
+        first = Appointment.objects.create(patient=self.patients[0], doctor=self.doctor, time=self.slot)
+        self.assertEqual(self.book(self.patients[1], self.doctor, self.slot), 409)
+        first.status = 'canceled'
+        first.save()
+        self.assertEqual(self.book(self.patients[1], self.doctor, self.slot), 201)
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    # TestCase wraps every test in a transaction, which always pins reads to default
+    def test_reads_leave_default_only_inside_transactions(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Appointment), 'replica')
+        self.assertEqual(router.db_for_write(Appointment), 'default')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Appointment), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'api'))
+
+
+@override_settings(PATIENT_PROFILE_LAB_REPORTS=2)
+class PatientProfileLabReportsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('admin', role=User.Role.ADMIN))
+        self.patients = [make_user(f'patient{i}') for i in range(3)]
+        self.reports = {
+            patient.pk: [
+                LabReport.objects.create(patient=patient.patient_profile, report=f'lab_reports/{i}.pdf')
+                for i in range(i + 1)
+            ]
+            for i, patient in enumerate(self.patients)
+        }
+
+    def test_only_the_latest_reports_are_nested(self):
+        with self.assertNumQueries(4):  # profiles + one windowed lab report query + groups + permissions
+            response = self.client.get(reverse('patientprofile-list'))
+        for row in response.data:
+            reports = self.reports.get(row['user']['id'], [])
+            self.assertEqual([report['id'] for report in row['lab_reports']], [r.pk for r in reports[::-1][:2]])
+            self.assertEqual(row['lab_reports_count'], len(reports))
+            self.assertTrue(row['lab_reports_url'].endswith(reverse('get_patient_lab_reports', args=[row['id']])))
+
+    def test_updates_render_the_same_representation(self):
+        profile = self.patients[2].patient_profile
+        response = self.client.patch(reverse('patientprofile-detail', args=[profile.pk]), {'height': 180})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['lab_reports']), 2)
+        self.assertEqual(response.data['lab_reports_count'], 3)
+
+    def test_sparse_fields_keep_the_cap(self):
+        url = reverse('patientprofile-detail', args=[self.patients[2].patient_profile.pk])
+        with self.assertNumQueries(2):
+            response = self.client.get(url + '?fields=lab_reports.id,lab_reports_count')
+        self.assertEqual(response.data, {
+            'lab_reports': [{'id': r.pk} for r in self.reports[self.patients[2].pk][:0:-1]],
+            'lab_reports_count': 3,
+        })
+
+
+class LabReportDownloadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.patient = make_user('patient')
+        self.content = bytes(range(256)) * 1024
+        self.report = LabReport(patient=self.patient.patient_profile)
+        self.report.report.save('scan.pdf', ContentFile(self.content))
+        self.url = reverse('labreport-download', args=[self.report.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def test_full_download_streams_file_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertFalse(response['ETag'].startswith('W/'))
+        self.assertIn('Last-Modified', response)
+
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        suffix = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(suffix.streaming_content), self.content[-10:])
+
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(stale.status_code, 200)
+
+        outside = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(outside.status_code, 416)
+
+    def test_other_patients_are_refused(self):
+        self.client.force_authenticate(make_user('someone'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_reports_link_to_the_download_not_the_media_file(self):
+        data = self.client.get(reverse('labreport-detail', args=[self.report.pk])).data
+        self.assertEqual(data['report'], 'http://testserver' + self.url)
+
+    @override_settings(LAB_REPORT_DOWNLOAD_OFFLOAD='x-accel-redirect')
+    def test_offload_mode_hands_file_to_front_server(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.report.report.name)
+        self.assertEqual(response.content, b'')
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.tmp, 'media'), LAB_REPORT_UPLOAD_DIR=os.path.join(self.tmp, 'uploads')
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.patient = make_user('patient')
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.content = os.urandom(2500)
+
+    def start(self, checksum=None):
+        response = self.client.post(reverse('labreportupload-list'), {
+            'patient': self.patient.patient_profile.pk,
+            'filename': '../scan.pdf',
+            'size': len(self.content),
+            'chunk_size': 1000,
+            'checksum': checksum or hashlib.sha256(self.content).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def put_chunk(self, upload_id, number, data):
+        url = reverse('labreportupload-chunk', args=[upload_id, number])
+        return self.client.put(url, data, content_type='application/octet-stream')
+
+    def test_chunks_can_be_resent_and_finalized(self):
+        upload_id = self.start()
+        self.assertEqual(self.put_chunk(upload_id, 2, self.content[2000:]).status_code, 200)
+        # A truncated chunk is rejected and leaves nothing behind
+        self.assertEqual(self.put_chunk(upload_id, 0, self.content[:10]).status_code, 400)
+        response = self.client.post(reverse('labreportupload-finalize', args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+
+        self.put_chunk(upload_id, 0, self.content[:1000])
+        status = self.client.get(reverse('labreportupload-detail', args=[upload_id]))
+        self.assertEqual(status.data['received_chunks'], [0, 2])
+        self.put_chunk(upload_id, 1, self.content[1000:2000])
+
+        response = self.client.post(reverse('labreportupload-finalize', args=[upload_id]))
+        self.assertEqual(response.status_code, 201, response.data)
+        report = LabReport.objects.get(pk=response.data['id'])
+        self.assertEqual(os.path.basename(report.report.name), 'scan.pdf')
+        with report.report.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertFalse(LabReportUpload.objects.exists())
+
+    def test_checksum_mismatch_is_rejected(self):
+        upload_id = self.start(checksum='0' * 64)
+        for number in range(3):
+            self.put_chunk(upload_id, number, self.content[number * 1000:(number + 1) * 1000])
+        response = self.client.post(reverse('labreportupload-finalize', args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LabReport.objects.exists())
+
+    def test_abandoned_sessions_are_purged(self):
+        upload = LabReportUpload.objects.get(pk=self.start())
+        self.put_chunk(upload.pk, 0, self.content[:1000])
+        self.assertEqual(purge_expired(), 0)
+        self.assertEqual(purge_expired(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(os.path.exists(session_dir(upload)))
+
+    def test_sessions_are_private_to_their_creator(self):
+        upload_id = self.start()
+        self.client.force_authenticate(make_user('other'))
+        self.assertEqual(self.put_chunk(upload_id, 0, self.content[:1000]).status_code, 404)
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False)
+class DoctorImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.doctor = make_doctor('doctor', Department.objects.create(name='Cardiology'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def png(self, size, mode='RGB', name='portrait.png'):
+        buffer = io.BytesIO()
+        Image.new(mode, size).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def upload(self, upload):
+        url = reverse('doctorprofile-detail', args=[self.doctor.doctor_profile.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(url, {'image': upload}, format='multipart')
+
+    def test_variants_are_rendered_and_exposed(self):
+        response = self.upload(self.png((2000, 1500)))
+        self.assertEqual(response.status_code, 200, response.data)
+
+        profile = DoctorProfile.objects.get(pk=self.doctor.doctor_profile.pk)
+        self.assertEqual(set(profile.image_variants), {'thumb', 'card', 'full'})
+        with profile.image.storage.open(profile.image_variants['thumb']['webp']) as fh:
+            self.assertEqual(Image.open(fh).size, (96, 72))
+
+        data = self.client.get(reverse('doctorprofile-detail', args=[profile.pk])).data
+        self.assertTrue(data['image_variants']['card']['jpeg'].endswith('portrait_card.jpeg'))
+
+        # Replacing the image removes the old file and its variants
+        old_thumb = profile.image_variants['thumb']['jpeg']
+        self.upload(self.png((400, 400), name='new.png'))
+        self.assertFalse(profile.image.storage.exists(old_thumb))
+        profile.refresh_from_db()
+        self.assertTrue(profile.image.storage.exists(profile.image_variants['thumb']['jpeg']))
+
+    @override_settings(DOCTOR_IMAGE_MAX_PIXELS=1_000_000)
+    def test_oversized_images_are_rejected_from_the_header(self):
+        response = self.upload(self.png((4000, 4000), mode='1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    @override_settings(DOCTOR_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_large_files_are_rejected(self):
+        with self.assertRaises(ValidationError):
+            validate_doctor_image(self.png((200, 200)))
+
+    def test_stored_images_are_not_validated_again(self):
+        profile = self.doctor.doctor_profile
+        profile.image = 'doctor_images/missing.png'  # saved earlier, since removed from storage
+        profile.full_clean()
+        profile.image = self.png((200, 200))
+        profile.full_clean()
+        with override_settings(DOCTOR_IMAGE_MAX_UPLOAD_SIZE=100), self.assertRaises(ValidationError):
+            profile.full_clean()
+
+
+class FieldTrackingTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name='Cardiology')
+        make_user('patient')
+
+    def test_plain_user_save_is_a_single_update(self):
+        user = User.objects.get(username='patient')
+        user.email = 'patient@example.com'  # names would also reindex search documents
+        with self.assertNumQueries(1) as context:
+            user.save()
+        self.assertTrue(context.captured_queries[0]['sql'].startswith('UPDATE'))
+
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    def test_role_change_is_detected_without_rereading_the_user(self):
+        user = User.objects.get(username='patient')
+        self.assertFalse(user.has_changed('role'))
+        user.role = User.Role.DOCTOR
+        self.assertTrue(user.has_changed('role'))
+        self.assertEqual(user.get_original('role'), User.Role.PATIENT)
+        user.save()
+
+        self.assertFalse(PatientProfile.objects.filter(user=user).exists())
+        self.assertTrue(DoctorProfile.objects.filter(user=user).exists())
+        self.assertFalse(user.has_changed('role'))
+
+    def test_fields_left_out_of_update_fields_still_count_as_changed(self):
+        user = User.objects.get(username='patient')
+        user.role = User.Role.DOCTOR
+        user.first_name = 'Renamed'
+        user.save(update_fields=['first_name'])
+        self.assertFalse(user.has_changed('first_name'))
+        self.assertTrue(user.has_changed('role'))
+        self.assertEqual(user.get_original('role'), User.Role.PATIENT)
+
+    def test_instances_built_by_hand_fall_back_to_the_database(self):
+        user = User.objects.get(username='patient')
+        detached = User(pk=user.pk, username=user.username, role=User.Role.ADMIN)
+        self.assertEqual(detached.get_original('role'), User.Role.PATIENT)
+
+    def test_doctor_profile_save_does_not_reload_the_row(self):
+        profile = DoctorProfile.objects.get(user=make_doctor('doctor', self.department))
+        profile.bio = 'Cardiologist'
+        with self.assertNumQueries(1):
+            profile.save()
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        self.department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', self.department)
+        self.patient = make_user('patient')
+        for hour in range(3):
+            Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, time=timezone.now() + timedelta(hours=hour)
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_fields_trim_the_payload_and_the_columns(self):
+        response, sql = self.get(reverse('appointment-list') + '?fields=id,time,status')
+        self.assertEqual([set(row) for row in response.data['results']], [{'id', 'time', 'status'}] * 3)
+        self.assertNotIn('description', sql)
+        self.assertNotIn('api_user', sql)  # no join for names that were not asked for
+
+    def test_method_fields_load_only_their_sources(self):
+        response, sql = self.get(reverse('appointment-list') + '?fields=id,doctor_name,department')
+        row = response.data['results'][0]
+        self.assertEqual(row, {'id': row['id'], 'doctor_name': 'Doctor Test', 'department': 'Cardiology'})
+        self.assertNotIn('password', sql)
+        self.assertNotIn('description', sql)
+
+    def test_dotted_fields_reach_into_nested_serializers(self):
+        response, sql = self.get(reverse('doctorprofile-list') + '?fields=id,user.first_name,user.profile_id')
+        profile = self.doctor.doctor_profile
+        self.assertEqual(response.data, [{'id': profile.id, 'user': {'first_name': 'Doctor', 'profile_id': profile.id}}])
+        self.assertNotIn('password', sql)
+        self.assertNotIn('user_permissions', sql)
+
+    def test_expand_renders_relations_in_the_same_query(self):
+        url = reverse('appointment-list') + '?fields=id,patient.last_name,doctor.last_name&expand=patient,doctor'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['patient'], {'last_name': 'Test'})
+        self.assertEqual(response.data['results'][0]['doctor'], {'last_name': 'Test'})
+
+    def test_expanded_users_are_public_fields_only(self):
+        appointment = Appointment.objects.first()
+        PreVisitReport.objects.create(appointment=appointment, responses={})
+        for url in (
+            reverse('appointment-list') + '?expand=patient,doctor',
+            reverse('previsitreport-list') + '?expand=appointment.patient',
+            reverse('previsitreport-detail', args=[appointment.pk]) + '?expand=appointment.patient',
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotIn('password', response.content.decode(), url)
+            self.assertNotIn('email', response.content.decode(), url)
+        self.assertEqual(
+            set(self.client.get(reverse('appointment-list') + '?expand=patient').data['results'][0]['patient']),
+            {'id', 'first_name', 'last_name', 'role'},
+        )
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(reverse('previsitreport-list')).status_code, (401, 403))
+
+    def test_sparse_pages_keep_the_cursor(self):
+        url = reverse('appointment-list') + '?fields=id&page_size=2'
+        first = self.client.get(url).data
+        second = self.client.get(first['next']).data
+        self.assertEqual(len(first['results']) + len(second['results']), 3)
+
+    def test_unknown_names_are_rejected(self):
+        for query in ('fields=id,nope', 'expand=description', 'fields=time.hour'):
+            response = self.client.get(reverse('appointment-list') + '?' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_default_representation_is_unchanged(self):
+        response = self.client.get(reverse('appointment-list'))
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'patient', 'doctor', 'time', 'description', 'status',
+             'patient_name', 'doctor_name', 'doctor_id', 'department'},
+        )
+
+
+class CompiledListTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        cardiology = Department.objects.create(name='Cardiology')
+        doctors = [make_doctor('doctor', cardiology), make_doctor('other', Department.objects.create(name='Renal'))]
+        patient = make_user('patient', last_name='Ó Briain')
+        start = timezone.now().replace(microsecond=123456)
+        for i, status in enumerate(['pending', 'approved', 'canceled', 'Pending', 'no-show']):
+            Appointment.objects.create(
+                patient=patient, doctor=doctors[i % 2], time=start + timedelta(hours=i // 2),
+                status=status, description=None if i % 2 else f'visit {i}',
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_projection_matches_the_serializer(self):
+        queryset = AppointmentSerializer.setup_eager_loading(Appointment.objects.order_by('id'))
+        projection = compile_serializer(AppointmentSerializer)
+        compiled = projection.render(projection.rows(queryset))
+        expected = AppointmentSerializer(queryset, many=True).data
+        self.assertEqual(compiled, expected)
+        self.assertEqual([list(row) for row in compiled], [list(row) for row in expected])
+
+    def test_list_endpoint_matches_the_serializer(self):
+        url = reverse('appointment-list') + '?page_size=2'
+        with self.assertNumQueries(1):
+            compiled = self.client.get(url)
+        with mock.patch.object(AppointmentViewSet, 'compiled_list', False):
+            expected = self.client.get(url)
+        self.assertEqual(compiled.content, expected.content)
+        self.assertEqual(self.client.get(compiled.data['next']).content,
+                         self.client.get(expected.data['next']).content)
+
+    def test_serializers_that_need_instances_are_rejected(self):
+        for serializer_class in (DoctorProfileSerializer, PatientProfileSerializer, LabReportSerializer):
+            with self.assertRaises(ImproperlyConfigured):
+                compile_serializer(serializer_class)
+
+
+@shared_cache
+@override_settings(JWT_STATELESS_READS=True)
+class StatelessJWTTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.patient = make_user('patient')
+        self.client = APIClient()
+        self.login(self.patient)
+
+    def login(self, user):
+        token = MyTokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def assertRevoked(self, response):
+        # SessionAuthentication comes first, so failures are reported as 403
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['code'], 'token_revoked')
+
+    def test_reads_do_not_load_the_user(self):
+        url = reverse('appointment-list')
+        with self.assertNumQueries(1):  # just the appointments
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_still_load_the_user(self):
+        response = self.client.post(reverse('labreportupload-list'), {})
+        self.assertEqual(response.status_code, 400)
+        with self.settings(JWT_STATELESS_READS=False), self.assertNumQueries(2):
+            self.client.get(reverse('appointment-list'))
+
+    def test_role_change_revokes_outstanding_tokens(self):
+        self.patient.role = User.Role.DOCTOR
+        self.patient.save()
+        self.assertRevoked(self.client.get(reverse('appointment-list')))
+
+        self.login(self.patient)
+        self.assertEqual(self.client.get(reverse('appointment-list')).status_code, 200)
+
+    def test_deactivation_revokes_outstanding_tokens(self):
+        self.patient.is_active = False
+        self.patient.save()
+        self.assertRevoked(self.client.get(reverse('appointment-list')))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_does_not_version_tokens(self):
+        # Another worker's LocMemCache would hold a different version
+        self.assertNotIn(TOKEN_VERSION_CLAIM, MyTokenObtainPairSerializer.get_token(self.patient))
+        cache.set(token_version_key(self.patient.pk), 1, timeout=None)
+        with self.assertNumQueries(2):  # user + appointments
+            self.assertEqual(self.client.get(reverse('appointment-list')).status_code, 200)
+
+    def test_lost_version_falls_back_to_the_database(self):
+        cache.delete(token_version_key(self.patient.pk))
+        with self.assertNumQueries(2):  # user + appointments
+            self.assertEqual(self.client.get(reverse('appointment-list')).status_code, 200)
+
+
+@shared_cache
+@override_settings(JWT_REVOCATION_FILTER=True)
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        revocations.reset()
+        self.addCleanup(revocations.reset)
+        self.patient = make_user('patient')
+        self.refresh = str(MyTokenObtainPairSerializer.get_token(self.patient))
+
+    def rotate(self, refresh):
+        return self.client.post(reverse('token_refresh'), {'refresh': refresh})
+
+    def test_rotated_and_logged_out_tokens_are_rejected(self):
+        response = self.rotate(self.refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rotate(self.refresh).status_code, 401)
+
+        rotated = response.data['refresh']
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        self.assertEqual(client.post(reverse('logout'), {'refresh': rotated}).status_code, 200)
+        self.assertEqual(self.rotate(rotated).status_code, 401)
+
+    def test_unrevoked_tokens_are_checked_without_queries(self):
+        is_revoked('warm-up')
+        with self.assertNumQueries(0):
+            self.assertFalse(is_revoked(RevocableRefreshToken(self.refresh)['jti']))
+
+    def test_filter_picks_up_revocations_made_elsewhere(self):
+        token = RevocableRefreshToken(self.refresh)
+        self.assertFalse(is_revoked(token['jti']))
+        # Another process blacklists the token and bumps the shared counter
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+        cache.incr(REVOCATIONS_KEY)
+        self.assertTrue(is_revoked(token['jti']))
+
+    def test_concurrent_revocations_bumping_the_counter_once_are_both_seen(self):
+        mine, theirs = RevocableRefreshToken(self.refresh), RevocableRefreshToken(
+            str(MyTokenObtainPairSerializer.get_token(make_user('other')))
+        )
+        self.assertFalse(is_revoked(theirs['jti']))
+        version = cache.get(REVOCATIONS_KEY)
+        # Another process revokes its token; both non-atomic incrs read the same value and write version + 1
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=theirs['jti']))
+        cache.set(REVOCATIONS_KEY, version + 1, timeout=None)
+        with mock.patch.object(cache, 'incr', return_value=version + 1):
+            mine.blacklist()
+        self.assertTrue(is_revoked(mine['jti']))
+        self.assertTrue(is_revoked(theirs['jti']))
+
+    def test_expired_tokens_are_pruned_once_per_interval(self):
+        expired = OutstandingToken.objects.create(jti='old', token='x', expires_at=timezone.now() - timedelta(days=1))
+        BlacklistedToken.objects.create(token=expired)
+        self.assertEqual(maybe_prune(), 1)
+        self.assertFalse(BlacklistedToken.objects.exists())
+        self.assertEqual(OutstandingToken.objects.count(), 1)  # self.refresh has not expired
+        OutstandingToken.objects.create(jti='older', token='x', expires_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(maybe_prune(), 0)
+
+    def test_each_revocation_prunes_at_most_one_batch(self):
+        for i in range(5):
+            expired = OutstandingToken.objects.create(
+                jti=f'old{i}', token='x', expires_at=timezone.now() - timedelta(days=1)
+            )
+            BlacklistedToken.objects.create(token=expired)
+        with mock.patch('api.revocation.REQUEST_PRUNE_BATCH_SIZE', 2):
+            self.assertEqual([maybe_prune() for _ in range(4)], [2, 2, 1, 0])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(5000, 0.001)
+        members = [f'member{i}' for i in range(5000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(f'other{i}' in bloom for i in range(20000))
+        self.assertLess(false_positives, 100)
+
+
+@shared_cache
+class DoctorDirectoryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        reset_stats(DOCTOR_DIRECTORY)
+        self.department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', self.department)
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+        self.urls = [
+            reverse('doctorprofile-list'),
+            reverse('doctors-by-department', args=[self.department.pk]),
+        ]
+
+    def test_second_request_is_served_without_queries(self):
+        for url in self.urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertEqual(response.data[0]['user']['username'], 'doctor')
+        self.assertEqual(cache_stats(DOCTOR_DIRECTORY), {'hits': 2, 'misses': 2})
+
+    def assertInvalidated(self, change):
+        for url in self.urls:
+            self.client.get(url)
+        change()
+        for url in self.urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_doctor_user_changes_invalidate(self):
+        def rename():
+            self.doctor.first_name = 'Renamed'
+            self.doctor.save()
+        self.assertInvalidated(rename)
+        self.assertEqual(self.client.get(self.urls[0]).data[0]['user']['first_name'], 'Renamed')
+
+    def test_profile_and_department_changes_invalidate(self):
+        self.assertInvalidated(lambda: Department.objects.get().save())
+        self.assertInvalidated(lambda: DoctorProfile.objects.get().save())
+        self.assertInvalidated(lambda: make_doctor('second', self.department))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_not_used(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Cache', response)
+
+    def test_patient_changes_do_not_invalidate(self):
+        patient = make_user('patient')
+        self.client.get(self.urls[0])
+        patient.first_name = 'Renamed'
+        patient.save()
+        self.assertEqual(self.client.get(self.urls[0])['X-Cache'], 'HIT')
+
+    def test_unknown_department_is_not_cached(self):
+        url = reverse('doctors-by-department', args=[999])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@shared_cache
+class ReferenceDataETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.department = Department.objects.create(name='Cardiology')
+        ReportType.objects.create(name='Blood')
+        PreVisitQuestion.objects.create(department=self.department, question_text='Pain?')
+        self.client = APIClient()
+
+    def test_matching_etag_is_answered_without_queries(self):
+        for name in ('department-list', 'reporttype-list', 'previsitquestion-list'):
+            url = reverse(name)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            with self.assertNumQueries(0):
+                revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated['ETag'], etag)
+
+    def test_changes_produce_a_new_etag(self):
+        url = reverse('department-detail', args=[self.department.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(self.client.get(reverse('department-list'))['ETag'], etag)
+
+        self.department.description = 'Heart'
+        self.department.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['description'], 'Heart')
+
+    def test_other_tables_keep_their_etag(self):
+        url = reverse('reporttype-list')
+        etag = self.client.get(url)['ETag']
+        Department.objects.create(name='Neurology')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_expanded_relations_change_the_etag(self):
+        url = reverse('previsitquestion-list') + '?expand=department'
+        etag = self.client.get(url)['ETag']
+        self.department.name = 'Heart'
+        self.department.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['department']['name'], 'Heart')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_sends_no_etag(self):
+        response = self.client.get(reverse('department-list'), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class AppointmentBatchTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', department)
+        self.patient = make_user('patient')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('appointment-batch')
+
+    def slot(self, n):
+        return self.start + timedelta(minutes=30 * n)
+
+    def post(self, operations):
+        return self.client.post(self.url, {'operations': operations}, format='json')
+
+    def test_times_off_the_slot_grid_are_rejected(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.slot(0))
+        overlapping = (self.slot(0) + timedelta(minutes=10)).isoformat()
+        response = self.client.post(
+            reverse('appointment-list'), {'patient': self.patient.pk, 'doctor': self.doctor.pk, 'time': overlapping}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('time', response.data)
+        response = self.post([{'op': 'create', 'patient': self.patient.pk, 'doctor': self.doctor.pk, 'time': overlapping}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_appointments_can_swap_slots(self):
+        first = Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.slot(0))
+        second = Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.slot(1))
+        response = self.post([
+            {'op': 'reschedule', 'id': first.pk, 'time': self.slot(1).isoformat()},
+            {'op': 'reschedule', 'id': second.pk, 'time': self.slot(0).isoformat()},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.time, first.status), (self.slot(1), 'pending'))
+        self.assertEqual((second.time, second.status), (self.slot(0), 'pending'))
+
+    def test_bulk_reschedule_is_a_handful_of_queries(self):
+        appointments = Appointment.objects.bulk_create(
+            Appointment(patient=self.patient, doctor=self.doctor, time=self.slot(i)) for i in range(200)
+        )
+        operations = [
+            {'op': 'reschedule', 'id': a.pk, 'time': self.slot(i + 1000).isoformat()}
+            for i, a in enumerate(appointments)
+        ]
+        # targets, conflicts, savepoint, update, daily stats insert + update, release
+        with self.assertNumQueries(7):
+            response = self.post(operations)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Appointment.objects.filter(time__gte=self.slot(1000)).count(), 200)
+
+    def test_mixed_operations(self):
+        existing = Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.slot(0))
+        response = self.post([
+            {'op': 'status', 'id': existing.pk, 'status': 'canceled'},
+            # the canceled appointment's slot can be reused in the same batch
+            {'op': 'create', 'patient': self.patient.pk, 'doctor': self.doctor.pk, 'time': self.slot(0).isoformat()},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([r['op'] for r in response.data['results']], ['status', 'create'])
+        self.assertEqual(Appointment.objects.exclude(status='canceled').count(), 1)
+
+    def test_any_invalid_item_rejects_the_whole_batch(self):
+        existing = Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.slot(0))
+        response = self.post([
+            {'op': 'reschedule', 'id': existing.pk, 'time': self.slot(1).isoformat()},
+            {'op': 'create', 'patient': self.patient.pk, 'doctor': self.doctor.pk, 'time': self.slot(1).isoformat()},
+            {'op': 'create', 'patient': self.patient.pk, 'doctor': self.patient.pk, 'time': self.slot(2).isoformat()},
+            {'op': 'status', 'id': 999999, 'status': 'approved'},
+            {'op': 'status', 'id': existing.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.data['results']
+        self.assertEqual(results[0], {'index': 0, 'status': 'valid'})
+        self.assertIn('time', results[1]['errors'])
+        self.assertIn('doctor', results[2]['errors'])
+        self.assertIn('id', results[3]['errors'])
+        self.assertIn('status', results[4]['errors'])
+        existing.refresh_from_db()
+        self.assertEqual(existing.time, self.slot(0))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_patients_only_touch_their_own_appointments(self):
+        other = make_user('other')
+        theirs = Appointment.objects.create(patient=other, doctor=self.doctor, time=self.slot(0))
+        self.client.force_authenticate(self.patient)
+        response = self.post([
+            {'op': 'status', 'id': theirs.pk, 'status': 'canceled'},
+            {'op': 'create', 'patient': other.pk, 'doctor': self.doctor.pk, 'time': self.slot(1).isoformat()},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('id', response.data['results'][0]['errors'])
+        self.assertIn('patient', response.data['results'][1]['errors'])
+
+
+class AppointmentStatsTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        cardiology = Department.objects.create(name='Cardiology')
+        neurology = Department.objects.create(name='Neurology')
+        self.cardiologist = make_doctor('cardiologist', cardiology)
+        self.neurologist = make_doctor('neurologist', neurology)
+        self.patient = make_user('patient')
+        day = timezone.make_aware(datetime(2025, 3, 3, 9))  # a Monday
+        for offset, doctor, status in [
+            (0, self.cardiologist, 'pending'),
+            (0, self.neurologist, 'completed'),
+            (1, self.cardiologist, 'completed'),
+            (8, self.cardiologist, 'canceled'),
+            (40, self.neurologist, 'pending'),  # outside the queried range
+        ]:
+            Appointment.objects.create(
+                patient=self.patient, doctor=doctor, status=status, time=day + timedelta(days=offset)
+            )
+        self.client = APIClient()
+        self.url = reverse('appointment-stats')
+
+    def get(self, user, group_by):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url, {'group_by': group_by, 'start': '2025-03-01', 'end': '2025-03-31'})
+
+    def test_group_by_day_counts_every_status(self):
+        with self.assertNumQueries(1):
+            response = self.get(self.admin, 'day')
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data['results']
+        self.assertEqual([str(row['day']) for row in results], ['2025-03-03', '2025-03-04', '2025-03-11'])
+        self.assertEqual(set(results[0]['counts']), {value for value, _ in Appointment.STATUS_CHOICES})
+        self.assertEqual((results[0]['counts']['pending'], results[0]['counts']['completed']), (1, 1))
+        self.assertEqual(results[0]['total'], 2)
+
+    def test_group_by_week_and_department(self):
+        weeks = self.get(self.admin, 'week').data['results']
+        self.assertEqual([(str(row['week']), row['total']) for row in weeks], [('2025-03-03', 3), ('2025-03-10', 1)])
+        departments = self.get(self.admin, 'department').data['results']
+        self.assertEqual(
+            [(row['department_name'], row['total']) for row in departments], [('Cardiology', 3), ('Neurology', 1)]
+        )
+
+    def test_doctors_only_see_their_own_appointments(self):
+        rows = self.get(self.cardiologist, 'doctor').data['results']
+        self.assertEqual([(row['doctor'], row['total']) for row in rows], [(self.cardiologist.id, 3)])
+        self.assertEqual(self.get(self.patient, 'day').status_code, 403)
+
+    def test_appointments_booked_through_the_api_are_counted(self):
+        self.client.force_authenticate(self.patient)
+        for doctor in (self.cardiologist, self.neurologist):
+            response = self.client.post(reverse('appointment-list'), {
+                'patient': self.patient.pk, 'doctor': doctor.pk,
+                'time': timezone.make_aware(datetime(2025, 3, 5, 10)).isoformat(),
+            })
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(response.data['status'], 'pending')
+        row = next(row for row in self.get(self.admin, 'day').data['results'] if str(row['day']) == '2025-03-05')
+        self.assertEqual((row['counts']['pending'], row['total']), (2, 2))
+
+    def test_rejects_bad_parameters(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(self.url, {'group_by': 'month', 'start': '2025-03-01', 'end': '2025-03-31'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': '2020-01-01', 'end': '2025-03-31'}).status_code, 400)
+
+
+
+class DailyStatsTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', role=User.Role.ADMIN)
+        self.doctor = make_doctor('doctor', Department.objects.create(name='Cardiology'))
+        self.patient = make_user('patient')
+        self.blood = ReportType.objects.create(name='Blood')
+        self.day = timezone.make_aware(datetime(2025, 3, 3, 9))
+
+    def snapshot(self):
+        return {
+            'appointments': set(
+                AppointmentDailyStat.objects.filter(count__gt=0).values_list('doctor_id', 'day', 'status', 'count')
+            ),
+            'patients': set(PatientDailyStat.objects.filter(count__gt=0).values_list('day', 'count')),
+            'lab_reports': set(
+                LabReportDailyStat.objects.filter(count__gt=0).values_list('report_type_id', 'day', 'count')
+            ),
+        }
+
+    def test_signals_keep_counts_in_line_with_a_rebuild(self):
+        first = Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.day, status='pending')
+        second = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, time=self.day + timedelta(hours=1), status='pending'
+        )
+        first.status = 'completed'
+        first.save()
+        second.time += timedelta(days=1)
+        second.save()
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, time=self.day + timedelta(days=2), status='approved'
+        ).delete()
+        report = LabReport.objects.create(patient=self.patient.patient_profile, report='r.pdf', report_type=self.blood)
+        LabReport.objects.create(patient=self.patient.patient_profile, report='untyped.pdf')
+        report.report_type = ReportType.objects.create(name='Urine')
+        report.save()
+        make_user('leaving').delete()
+
+        incremental = self.snapshot()
+        self.assertEqual(incremental['appointments'], {
+            (self.doctor.id, self.day.date(), 'completed', 1),
+            (self.doctor.id, self.day.date() + timedelta(days=1), 'pending', 1),
+        })
+        rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_batch_writes_update_the_statistics(self):
+        existing = Appointment.objects.create(patient=self.patient, doctor=self.doctor, time=self.day)
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('appointment-batch'), {'operations': [
+            {'op': 'status', 'id': existing.pk, 'status': 'canceled'},
+            {'op': 'create', 'patient': self.patient.pk, 'doctor': self.doctor.pk, 'time': self.day.isoformat()},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.json())
+        counts = dict(AppointmentDailyStat.objects.filter(count__gt=0).values_list('status', 'count'))
+        self.assertEqual(counts, {'canceled': 1, 'pending': 1})
+        incremental = self.snapshot()
+        rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_daily_endpoint(self):
+        LabReport.objects.create(patient=self.patient.patient_profile, report='r.pdf', report_type=self.blood)
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        today = timezone.localdate()
+        response = client.get(reverse('daily-stats'), {'start': today, 'end': today})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['new_patients'], [{'day': today, 'count': 3}])
+        self.assertEqual(
+            [(row['report_type_name'], row['count']) for row in response.data['lab_reports']], [('Blood', 1)]
+        )
+        client.force_authenticate(self.doctor)
+        self.assertEqual(client.get(reverse('daily-stats'), {'start': today, 'end': today}).status_code, 403)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', department)
+        self.patient = make_user('patient', first_name='Amira', last_name='Hassan')
+        self.other = make_user('other', first_name='Omar', last_name='Said')
+        self.question = PreVisitQuestion.objects.create(department=department, question_text='Where does it hurt?')
+        self.day = timezone.make_aware(datetime(2025, 3, 3, 9))
+        self.report = self.previsit(self.patient, 0, {str(self.question.pk): 'Sharp chest pain when climbing stairs'})
+        self.previsit(self.other, 1, {str(self.question.pk): 'Headache and some chest tightness'})
+        LabReport.objects.create(
+            patient=self.patient.patient_profile, report='lab_reports/cbc.pdf',
+            report_type=ReportType.objects.create(name='Complete blood count'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def previsit(self, patient, n, responses):
+        appointment = Appointment.objects.create(
+            patient=patient, doctor=self.doctor, time=self.day + timedelta(hours=n)
+        )
+        return PreVisitReport.objects.create(appointment=appointment, responses=responses)
+
+    def find(self, q, **params):
+        response = self.client.get(reverse('search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_phrases_questions_and_names_are_searchable(self):
+        [hit] = self.find('"chest pain"')['results']
+        self.assertEqual((hit['type'], hit['id'], hit['appointment']), ('previsit_report', self.report.pk, self.report.appointment_id))
+        self.assertIn('[chest pain]', hit['snippet'])
+        self.assertEqual(len(self.find('hurt')['results']), 2)
+        self.assertEqual([r['type'] for r in self.find('amira blood')['results']], ['lab_report'])
+        self.assertEqual(self.find('chest OR NEAR(')['results'], [])  # operators are plain words
+
+    def test_index_follows_edits_and_deletes(self):
+        self.patient.last_name = 'Mansour'
+        self.patient.save()
+        self.assertEqual(len(self.find('mansour')['results']), 2)
+        self.question.question_text = 'Describe the symptoms'
+        self.question.save()
+        self.assertEqual(len(self.find('symptoms', type='previsit_report')['results']), 2)
+        self.report.delete()
+        self.assertEqual(self.find('stairs')['results'], [])
+
+    def test_patients_only_find_their_own_documents(self):
+        self.client.force_authenticate(self.other)
+        self.assertEqual([r['patient'] for r in self.find('chest')['results']], [self.other.pk])
+
+    def test_pagination(self):
+        page = self.find('chest', limit=1)
+        self.assertEqual(len(page['results']), 1)
+        self.assertIn('offset=1', page['next'])
+        last = self.client.get(page['next']).data
+        self.assertIsNone(last['next'])
+        self.assertIsNotNone(last['previous'])
+
+
+class PreVisitAnswerTests(TestCase):
+    def setUp(self):
+        self.cardiology = Department.objects.create(name='Cardiology')
+        neurology = Department.objects.create(name='Neurology')
+        self.cardiologist = make_doctor('cardiologist', self.cardiology)
+        self.neurologist = make_doctor('neurologist', neurology)
+        self.patient = make_user('patient')
+        self.smoker = PreVisitQuestion.objects.create(department=self.cardiology, question_text='Do you smoke?')
+        self.pain = PreVisitQuestion.objects.create(department=self.cardiology, question_text='Where is the pain?')
+        self.day = timezone.make_aware(datetime(2025, 3, 3, 9))
+        self.client = APIClient()
+        self.client.force_authenticate(make_user('admin', role=User.Role.ADMIN))
+
+    def report(self, doctor, n, responses):
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=doctor, time=self.day + timedelta(hours=n)
+        )
+        return PreVisitReport.objects.create(appointment=appointment, responses=responses)
+
+    def matching(self, **params):
+        response = self.client.get(reverse('appointment-list'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['id'] for row in response.data['results']]
+
+    def test_both_response_shapes_are_normalized(self):
+        keyed = self.report(self.cardiologist, 0, {str(self.smoker.pk): ' Yes ', str(self.pain.pk): ['chest', 'arm']})
+        listed = self.report(self.neurologist, 1, [{'question': self.smoker.pk, 'answer': 'yes'}, {'note': 'ignored'}])
+        self.report(self.cardiologist, 2, {str(self.smoker.pk): 'no', '999999': 'unknown question'})
+
+        self.assertEqual(
+            dict(keyed.answers.values_list('question_id', 'answer')),
+            {self.smoker.pk: ' Yes ', self.pain.pk: 'chest, arm'},
+        )
+        self.assertEqual(PreVisitAnswer.objects.count(), 4)
+        self.assertEqual(
+            self.matching(question=self.smoker.pk, answer='YES'), [keyed.appointment_id, listed.appointment_id]
+        )
+        self.assertEqual(
+            self.matching(department=self.cardiology.pk, question=self.smoker.pk, answer='yes'), [keyed.appointment_id]
+        )
+
+    def test_changed_responses_replace_the_answers(self):
+        report = self.report(self.cardiologist, 0, {str(self.smoker.pk): 'yes'})
+        report.responses = {str(self.smoker.pk): 'no'}
+        report.save()
+        self.assertEqual(list(report.answers.values_list('value', flat=True)), ['no'])
+        self.assertEqual(self.matching(question=self.smoker.pk, answer='yes'), [])
+
+    def test_responses_edited_in_place_replace_the_answers(self):
+        created = self.report(self.cardiologist, 0, {str(self.smoker.pk): 'yes'})
+        created.responses[str(self.smoker.pk)] = 'no'
+        created.save()
+        self.assertEqual(list(created.answers.values_list('value', flat=True)), ['no'])
+        loaded = PreVisitReport.objects.get(pk=created.pk)
+        loaded.responses[str(self.pain.pk)] = 'chest'
+        loaded.save()
+        self.assertEqual(
+            dict(loaded.answers.values_list('question_id', 'value')), {self.smoker.pk: 'no', self.pain.pk: 'chest'}
+        )
+
+    def test_question_and_answer_go_together(self):
+        response = self.client.get(reverse('appointment-list'), {'question': self.smoker.pk})
+        self.assertEqual(response.status_code, 400)
+
+
+@shared_cache
+class AsyncReadPathTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        department = Department.objects.create(name='Cardiology')
+        self.doctor = make_doctor('doctor', department)
+        self.patient = make_user('patient')
+        start = timezone.now().replace(microsecond=0)
+        for i in range(3):
+            appointment = Appointment.objects.create(
+                patient=self.patient, doctor=self.doctor, time=start + timedelta(hours=i)
+            )
+            LabReport.objects.create(patient=self.patient.patient_profile, report=f'lab_reports/{i}.pdf')
+        self.report = PreVisitReport.objects.create(appointment=appointment, responses={'pain': 'no'})
+        token = MyTokenObtainPairSerializer.get_token(self.patient).access_token
+        self.auth = {'Authorization': f'Bearer {token}'}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    async def test_lists_match_the_sync_endpoints(self):
+        for sync_name, async_name in [
+            ('appointment-list', 'async-appointment-list'),
+            ('labreport-list', 'async-labreport-list'),
+        ]:
+            expected = (await sync_to_async(self.client.get)(reverse(sync_name), {'page_size': 2})).json()
+            response = await self.async_client.get(reverse(async_name), {'page_size': 2}, headers=self.auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['results'], expected['results'])
+            self.assertIn('/api/async/', response.json()['next'])
+
+    async def test_doctor_directory_shares_the_sync_cache(self):
+        await sync_to_async(self.client.get)(reverse('doctorprofile-list'))
+        response = await self.async_client.get(reverse('async-doctor-list'), headers=self.auth)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual([doctor['user']['id'] for doctor in response.json()], [self.doctor.id])
+
+    async def test_previsit_report_detail(self):
+        url = reverse('async-previsitreport-detail', args=[self.report.appointment_id])
+        response = await self.async_client.get(url, headers=self.auth)
+        self.assertEqual(response.json()['responses'], {'pain': 'no'})
+        missing = reverse('async-previsitreport-detail', args=[self.report.appointment_id + 100])
+        self.assertEqual((await self.async_client.get(missing, headers=self.auth)).status_code, 404)
+
+    async def test_authentication_errors_mirror_the_sync_views(self):
+        url = reverse('async-appointment-list')
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+        self.assertEqual((await self.async_client.post(url, headers=self.auth)).status_code, 405)
+        await sync_to_async(revoke_user_tokens)(self.patient.pk)
+        response = await self.async_client.get(url, headers=self.auth)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['code'], 'token_revoked')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PatientImportTests(TestCase):
+    CSV = (
+        "Username,Email,First_Name,Last_Name,Password,Phone,DOB,Height,Weight\n"
+        "amira,amira@example.com,Amira,Haddad,s3cret,0123456789,1990-04-01,165,60\n"
+        "omar,,Omar,Saleh,,,,,\n"
+        ",nobody@example.com,No,Username,,,,,\n"
+        "existing,,Taken,Name,,,,,\n"
+        "lina,,Lina,Khoury,,,01/02/1990,170,65\n"
+        "amira,,Amira,Again,,,,,\n"
+    )
+
+    def setUp(self):
+        make_user('existing')
+
+    def run_import(self, **kwargs):
+        return import_patients(read_rows(io.BytesIO(self.CSV.encode()), 'patients.csv'), batch_size=2, **kwargs)
+
+    def test_valid_rows_become_patients_without_signals(self):
+        patients_before = PatientDailyStat.objects.get(day=timezone.localdate()).count
+        result = self.run_import(workers=2)
+
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['errors'], [
+            (4, 'username is required'),
+            (5, "username 'existing' already exists"),
+            (6, 'dob must be a YYYY-MM-DD date'),
+            (7, "username 'amira' appears more than once"),
+        ])
+        amira = User.objects.get(username='amira')
+        self.assertEqual((amira.role, amira.phone, amira.dob.isoformat()), (User.Role.PATIENT, '0123456789', '1990-04-01'))
+        self.assertTrue(amira.check_password('s3cret'))
+        self.assertFalse(User.objects.get(username='omar').has_usable_password())
+        self.assertEqual(amira.patient_profile.bmi, 22.04)
+        self.assertIsNone(User.objects.get(username='omar').patient_profile.bmi)
+        self.assertEqual(PatientDailyStat.objects.get(day=timezone.localdate()).count, patients_before + 2)
+
+    def test_rejects_unknown_formats_and_missing_username_column(self):
+        with self.assertRaises(PatientImportError):
+            list(read_rows(io.BytesIO(b''), 'patients.txt'))
+        with self.assertRaises(PatientImportError):
+            list(read_rows(io.BytesIO(b'email\nx@example.com\n'), 'patients.csv'))
+
+    def test_admin_import(self):
+        self.client.force_login(make_user('staff', role=User.Role.ADMIN, is_staff=True, is_superuser=True))
+        upload = SimpleUploadedFile('patients.csv', self.CSV.encode(), content_type='text/csv')
+        response = self.client.post(reverse('admin:api_patientprofile_import'), {'file': upload})
+        self.assertRedirects(response, reverse('admin:api_patientprofile_changelist'))
+        self.assertTrue(User.objects.filter(username='omar').exists())
+
+    @override_settings(PATIENT_IMPORT_ADMIN_MAX_ROWS=3)
+    def test_admin_import_refuses_large_files(self):
+        self.client.force_login(make_user('staff', role=User.Role.ADMIN, is_staff=True, is_superuser=True))
+        upload = SimpleUploadedFile('patients.csv', self.CSV.encode(), content_type='text/csv')
+        response = self.client.post(reverse('admin:api_patientprofile_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('import_patients', str(response.context['form'].errors['file']))
+        self.assertFalse(User.objects.filter(username='omar').exists())
@@ -0,0 +1,114 @@
+"""
+Disk handling for resumable lab report uploads.
+
+Each LabReportUpload owns a directory under LAB_REPORT_UPLOAD_DIR holding one
+file per received chunk. Chunks are copied from the request stream in small
+blocks, so memory use is bounded whatever the chunk or file size. On finalize
+the chunks are stitched together while hashing, checked against the declared
+SHA-256, and handed to the LabReport storage.
+"""
+import hashlib
+import os
+import shutil
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import LabReport, LabReportUpload
+
+BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def session_dir(upload):
+    return os.path.join(settings.LAB_REPORT_UPLOAD_DIR, str(upload.pk))
+
+
+def chunk_path(upload, number):
+    return os.path.join(session_dir(upload), f'{number:06d}.part')
+
+
+def received_chunks(upload):
+    try:
+        names = os.listdir(session_dir(upload))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name.split('.')[0]) for name in names if name.endswith('.part'))
+
+
+def write_chunk(upload, number, stream):
+    """Copy chunk `number` from `stream` to disk, replacing any earlier attempt."""
+    if not 0 <= number < upload.chunk_count:
+        raise UploadError(f'Chunk number must be between 0 and {upload.chunk_count - 1}')
+    expected = upload.chunk_length(number)
+
+    os.makedirs(session_dir(upload), exist_ok=True)
+    final_path = chunk_path(upload, number)
+    partial_path = final_path + '.tmp'
+    written = 0
+    with open(partial_path, 'wb') as fh:
+        while written <= expected:
+            block = stream.read(min(BLOCK_SIZE, expected + 1 - written))
+            if not block:
+                break
+            fh.write(block)
+            written += len(block)
+    if written != expected:
+        os.remove(partial_path)
+        raise UploadError(f'Chunk {number} must be exactly {expected} bytes')
+    # Only complete chunks become visible, so an interrupted PUT is simply retried
+    os.replace(partial_path, final_path)
+    LabReportUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now())
+
+
+def finalize(upload):
+    """Assemble the chunks, verify the checksum and create the LabReport."""
+    missing = sorted(set(range(upload.chunk_count)) - set(received_chunks(upload)))
+    if missing:
+        raise UploadError(f'Missing chunks: {missing[:20]}')
+
+    assembled_path = os.path.join(session_dir(upload), 'assembled')
+    digest = hashlib.sha256()
+    with open(assembled_path, 'wb') as out:
+        for number in range(upload.chunk_count):
+            with open(chunk_path(upload, number), 'rb') as part:
+                while block := part.read(BLOCK_SIZE):
+                    digest.update(block)
+                    out.write(block)
+    if digest.hexdigest() != upload.checksum.lower():
+        os.remove(assembled_path)
+        raise UploadError('Checksum mismatch; re-upload the chunks')
+
+    directory = session_dir(upload)
+    with transaction.atomic(), open(assembled_path, 'rb') as fh:
+        report = LabReport(patient_id=upload.patient_id, report_type_id=upload.report_type_id)
+        report.report.save(upload.filename, File(fh), save=True)
+        upload.delete()
+    shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+def discard_files(upload):
+    shutil.rmtree(session_dir(upload), ignore_errors=True)
+
+
+def purge_expired(now=None):
+    """Delete sessions idle for longer than LAB_REPORT_UPLOAD_EXPIRY; returns how many."""
+    cutoff = (now or timezone.now()) - settings.LAB_REPORT_UPLOAD_EXPIRY
+    expired = list(LabReportUpload.objects.filter(updated_at__lt=cutoff))
+    for upload in expired:
+        discard_files(upload)
+    LabReportUpload.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+
+    # Directories whose session row is already gone (e.g. deleted via the admin)
+    known = {str(pk) for pk in LabReportUpload.objects.values_list('pk', flat=True)}
+    if os.path.isdir(settings.LAB_REPORT_UPLOAD_DIR):
+        for name in os.listdir(settings.LAB_REPORT_UPLOAD_DIR):
+            if name not in known:
+                shutil.rmtree(os.path.join(settings.LAB_REPORT_UPLOAD_DIR, name), ignore_errors=True)
+    return len(expired)
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .views import *
+from . import async_views
 
 # Create a router and register our viewsets with it.
 router = DefaultRouter()
@@ -11,6 +12,7 @@ router.register(r'doctors', DoctorProfileViewSet)
 router.register(r'patients', PatientProfileViewSet)
 router.register(r'reporttypes', ReportTypeViewSet)
 router.register(r'labreports', LabReportViewSet)
+router.register(r'labreport-uploads', LabReportUploadViewSet)
 router.register(r'appointments', AppointmentViewSet)
 router.register(r'previsitquestions', PreVisitQuestionViewSet)
 router.register(r'previsitreports', PreVisitReportViewSet)
@@ -32,6 +34,8 @@ urlpatterns = [
 
     # Doctors Custom Requests
     path('doctors/department/<int:department_id>/', DoctorProfileViewSet.doctors_by_department, name='doctors-by-department'),
+    path('doctors/department/<int:department_id>/slots/', DoctorProfileViewSet.available_slots_by_department, name='doctor-slots-by-department'),
+    path('doctors/<int:doctor_id>/slots/', DoctorProfileViewSet.available_slots, name='doctor-slots'),
 
 
     # LabReports Custom Requests
@@ -44,4 +48,17 @@ urlpatterns = [
     # path('appointments/patient/', AppointmentViewSet.patient_appointments, name='patient-appointments'),
     path('appointments/patient/<int:patient_id>/', AppointmentViewSet.patient_appointments, name='patient-appointments-admin'),
 
+    # Dashboard statistics
+    path('stats/daily/', DailyStatsView.as_view(), name='daily-stats'),
+
+    # Full-text search
+    path('search/', SearchView.as_view(), name='search'),
+
+    # Async read path for ASGI deployments (see api/async_views.py)
+    path('async/appointments/', async_views.appointment_list, name='async-appointment-list'),
+    path('async/doctors/', async_views.doctor_list, name='async-doctor-list'),
+    path('async/labreports/', async_views.lab_report_list, name='async-labreport-list'),
+    path('async/previsitreports/<int:appointment>/', async_views.previsit_report_detail,
+         name='async-previsitreport-detail'),
+
 ]
\ No newline at end of file
@@ -1,12 +1,33 @@
-from rest_framework import viewsets, status
+import hashlib
+import io
+
+from rest_framework import mixins, viewsets, status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags, quote_etag
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
 from .models import *
 from .serializers import *
-from rest_framework.decorators import api_view, permission_classes
+from .authentication import TOKEN_VERSION_CLAIM, current_token_version
+from .revocation import RevocableRefreshToken
+from .batch import apply_batch
+from .caching import DOCTOR_DIRECTORY, cache_is_shared, cached, get_version
+from .downloads import serve_file
+from .uploads import UploadError, discard_files, write_chunk, finalize as finalize_upload
+from .slots import free_slots, reserve_slot
+from .stats import GROUPINGS, STATUSES, daily_totals, status_counts
+from . import search
+from .previsit import filter_by_answer
+from .signals import REFERENCE_MODELS
+from .sparse import SparseQuerysetMixin, expanded_models, is_sparse, plan_queryset
+from .compiled import CompiledListMixin
+from .pagination import AppointmentPagination, LabReportPagination, UserPagination
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
@@ -24,6 +45,9 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         # token['groups'] = user.groups.all()
         token['username'] = user.username
         token['role'] = user.role
+        version = current_token_version(user.pk)
+        if version is not None:
+            token[TOKEN_VERSION_CLAIM] = version
         
         if user.role == 'DOCTOR' and hasattr(user, 'doctor_profile'):
             token['profile_id'] = user.doctor_profile.id
@@ -61,67 +85,268 @@ class LogoutView(APIView):
 
     def post(self, request):
         try:
-            token = RefreshToken(request.data["refresh"])
+            token = RevocableRefreshToken(request.data["refresh"])
             token.blacklist()
             return Response({"message": "Successfully logged out"}, status=status.HTTP_200_OK)
         except Exception:
             return Response({"error": "Invalid token"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class VersionedETagMixin:
+    """
+    Conditional GET for small reference tables. The ETag is derived from the
+    table's change version (bumped by api.signals) and the requested URL, so
+    a matching If-None-Match is answered with 304 before any query runs.
+    Relations rendered through ?expand= add their own table's version.
+    Versions bumped in a per-process cache would not reach the other
+    workers, so without a shared cache no ETag is sent.
+    """
+
+    def get_etag(self, request):
+        """The ETag, or None when the response reads a table without a version."""
+        models = [self.get_queryset().model, *expanded_models(self.get_serializer_class(), request)]
+        if not all(model in REFERENCE_MODELS for model in models):
+            return None
+        versions = ','.join(f"{model._meta.db_table}:{get_version(model._meta.db_table)}" for model in models)
+        representation = f"{request.get_full_path()}|{request.META.get('HTTP_ACCEPT', '')}"
+        digest = hashlib.sha256(f"{versions}:{representation}".encode()).hexdigest()
+        return quote_etag(digest[:32])
+
+    def conditional(self, request, handler, *args, **kwargs):
+        etag = self.get_etag(request) if cache_is_shared() else None
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, super().retrieve, *args, **kwargs)
+
+class UserViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UserPagination
 
     # Return users based on roles
     def get_queryset(self):
         user = self.request.user
         if user.role == User.Role.ADMIN:
-            return User.objects.all()
+            queryset = User.objects.all()
         elif user.role == User.Role.DOCTOR:
-            return User.objects.filter(role=User.Role.DOCTOR)
-        return User.objects.filter(id=user.id)  # Patients see only themselves
+            queryset = User.objects.filter(role=User.Role.DOCTOR)
+        else:
+            queryset = User.objects.filter(id=user.id)  # Patients see only themselves
+        return UserSerializer.setup_eager_loading(queryset)
 
-class DepartmentViewSet(viewsets.ModelViewSet):
+class DepartmentViewSet(VersionedETagMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializer
 
-class DoctorProfileViewSet(viewsets.ModelViewSet):
+class DoctorProfileViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = DoctorProfile.objects.all()
     serializer_class = DoctorProfileSerializer
 
+    def get_queryset(self):
+        return DoctorProfileSerializer.setup_eager_loading(DoctorProfile.objects.all())
+
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return _directory_response(request, 'all', lambda: list(build(request, *args, **kwargs).data))
+
     @api_view(['GET'])
     @permission_classes([IsAuthenticated])
     def doctors_by_department(request, department_id):
-        try:
+        def build():
             department = Department.objects.get(id=department_id)
-            doctors = DoctorProfile.objects.filter(department=department)
-            serializer = DoctorProfileSerializer(doctors, many=True)
-            return Response(serializer.data, status=200)
+            doctors = DoctorProfileSerializer.setup_eager_loading(
+                DoctorProfile.objects.filter(department=department)
+            )
+            if is_sparse(request):
+                doctors = plan_queryset(doctors, DoctorProfileSerializer(context={'request': request}))
+            return list(DoctorProfileSerializer(doctors, many=True, context={'request': request}).data)
+
+        try:
+            return _directory_response(request, f'department:{department_id}', build)
         except Department.DoesNotExist:
             return Response({"error": "Department not found"}, status=404)
 
-class PatientProfileViewSet(viewsets.ModelViewSet):
+    @api_view(['GET'])
+    @permission_classes([IsAuthenticated])
+    def available_slots_by_department(request, department_id):
+        if not Department.objects.filter(id=department_id).exists():
+            return Response({"error": "Department not found"}, status=404)
+        return _available_slots(request, DoctorProfile.objects.filter(department_id=department_id))
+
+    @api_view(['GET'])
+    @permission_classes([IsAuthenticated])
+    def available_slots(request, doctor_id):
+        doctors = DoctorProfile.objects.filter(id=doctor_id)
+        if not doctors.exists():
+            return Response({"error": "Doctor not found"}, status=404)
+        return _available_slots(request, doctors)
+
+def directory_cache_key(request, key):
+    return f"{request.scheme}://{request.get_host()}|{key}|{request.GET.urlencode()}"
+
+
+def _directory_response(request, key, build):
+    """
+    Serve a doctor directory payload from the versioned cache. Entries are
+    invalidated by api.signals whenever a doctor, doctor user or department
+    changes; the host is part of the key because image URLs are absolute.
+    """
+    if not settings.DOCTOR_DIRECTORY_CACHE_ENABLED or not cache_is_shared():
+        return Response(build(), status=200)
+    data, hit = cached(
+        DOCTOR_DIRECTORY, directory_cache_key(request, key), build, timeout=settings.DOCTOR_DIRECTORY_CACHE_TIMEOUT
+    )
+    response = Response(data, status=200)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+def _date_range(request, max_days):
+    """(start, end, None) from the ?start= and ?end= dates, or (None, None, error response)."""
+    try:
+        first_day = parse_date(request.query_params.get('start', ''))
+        last_day = parse_date(request.query_params.get('end', ''))
+    except ValueError:
+        first_day = last_day = None
+    if first_day is None or last_day is None:
+        return None, None, Response({"error": "start and end dates (YYYY-MM-DD) are required"}, status=400)
+    if last_day < first_day or (last_day - first_day).days >= max_days:
+        return None, None, Response({"error": f"Date range must be between 1 and {max_days} days"}, status=400)
+    return first_day, last_day, None
+
+
+def _available_slots(request, doctors):
+    """Free slots for `doctors` between the ?start= and ?end= dates (inclusive)."""
+    first_day, last_day, error = _date_range(request, settings.FREE_SLOT_MAX_DAYS)
+    if error:
+        return error
+
+    doctors = list(doctors.select_related('user').prefetch_related('working_hours'))
+    slots = free_slots(doctors, first_day, last_day)
+    return Response([
+        {
+            "doctor_id": doctor.id,
+            "doctor_name": f"{doctor.user.first_name} {doctor.user.last_name}",
+            "slots": slots[doctor.id],
+        }
+        for doctor in doctors
+    ], status=200)
+
+class PatientProfileViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = PatientProfile.objects.all()
     serializer_class = PatientProfileSerializer
 
-class ReportTypeViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        return PatientProfileSerializer.setup_eager_loading(PatientProfile.objects.all())
+
+class ReportTypeViewSet(VersionedETagMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = ReportType.objects.all()
     serializer_class = ReportTypeSerializer
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(CompiledListMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
+    pagination_class = AppointmentPagination
 
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
         if user.role == User.Role.DOCTOR:
-            return Appointment.objects.filter(doctor=user)
+            queryset = Appointment.objects.filter(doctor_id=user.id)
         elif user.role == User.Role.PATIENT:
-            return Appointment.objects.filter(patient=user)
-        return Appointment.objects.all()  # Default empty queryset
+            queryset = Appointment.objects.filter(patient_id=user.id)
+        else:
+            queryset = Appointment.objects.all()  # Default empty queryset
+        if self.action == 'list':
+            queryset = self.filter_list(queryset)
+        return AppointmentSerializer.setup_eager_loading(queryset)
+
+    def filter_list(self, queryset):
+        """
+        ?department=<id> and ?question=<id>&answer=<text> (repeat answer to
+        accept several); answers match case-insensitively via PreVisitAnswer.
+        """
+        params = self.request.query_params
+        try:
+            department_id = int(params['department']) if 'department' in params else None
+            question_id = int(params['question']) if 'question' in params else None
+        except ValueError:
+            raise ValidationError({"error": "department and question must be integers"})
+        answers = params.getlist('answer')
+        if (question_id is None) != (not answers):
+            raise ValidationError({"error": "question and answer must be given together"})
+
+        if department_id is not None:
+            queryset = queryset.filter(doctor__doctor_profile__department_id=department_id)
+        if question_id is not None:
+            queryset = filter_by_answer(queryset, question_id, answers)
+        return queryset
+
+    def perform_create(self, serializer):
+        reserve_slot(serializer)
+
+    def perform_update(self, serializer):
+        reserve_slot(serializer)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply a list of operations in one transaction:
+        {"operations": [{"op": "create", "patient": 1, "doctor": 2, "time": "..."},
+                        {"op": "status", "id": 5, "status": "canceled"},
+                        {"op": "reschedule", "id": 6, "time": "..."}]}
+        Nothing is written unless every operation is valid.
+        """
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({"error": "operations must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > settings.APPOINTMENT_BATCH_MAX_SIZE:
+            return Response(
+                {"error": f"At most {settings.APPOINTMENT_BATCH_MAX_SIZE} operations per batch"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        ok, results = apply_batch(request.user, operations, self.get_queryset().select_related(None))
+        return Response({"results": results}, status=status.HTTP_200_OK if ok else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """
+        Status counts per ?group_by=day|week|doctor|department between the
+        ?start= and ?end= dates (inclusive), read from the daily statistics
+        table. Doctors only see their own appointments; patients have no access.
+        """
+        if request.user.role not in (User.Role.ADMIN, User.Role.DOCTOR):
+            return Response({"error": "Only doctors and admins can view appointment statistics"}, status=403)
+        group_by = request.query_params.get('group_by', 'day')
+        if group_by not in GROUPINGS:
+            return Response({"error": f"group_by must be one of: {', '.join(GROUPINGS)}"}, status=400)
+        first_day, last_day, error = _date_range(request, settings.APPOINTMENT_STATS_MAX_DAYS)
+        if error:
+            return error
+
+        doctor_id = request.user.id if request.user.role == User.Role.DOCTOR else None
+        return Response({
+            "group_by": group_by,
+            "start": first_day,
+            "end": last_day,
+            "statuses": STATUSES,
+            "results": status_counts(group_by, first_day, last_day, doctor_id=doctor_id),
+        }, status=200)
     
     @api_view(['GET'])
     def patient_appointments(request, patient_id=None):
@@ -136,26 +361,93 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
         # Doctors can only view appointments of their patients
         elif user.role == User.Role.DOCTOR:
-            appointments = Appointment.objects.filter(doctor=user)
+            appointments = Appointment.objects.filter(doctor_id=user.id)
 
         # Patients can only view their own appointments
         elif user.role == User.Role.PATIENT:
             if patient_id and patient_id != user.id:
                 return Response({"error": "You can only view your own appointments"}, status=403)
-            appointments = Appointment.objects.filter(patient=user)
+            appointments = Appointment.objects.filter(patient_id=user.id)
 
         else:
             return Response({"error": "Unauthorized access"}, status=403)
 
-        serializer = AppointmentSerializer(appointments, many=True)
+        serializer = AppointmentSerializer(
+            AppointmentSerializer.setup_eager_loading(appointments), many=True
+        )
         return Response(serializer.data, status=200)
 
     
     
 
-class LabReportViewSet(viewsets.ModelViewSet):
+class DailyStatsView(APIView):
+    """New patients and lab reports per type for each day between ?start= and ?end= (admins only)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.role != User.Role.ADMIN:
+            return Response({"error": "Only admins can view these statistics"}, status=403)
+        first_day, last_day, error = _date_range(request, settings.APPOINTMENT_STATS_MAX_DAYS)
+        if error:
+            return error
+        return Response({"start": first_day, "end": last_day, **daily_totals(first_day, last_day)}, status=200)
+
+
+class SearchView(APIView):
+    """
+    Ranked full-text search: ?q= (words, or "quoted phrases"), optional
+    ?type=previsit_report,lab_report, paginated with ?limit= and ?offset=.
+    Patients only find their own documents.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        expression = search.match_expression(request.query_params.get('q', ''))
+        if expression is None:
+            return Response({"error": "q is required"}, status=400)
+        kinds = [kind for kind in request.query_params.get('type', '').split(',') if kind]
+        if any(kind not in search.KINDS for kind in kinds):
+            return Response({"error": f"type must be one of: {', '.join(search.KINDS)}"}, status=400)
+        try:
+            limit = min(int(request.query_params.get('limit', settings.SEARCH_PAGE_SIZE)), settings.SEARCH_MAX_PAGE_SIZE)
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({"error": "limit and offset must be integers"}, status=400)
+        if limit < 1 or offset < 0:
+            return Response({"error": "limit must be positive and offset not negative"}, status=400)
+
+        patient_id = request.user.id if request.user.role == User.Role.PATIENT else None
+        # One extra row tells whether there is a next page without counting every match
+        results = search.search(expression, kinds=kinds, patient_id=patient_id, limit=limit + 1, offset=offset)
+        url = request.build_absolute_uri()
+        next_url = replace_query_param(url, 'offset', offset + limit) if len(results) > limit else None
+        if offset <= 0:
+            previous_url = None
+        elif offset <= limit:
+            previous_url = remove_query_param(url, 'offset')
+        else:
+            previous_url = replace_query_param(url, 'offset', offset - limit)
+        return Response({"next": next_url, "previous": previous_url, "results": results[:limit]}, status=200)
+
+
+class LabReportViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = LabReport.objects.all()
     serializer_class = LabReportSerializer
+    pagination_class = LabReportPagination
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def download(self, request, pk=None):
+        """
+        Stream the report file. Patients may only fetch their own reports;
+        supports Range requests and ETag/Last-Modified revalidation.
+        """
+        report = self.get_object()
+        user = request.user
+        if user.role == User.Role.PATIENT and report.patient.user_id != user.id:
+            return Response({"error": "You can only download your own lab reports"}, status=403)
+        if not report.report or not report.report.storage.exists(report.report.name):
+            return Response({"error": "Report file not found"}, status=404)
+        return serve_file(request, report.report)
 
     @api_view(['GET'])
     @permission_classes([IsAuthenticated])
@@ -181,28 +473,74 @@ class LabReportViewSet(viewsets.ModelViewSet):
     @api_view(['GET'])
     def get_patient_lab_reports(request, patient_id):
         """
-        Fetch all lab reports for a specific patient.
+        Fetch a page of lab reports for a specific patient.
         """
         try:
             reports = LabReport.objects.filter(patient_id=patient_id)  # Filter by patient_id
-            serializer = LabReportSerializer(reports, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            paginator = LabReportPagination()
+            page = paginator.paginate_queryset(reports, request)
+            serializer = LabReportSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         except LabReport.DoesNotExist:
             return Response({'detail': 'No lab reports found for this patient.'}, status=status.HTTP_404_NOT_FOUND)
 
-class PreVisitQuestionViewSet(viewsets.ModelViewSet):
+class LabReportUploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                             mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable upload protocol: POST a session, PUT each numbered chunk as a raw
+    body to chunks/<n>/, then POST finalize/ to verify the checksum and create
+    the LabReport. GET on the session lists the chunks already received.
+    """
+    queryset = LabReportUpload.objects.all()
+    serializer_class = LabReportUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return LabReportUpload.objects.filter(created_by_id=self.request.user.id)
+
+    def perform_create(self, serializer):
+        user = self.request.user
+        patient = serializer.validated_data['patient']
+        if user.role == User.Role.PATIENT and patient.user_id != user.id:
+            raise PermissionDenied("You can only upload your own lab reports")
+        serializer.save(created_by=user)
+
+    def perform_destroy(self, instance):
+        discard_files(instance)
+        instance.delete()
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<number>\d+)')
+    def chunk(self, request, pk=None, number=None):
+        upload = self.get_object()
+        try:
+            write_chunk(upload, int(number), request.stream or io.BytesIO())
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(upload).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            report = finalize_upload(upload)
+        except UploadError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(LabReportSerializer(report).data, status=status.HTTP_201_CREATED)
+
+class PreVisitQuestionViewSet(VersionedETagMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = PreVisitQuestion.objects.all()
     serializer_class = PreVisitQuestionSerializer
 
-class PreVisitReportViewSet(viewsets.ModelViewSet):
+class PreVisitReportViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = PreVisitReport.objects.all()
     serializer_class = PreVisitReportSerializer
+    permission_classes = [IsAuthenticated]
 
     lookup_field = 'appointment'  # this makes DRF use `appointment_id` as lookup
 
     def retrieve(self, request, appointment=None):
         try:
-            report = PreVisitReport.objects.get(appointment__id=appointment)
+            report = self.filter_queryset(self.get_queryset()).get(appointment__id=appointment)
             serializer = self.get_serializer(report)
             return Response(serializer.data)
         except PreVisitReport.DoesNotExist:
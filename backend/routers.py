@@ -0,0 +1,25 @@
+"""
+Read/write split for the production SQLite profile (see DATABASES in settings).
+
+Reads go to the read-only "replica" connection so they never queue behind a
+writer's transaction on the "default" connection. Reads made while "default"
+is inside a transaction stay there: uncommitted rows are only visible to the
+connection that wrote them.
+"""
+from django.db import connections
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # both aliases are the same database
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'rest_framework',
     'api',
@@ -82,7 +83,8 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework.authentication.SessionAuthentication",  # Enables API UI login
         # 'rest_framework.permissions.IsAuthenticated',  # Change if needed
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # simplejwt's JWTAuthentication plus token-version revocation (see api/authentication.py)
+        "api.authentication.VersionedJWTAuthentication",
     ),
 }
 
@@ -93,8 +95,89 @@ SIMPLE_JWT = {
     "BLACKLIST_AFTER_ROTATION": True,  # Blacklist old refresh tokens
     "AUTH_HEADER_TYPES": ("Bearer",),
     "TOKEN_USER_CLASS": "api.models.User",  # Update with your user model
+    # Blacklist checks and writes through api/revocation.py
+    "TOKEN_REFRESH_SERIALIZER": "api.revocation.RevocableTokenRefreshSerializer",
 }
 
+# Token versions (api/authentication.py), reference table versions and the
+# doctor directory (api/caching.py) and the revocation counter live in the
+# cache, and every worker must see the same values. Redis is the supported
+# shared cache: set REDIS_URL (needs the redis package). Without it each
+# process gets its own LocMemCache and those features fall back to the
+# database.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.environ["REDIS_URL"]},
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+
+# Build request.user from token claims on GET/HEAD/OPTIONS instead of loading
+# the User row. Token versions live in the (shared) cache, see CACHES.
+JWT_STATELESS_READS = os.environ.get("JWT_STATELESS_READS", "") == "1"
+
+# Answer "is this refresh token blacklisted" from a per-process Bloom filter,
+# querying the blacklist only on a possible hit (see api/revocation.py). New
+# revocations reach other workers through a cache counter, so this also needs
+# a shared cache backend.
+JWT_REVOCATION_FILTER = os.environ.get("JWT_REVOCATION_FILTER", "") == "1"
+JWT_REVOCATION_FILTER_ERROR_RATE = 0.001
+# Expired outstanding/blacklisted tokens are deleted at most this often (seconds)
+TOKEN_PRUNE_INTERVAL = 3600
+
+# Appointment slots
+APPOINTMENT_SLOT_MINUTES = 30
+# Used for doctors without WorkingHours rows: weekday (Monday=0) -> (start, end)
+DEFAULT_WORKING_HOURS = {
+    6: ("09:00", "17:00"),  # Sunday
+    0: ("09:00", "17:00"),
+    1: ("09:00", "17:00"),
+    2: ("09:00", "17:00"),
+    3: ("09:00", "17:00"),  # Thursday
+}
+FREE_SLOT_MAX_DAYS = 31
+APPOINTMENT_BATCH_MAX_SIZE = 500
+# Longest date range the appointment statistics endpoint aggregates over
+APPOINTMENT_STATS_MAX_DAYS = 731
+
+# Full-text search results per page (api/search.py)
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Lab report downloads (api/downloads.py). Set to "x-sendfile" (Apache) or
+# "x-accel-redirect" (nginx) to let the front server send the file bytes.
+LAB_REPORT_DOWNLOAD_OFFLOAD = os.environ.get("LAB_REPORT_DOWNLOAD_OFFLOAD") or None
+# nginx `internal` location that maps onto MEDIA_ROOT
+LAB_REPORT_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+
+# Doctor profile images (api/images.py)
+DOCTOR_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+DOCTOR_IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANTS_ASYNC = True  # render variants in a background thread after commit
+
+# Doctor directory response cache (api/caching.py); invalidated by signals.
+# Only used with a shared cache (see CACHES): a per-process one would keep
+# serving the old directory in every worker but the one that saw the change.
+DOCTOR_DIRECTORY_CACHE_ENABLED = True
+DOCTOR_DIRECTORY_CACHE_TIMEOUT = 60 * 60
+
+# Resumable lab report uploads (api/uploads.py)
+LAB_REPORT_UPLOAD_DIR = os.environ.get("LAB_REPORT_UPLOAD_DIR", BASE_DIR / "lab_report_uploads")
+LAB_REPORT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+LAB_REPORT_UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 * 1024
+LAB_REPORT_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+LAB_REPORT_UPLOAD_EXPIRY = timedelta(hours=24)  # idle sessions are purged after this
+
+# Latest lab reports nested in each patient profile; the rest are paged at
+# labreports/patient/<id>/ (see PatientProfileSerializer)
+PATIENT_PROFILE_LAB_REPORTS = 5
+
+# The admin patient import runs on the request thread without a hashing pool,
+# so it only takes small files; larger ones go through manage.py import_patients
+PATIENT_IMPORT_ADMIN_MAX_ROWS = 100
 
 # Allow requests from frontend
 CORS_ALLOWED_ORIGINS = [
@@ -131,13 +214,52 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+DATABASE_NAME = Path(os.environ.get("DATABASE_NAME", BASE_DIR / 'db.sqlite3'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': DATABASE_NAME,
+        # File-backed test database: the shared-cache in-memory default fails
+        # concurrent writers with "table is locked" instead of waiting, which
+        # the double-booking concurrency tests depend on.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# DATABASE_PROFILE=production tunes SQLite for concurrent traffic:
+# - WAL journal: readers never block the writer and vice versa
+# - busy_timeout and IMMEDIATE transactions: writers queue for the lock
+#   instead of failing with "database is locked"
+# - synchronous=NORMAL is durable in WAL mode except on power loss
+# - a larger page cache, memory-mapped reads, persistent connections
+# - a read-only "replica" connection that backend.routers sends reads to
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "development")
+SQLITE_READ_PRAGMAS = [
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -65536",  # KiB, so 64 MB per connection
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+SQLITE_WRITE_PRAGMAS = ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL", *SQLITE_READ_PRAGMAS]
+
+if DATABASE_PROFILE == "production":
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': "; ".join(SQLITE_WRITE_PRAGMAS), 'transaction_mode': 'IMMEDIATE'},
+    })
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # Same file opened read-only; WAL readers see every committed write at once
+        'NAME': f"{DATABASE_NAME.resolve().as_uri()}?mode=ro",
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'uri': True, 'init_command': "; ".join([*SQLITE_READ_PRAGMAS, "PRAGMA query_only = 1"])},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['backend.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
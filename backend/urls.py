@@ -14,10 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.static import serve
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,7 +32,14 @@ urlpatterns = [
 # Serve static files only in development
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Only the public doctor images; lab reports are served by api/labreports/<id>/download/,
+    # which checks who is asking
+    urlpatterns += [
+        re_path(
+            r'^%s(?P<path>doctor_images/.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+            serve, {'document_root': settings.MEDIA_ROOT},
+        ),
+    ]
 
     # TEMPORARY fix for local development
 if not settings.DEBUG: